@@ -1,7 +1,7 @@
 # Teste-bot-main/app.py
 
 import os
-from flask import Flask, request, render_template
+from flask import Flask, request, render_template, got_request_exception
 from flask_login import LoginManager, login_required
 from psycopg2.extras import RealDictCursor
 from models.user import User
@@ -13,13 +13,40 @@ from routes.edit_produtos import edit_produtos_bp
 from routes.ver_produtos import ver_produtos_bp
 from routes.ver_conversas import ver_conversas_bp
 from routes.gerenciar_vendas import gerenciar_vendas_bp
-from utils.db_utils import get_db_connection, get_conta_id_from_sid, get_bot_config, get_last_bot_message
+from routes.eventos_painel import eventos_painel_bp
+from utils.db_utils import get_db_connection, get_conta_id_from_sid, get_bot_config, get_last_bot_message, finalizar_conexao_requisicao, executar_apos_confirmar, confirmar_transacao_requisicao, marcar_erro_requisicao
 from utils.fluxo_vendas import adicionar_ao_carrinho
 import utils.view_handlers as views
-from utils.twilio_utils import send_text
+from utils.invalidacao import iniciar_ouvinte_invalidacao
+from utils.tarefas_importacao import iniciar_executor_importacoes
+from utils.idempotencia import deduplicador_webhook
+from utils.twilio_utils import send_text, iniciar_despacho
+from utils.diario_conversas import registar_conversa
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "uma_chave_secreta_muito_forte_e_dificil")
+# Corpo máximo de um pedido (uploads de imagens e de ficheiros de importação);
+# acima disto o Werkzeug responde 413 sem ler o resto.
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('UPLOAD_TAMANHO_MAXIMO', 50 * 1024 * 1024))
+
+# Uma conexão/transação por pedido: os helpers de utils.db_utils partilham-na
+# e ela é confirmada uma única vez antes de a resposta sair (um commit falhado
+# vira erro 500). Pedidos que terminam numa exceção não confirmam; o teardown
+# desfaz o que restar e devolve a conexão ao pool.
+app.after_request(confirmar_transacao_requisicao)
+got_request_exception.connect(marcar_erro_requisicao, app)
+app.teardown_request(finalizar_conexao_requisicao)
+
+# Cada worker ouve as invalidações de cache emitidas pelos outros (LISTEN/NOTIFY).
+# A thread é criada no primeiro pedido, já dentro do processo do worker.
+app.before_request(iniciar_ouvinte_invalidacao)
+
+# Idem para o executor de importações: ao arrancar no worker retoma as
+# importações deixadas a meio por um worker anterior, e continua a vigiá-las.
+app.before_request(iniciar_executor_importacoes)
+# E para o despachante de mensagens, cuja vigia retoma os envios do outbox
+# deixados por workers que morreram.
+app.before_request(iniciar_despacho)
 
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -49,6 +76,7 @@ app.register_blueprint(edit_produtos_bp, url_prefix="/edit_produtos")
 app.register_blueprint(ver_produtos_bp, url_prefix="/ver_produtos")
 app.register_blueprint(ver_conversas_bp, url_prefix="/ver_conversas")
 app.register_blueprint(gerenciar_vendas_bp, url_prefix='/gerenciar_vendas')
+app.register_blueprint(eventos_painel_bp, url_prefix='/eventos')
 
 @app.route("/whatsapp", methods=["POST"])
 def whatsapp_webhook():
@@ -59,6 +87,9 @@ def whatsapp_webhook():
     
     if not all([sender_number, to_number, account_sid]): return "OK", 200
 
+    # Reentregas da Twilio (mesmo MessageSid) são descartadas antes de qualquer outro trabalho
+    if deduplicador_webhook.ja_processada(form_data.get("MessageSid"), account_sid): return "OK", 200
+
     conta_id = get_conta_id_from_sid(account_sid)
     if not conta_id: return "OK", 200
 
@@ -76,6 +107,11 @@ def whatsapp_webhook():
     else:
         payload = None
 
+    # Mensagem recebida vai para o diário (gravado em lote, fora do pedido). Só
+    # depois do commit: se o pedido falhar, a Twilio reenvia e ela seria registada duas vezes.
+    mensagem_recebida = user_message_body or payload
+    executar_apos_confirmar(lambda: registar_conversa(conta_id, sender_number, mensagem_usuario=mensagem_recebida, lido=False))
+
     if payload:
         if payload == 'view_categories':
             views.send_categories_view(conta_id, sender_number, to_number)
@@ -88,6 +124,14 @@ def whatsapp_webhook():
         elif payload.startswith('category_'):
             category_name = payload.replace('category_', '')
             views.send_products_from_category_view(conta_id, sender_number, to_number, category_name)
+        elif payload.startswith('catpage_'):
+            # Navegação entre páginas da lista de produtos: catpage_<página>_<categoria>
+            partes = payload.split('_', 2)
+            if len(partes) == 3 and partes[1].isdigit() and partes[2]:
+                views.send_products_from_category_view(conta_id, sender_number, to_number, partes[2], int(partes[1]))
+            else:
+                # Payload malformado: ignorado, para a Twilio não repetir o webhook.
+                print(f"Aviso: payload de paginação inválido ignorado: {payload!r}")
     
     elif user_message_body:
         greetings = ["oi", "olá", "ola", "menu", "começar", "bom dia", "boa tarde", "boa noite"]
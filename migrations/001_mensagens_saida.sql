@@ -0,0 +1,21 @@
+-- Teste-bot-main/migrations/001_mensagens_saida.sql
+-- Outbox durável do despachante de mensagens (utils/despacho.py).
+-- Só é usado quando DESPACHO_OUTBOX=1.
+
+CREATE TABLE IF NOT EXISTS mensagens_saida (
+    id BIGSERIAL PRIMARY KEY,
+    conta_id INTEGER NOT NULL REFERENCES contas(id) ON DELETE CASCADE,
+    para TEXT NOT NULL,
+    de TEXT NOT NULL,
+    tipo TEXT NOT NULL,
+    parametros JSONB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pendente',
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    ultimo_erro TEXT,
+    criado_em TIMESTAMP NOT NULL DEFAULT NOW(),
+    atualizado_em TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_mensagens_saida_pendentes
+    ON mensagens_saida (atualizado_em)
+    WHERE status = 'pendente';
@@ -0,0 +1,13 @@
+-- Teste-bot-main/migrations/002_webhook_mensagens_processadas.sql
+-- Mensagens já processadas pelo webhook /whatsapp, para descartar as
+-- reentregas da Twilio (utils/idempotencia.py). Linhas antigas são apagadas
+-- periodicamente (WEBHOOK_DEDUP_TTL).
+
+CREATE TABLE IF NOT EXISTS webhook_mensagens_processadas (
+    message_sid TEXT PRIMARY KEY,
+    account_sid TEXT,
+    recebido_em TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_webhook_mensagens_processadas_recebido_em
+    ON webhook_mensagens_processadas (recebido_em);
@@ -0,0 +1,51 @@
+-- Teste-bot-main/migrations/003_itens_venda.sql
+-- Itens do carrinho/venda numa tabela própria, em vez da string
+-- 'produto_idxquantidade,...' em vendas.produtos_vendidos.
+-- vendas.valor_total passa a ser mantido pelo servidor (trigger).
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS itens_venda (
+    venda_id INTEGER NOT NULL REFERENCES vendas(id) ON DELETE CASCADE,
+    -- Sem FK para produtos: excluir um produto não pode apagar o histórico de vendas.
+    produto_id INTEGER NOT NULL,
+    quantidade INTEGER NOT NULL CHECK (quantidade > 0),
+    preco_unitario NUMERIC(10, 2) NOT NULL,
+    PRIMARY KEY (venda_id, produto_id)
+);
+
+-- Converte os carrinhos/vendas existentes. O preço unitário é o preço atual
+-- do produto (o histórico não guardava o preço por item); o valor_total já
+-- gravado em cada venda não é alterado, pois o trigger é criado depois.
+INSERT INTO itens_venda (venda_id, produto_id, quantidade, preco_unitario)
+SELECT v.id, split_part(item, 'x', 1)::INTEGER, SUM(split_part(item, 'x', 2)::INTEGER), COALESCE(MAX(p.preco), 0)
+FROM vendas v
+CROSS JOIN LATERAL unnest(string_to_array(v.produtos_vendidos, ',')) AS item
+LEFT JOIN produtos p ON p.id = split_part(item, 'x', 1)::INTEGER AND p.conta_id = v.conta_id
+WHERE item ~ '^[0-9]+x[0-9]+$' AND split_part(item, 'x', 2)::INTEGER > 0
+GROUP BY v.id, split_part(item, 'x', 1)::INTEGER
+ON CONFLICT (venda_id, produto_id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION atualizar_valor_total_venda() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE vendas SET valor_total = COALESCE(valor_total, 0) + NEW.quantidade * NEW.preco_unitario
+        WHERE id = NEW.venda_id;
+    ELSIF TG_OP = 'UPDATE' THEN
+        UPDATE vendas SET valor_total = COALESCE(valor_total, 0)
+            + NEW.quantidade * NEW.preco_unitario - OLD.quantidade * OLD.preco_unitario
+        WHERE id = NEW.venda_id;
+    ELSE
+        UPDATE vendas SET valor_total = COALESCE(valor_total, 0) - OLD.quantidade * OLD.preco_unitario
+        WHERE id = OLD.venda_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_itens_venda_valor_total ON itens_venda;
+CREATE TRIGGER trg_itens_venda_valor_total
+    AFTER INSERT OR UPDATE OR DELETE ON itens_venda
+    FOR EACH ROW EXECUTE FUNCTION atualizar_valor_total_venda();
+
+COMMIT;
@@ -0,0 +1,27 @@
+-- Teste-bot-main/migrations/004_vendas_carrinho_aberto_unico.sql
+-- No máximo um carrinho aberto por (conta_id, cliente_id). Permite ao
+-- adicionar_ao_carrinho usar INSERT ... ON CONFLICT em vez de "SELECT e
+-- depois INSERT", que sob toques simultâneos criava dois carrinhos.
+
+BEGIN;
+
+-- Junta os carrinhos abertos duplicados no mais antigo de cada cliente.
+CREATE TEMP TABLE carrinhos_duplicados ON COMMIT DROP AS
+SELECT id, manter FROM (
+    SELECT id, MIN(id) OVER (PARTITION BY conta_id, cliente_id) AS manter
+    FROM vendas WHERE status = 'aberto'
+) v WHERE id <> manter;
+
+INSERT INTO itens_venda (venda_id, produto_id, quantidade, preco_unitario)
+SELECT d.manter, i.produto_id, SUM(i.quantidade), MAX(i.preco_unitario)
+FROM itens_venda i JOIN carrinhos_duplicados d ON d.id = i.venda_id
+GROUP BY d.manter, i.produto_id
+ON CONFLICT (venda_id, produto_id) DO UPDATE SET quantidade = itens_venda.quantidade + EXCLUDED.quantidade;
+
+UPDATE vendas SET status = 'mesclado' WHERE id IN (SELECT id FROM carrinhos_duplicados);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_vendas_carrinho_aberto_unico
+    ON vendas (conta_id, cliente_id)
+    WHERE status = 'aberto';
+
+COMMIT;
@@ -0,0 +1,32 @@
+-- Teste-bot-main/migrations/005_contatos_resumo.sql
+-- Resumo por contacto para a caixa de entrada do painel (ver_conversas).
+-- É atualizado de forma incremental pelo diário de conversas (novas
+-- mensagens) e ao marcar mensagens como lidas, para que a lista de contactos
+-- não tenha de agregar todo o histórico de `conversas` a cada visita.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS contatos_resumo (
+    conta_id INTEGER NOT NULL,
+    contato TEXT NOT NULL,
+    total_mensagens INTEGER NOT NULL DEFAULT 0,
+    ultima_mensagem TIMESTAMP,
+    nao_lidas INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (conta_id, contato)
+);
+
+CREATE INDEX IF NOT EXISTS idx_contatos_resumo_ultima
+    ON contatos_resumo (conta_id, ultima_mensagem DESC);
+
+-- Carga inicial a partir do histórico existente.
+INSERT INTO contatos_resumo (conta_id, contato, total_mensagens, ultima_mensagem, nao_lidas)
+SELECT conta_id, contato, COUNT(*), MAX(data_hora), COUNT(*) FILTER (WHERE lido = FALSE)
+FROM conversas
+WHERE conta_id IS NOT NULL AND contato IS NOT NULL
+GROUP BY conta_id, contato
+ON CONFLICT (conta_id, contato) DO UPDATE SET
+    total_mensagens = EXCLUDED.total_mensagens,
+    ultima_mensagem = EXCLUDED.ultima_mensagem,
+    nao_lidas = EXCLUDED.nao_lidas;
+
+COMMIT;
@@ -0,0 +1,9 @@
+-- Teste-bot-main/migrations/006_conversas_historico_indice.sql
+-- Índice para a paginação por cursor do histórico de um contacto
+-- (ver_conversas.get_historico_contato): cada página é uma leitura de
+-- `limit` entradas a partir de (data_hora, id), sem ordenar o histórico todo.
+-- CONCURRENTLY para não bloquear as escritas em `conversas`; por isso este
+-- ficheiro não corre dentro de BEGIN/COMMIT.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_conversas_contato_historico
+    ON conversas (conta_id, contato, data_hora DESC, id DESC);
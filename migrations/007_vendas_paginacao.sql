@@ -0,0 +1,36 @@
+-- Teste-bot-main/migrations/007_vendas_paginacao.sql
+-- Suporte à API paginada do painel de vendas (gerenciar_vendas.api_vendas):
+--  * índice para listar as vendas de uma conta por status e data, página a
+--    página, sem ordenar todas as vendas da conta;
+--  * coluna atualizado_em, mantida por trigger, para o modo `since` (só as
+--    vendas alteradas desde a última consulta do painel).
+
+BEGIN;
+
+ALTER TABLE vendas ADD COLUMN IF NOT EXISTS atualizado_em TIMESTAMPTZ;
+UPDATE vendas SET atualizado_em = COALESCE(data_venda, NOW()) WHERE atualizado_em IS NULL;
+ALTER TABLE vendas ALTER COLUMN atualizado_em SET DEFAULT clock_timestamp();
+ALTER TABLE vendas ALTER COLUMN atualizado_em SET NOT NULL;
+
+-- clock_timestamp() e não now(): queremos a hora da alteração, não a do início
+-- da transação. A API só entrega alterações com alguns segundos de idade, para
+-- que uma transação ainda por confirmar não fique para trás do cursor.
+CREATE OR REPLACE FUNCTION vendas_marcar_atualizacao() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.atualizado_em := clock_timestamp();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS vendas_atualizado_em ON vendas;
+CREATE TRIGGER vendas_atualizado_em
+    BEFORE UPDATE ON vendas
+    FOR EACH ROW EXECUTE FUNCTION vendas_marcar_atualizacao();
+
+CREATE INDEX IF NOT EXISTS idx_vendas_conta_status_data
+    ON vendas (conta_id, status, data_venda DESC NULLS LAST, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_vendas_conta_atualizado
+    ON vendas (conta_id, atualizado_em, id);
+
+COMMIT;
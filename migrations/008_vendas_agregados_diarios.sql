@@ -0,0 +1,41 @@
+-- Teste-bot-main/migrations/008_vendas_agregados_diarios.sql
+-- Agregados diários de vendas por conta, para o painel de análise. São
+-- atualizados por finalizar_compra na mesma transação em que a venda é
+-- fechada (ver utils/agregados_vendas.py); esta migração carrega o histórico.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS vendas_diarias (
+    conta_id INTEGER NOT NULL,
+    dia DATE NOT NULL,
+    receita NUMERIC(12, 2) NOT NULL DEFAULT 0,
+    pedidos INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (conta_id, dia)
+);
+
+CREATE TABLE IF NOT EXISTS vendas_diarias_produtos (
+    conta_id INTEGER NOT NULL,
+    dia DATE NOT NULL,
+    produto_id INTEGER NOT NULL,
+    quantidade INTEGER NOT NULL DEFAULT 0,
+    receita NUMERIC(12, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (conta_id, dia, produto_id)
+);
+
+-- Carga inicial a partir das vendas já finalizadas (substitui o que existir).
+DELETE FROM vendas_diarias;
+DELETE FROM vendas_diarias_produtos;
+
+INSERT INTO vendas_diarias (conta_id, dia, receita, pedidos)
+SELECT conta_id, data_venda::date, COALESCE(SUM(valor_total), 0), COUNT(*)
+FROM vendas
+WHERE status = 'finalizado' AND data_venda IS NOT NULL
+GROUP BY conta_id, data_venda::date;
+
+INSERT INTO vendas_diarias_produtos (conta_id, dia, produto_id, quantidade, receita)
+SELECT v.conta_id, v.data_venda::date, i.produto_id, SUM(i.quantidade), SUM(i.quantidade * i.preco_unitario)
+FROM vendas v JOIN itens_venda i ON i.venda_id = v.id
+WHERE v.status = 'finalizado' AND v.data_venda IS NOT NULL
+GROUP BY v.conta_id, v.data_venda::date, i.produto_id;
+
+COMMIT;
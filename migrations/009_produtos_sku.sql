@@ -0,0 +1,17 @@
+-- Teste-bot-main/migrations/009_produtos_sku.sql
+-- Chave de importação dos produtos: a importação em massa (upload_csv)
+-- atualiza o produto com o mesmo SKU ou, para linhas sem SKU, com o mesmo
+-- nome, em vez de criar duplicados a cada reimportação.
+
+BEGIN;
+
+ALTER TABLE produtos ADD COLUMN IF NOT EXISTS sku VARCHAR(100);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_produtos_conta_sku
+    ON produtos (conta_id, sku)
+    WHERE sku IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_produtos_conta_nome
+    ON produtos (conta_id, lower(nome));
+
+COMMIT;
@@ -0,0 +1,33 @@
+-- Teste-bot-main/migrations/010_importacoes.sql
+-- Tarefas de importação do catálogo (upload_csv). O pedido só grava o ficheiro
+-- e cria a linha; a importação corre numa thread de fundo que vai atualizando
+-- o progresso aqui (ver utils/tarefas_importacao.py).
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS importacoes (
+    id SERIAL PRIMARY KEY,
+    conta_id INTEGER NOT NULL,
+    nome_ficheiro TEXT NOT NULL,
+    caminho TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pendente', -- pendente, em_curso, concluida, falhou
+    total_linhas INTEGER, -- estimativa, para a barra de progresso
+    linhas_processadas INTEGER NOT NULL DEFAULT 0,
+    inseridos INTEGER NOT NULL DEFAULT 0,
+    atualizados INTEGER NOT NULL DEFAULT 0,
+    total_erros INTEGER NOT NULL DEFAULT 0,
+    erros JSONB NOT NULL DEFAULT '[]', -- primeiras linhas com erro: [{"linha": n, "erro": "..."}]
+    mensagem_erro TEXT,
+    criado_em TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    atualizado_em TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    concluido_em TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_importacoes_conta
+    ON importacoes (conta_id, criado_em DESC);
+
+CREATE INDEX IF NOT EXISTS idx_importacoes_por_processar
+    ON importacoes (atualizado_em)
+    WHERE status IN ('pendente', 'em_curso');
+
+COMMIT;
@@ -0,0 +1,29 @@
+-- Teste-bot-main/migrations/011_produtos_imagem_hash.sql
+-- Hash do conteúdo da imagem de cada produto (SHA-256 em hex), mantido por
+-- trigger. As listagens (ver_produtos) passam a ler só esta coluna em vez do
+-- bytea, e a rota da imagem usa-a como ETag para responder 304 sem ler o blob.
+
+BEGIN;
+
+ALTER TABLE produtos ADD COLUMN IF NOT EXISTS imagem_hash VARCHAR(64);
+
+UPDATE produtos SET imagem_hash = encode(sha256(imagem), 'hex')
+WHERE imagem IS NOT NULL AND imagem_hash IS NULL;
+
+CREATE OR REPLACE FUNCTION produtos_calcular_imagem_hash() RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.imagem IS NULL THEN
+        NEW.imagem_hash := NULL;
+    ELSE
+        NEW.imagem_hash := encode(sha256(NEW.imagem), 'hex');
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS produtos_imagem_hash ON produtos;
+CREATE TRIGGER produtos_imagem_hash
+    BEFORE INSERT OR UPDATE OF imagem ON produtos
+    FOR EACH ROW EXECUTE FUNCTION produtos_calcular_imagem_hash();
+
+COMMIT;
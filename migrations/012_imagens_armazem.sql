@@ -0,0 +1,27 @@
+-- Teste-bot-main/migrations/012_imagens_armazem.sql
+-- As imagens dos produtos passam a viver no armazém de imagens (utils/imagens.py),
+-- endereçado pelo hash do conteúdo; produtos.imagem_hash é a referência e
+-- produtos.imagem fica NULL.
+--
+-- O trigger da 011 passa a calcular o hash só quando há bytea (escritas
+-- antigas); com imagem NULL mantém o imagem_hash que a aplicação gravou. Para
+-- remover a imagem de um produto, grave imagem_hash = NULL.
+--
+-- Depois desta migração, com IMAGENS_PASTA (ou IMAGENS_ARMAZEM) igual à da
+-- aplicação, mova os blobs existentes em dois passos:
+--     python -m utils.imagens copiar   -- grava as imagens no armazém
+--     python -m utils.imagens limpar   -- relê cada cópia e só então apaga o bytea
+-- (e, numa janela de manutenção, VACUUM FULL produtos para devolver o espaço).
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION produtos_calcular_imagem_hash() RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.imagem IS NOT NULL THEN
+        NEW.imagem_hash := encode(sha256(NEW.imagem), 'hex');
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMIT;
@@ -0,0 +1,30 @@
+-- Teste-bot-main/migrations/013_vendas_alteracoes_xid.sql
+-- Modo `since` da API de vendas ordenado pelo commit, e não pelo relógio.
+-- Cada venda guarda o id da transação que a alterou por último (alterado_xid).
+-- A API só entrega alterações de transações já terminadas, isto é, com xid
+-- abaixo do xmin do snapshot da consulta; o cursor avança até esse xmin. Uma
+-- transação lenta a confirmar já não é ultrapassada pelo cursor, seja qual for
+-- a sua duração (substitui a margem VENDAS_MARGEM_ALTERACOES da 007).
+-- Requer PostgreSQL 13+ (xid8, pg_current_xact_id).
+
+BEGIN;
+
+ALTER TABLE vendas ADD COLUMN IF NOT EXISTS alterado_xid xid8;
+UPDATE vendas SET alterado_xid = pg_current_xact_id() WHERE alterado_xid IS NULL;
+ALTER TABLE vendas ALTER COLUMN alterado_xid SET DEFAULT pg_current_xact_id();
+ALTER TABLE vendas ALTER COLUMN alterado_xid SET NOT NULL;
+
+CREATE OR REPLACE FUNCTION vendas_marcar_atualizacao() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.atualizado_em := clock_timestamp();
+    NEW.alterado_xid := pg_current_xact_id();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE INDEX IF NOT EXISTS idx_vendas_conta_alterado_xid
+    ON vendas (conta_id, alterado_xid, id);
+
+DROP INDEX IF EXISTS idx_vendas_conta_atualizado;
+
+COMMIT;
@@ -0,0 +1,11 @@
+-- Teste-bot-main/migrations/014_importacoes_reclamacao.sql
+-- Número da reclamação de cada importação: incrementado sempre que um worker a
+-- reclama (utils/tarefas_importacao.py). As escritas do worker (progresso,
+-- estado final) só se aplicam se a reclamação ainda for a sua; se a tarefa foi
+-- retomada por outro worker, o primeiro deixa de lhe mexer.
+
+BEGIN;
+
+ALTER TABLE importacoes ADD COLUMN IF NOT EXISTS reclamacao INTEGER NOT NULL DEFAULT 0;
+
+COMMIT;
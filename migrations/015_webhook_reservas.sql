@@ -0,0 +1,15 @@
+-- Teste-bot-main/migrations/015_webhook_reservas.sql
+-- A reclamação de um MessageSid passa a ser confirmada logo, numa transação
+-- própria, como uma reserva ('em_curso') com prazo; o pedido marca-a como
+-- 'concluida' na sua transação. Uma reentrega simultânea da Twilio vê a
+-- reserva e é descartada sem esperar pelo fim do primeiro pedido. Se o pedido
+-- falhar a reserva é libertada; se o worker morrer, expira em reservado_ate
+-- (ver utils/idempotencia.py).
+
+BEGIN;
+
+ALTER TABLE webhook_mensagens_processadas
+    ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'concluida', -- em_curso, concluida
+    ADD COLUMN IF NOT EXISTS reservado_ate TIMESTAMP;
+
+COMMIT;
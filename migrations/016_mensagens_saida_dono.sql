@@ -0,0 +1,23 @@
+-- Teste-bot-main/migrations/016_mensagens_saida_dono.sql
+-- Cada envio pendente do outbox pertence a um worker (dono) até reservado_ate.
+-- O worker renova periodicamente a reserva dos seus envios enquanto está vivo;
+-- a recuperação (utils/despacho.py) só retoma envios com a reserva expirada,
+-- isto é, de workers que morreram, e nunca os que ainda estão numa fila.
+
+BEGIN;
+
+ALTER TABLE mensagens_saida
+    ADD COLUMN IF NOT EXISTS dono TEXT,
+    ADD COLUMN IF NOT EXISTS reservado_ate TIMESTAMP NOT NULL DEFAULT NOW();
+
+CREATE INDEX IF NOT EXISTS idx_mensagens_saida_dono
+    ON mensagens_saida (dono)
+    WHERE status = 'pendente';
+
+CREATE INDEX IF NOT EXISTS idx_mensagens_saida_reserva
+    ON mensagens_saida (reservado_ate)
+    WHERE status = 'pendente';
+
+DROP INDEX IF EXISTS idx_mensagens_saida_pendentes;
+
+COMMIT;
@@ -1,6 +1,15 @@
-from flask import Blueprint, render_template, abort, flash, redirect, url_for, request
+from flask import Blueprint, render_template, abort, flash, redirect, url_for, request, jsonify
 from flask_login import login_required, current_user
-from utils.db_utils import get_db_connection
+from utils.db_utils import get_db_connection, estatisticas_pool
+from utils.despacho import estatisticas_despacho
+from utils.envio_lote import estatisticas_envio_lote
+from utils.diario_conversas import estatisticas_diario
+from utils.eventos_painel import estatisticas_eventos
+from utils.tarefas_importacao import estatisticas_importacoes
+from utils.idempotencia import deduplicador_webhook
+from utils.cache import estatisticas_caches
+from utils.invalidacao import notificar_invalidacao
+from utils.notificacoes_pg import obter_ouvinte
 from psycopg2.extras import RealDictCursor
 from datetime import datetime
 from werkzeug.security import generate_password_hash
@@ -214,6 +223,8 @@ def editar_cliente(conta_id):
                      return render_template('editar_cliente.html', cliente=cliente, utilizador=utilizador_principal)
 
 
+                # O SID e as credenciais da Twilio podem ter mudado: avisa todos os workers
+                notificar_invalidacao(conn, conta_id, 'conta')
                 conn.commit() # Salva as alterações
                 flash(f'Dados do cliente (Conta ID: {conta_id}) atualizados com sucesso!', 'success')
                 return redirect(url_for('admin_bp.ver_clientes')) # Redireciona de volta para a lista
@@ -275,6 +286,24 @@ def editar_cliente(conta_id):
     return render_template('editar_cliente.html', cliente=cliente, utilizador=utilizador_principal)
 
 
+# Rota com as métricas internas deste worker (pool de conexões, etc.)
+@admin_bp.route('/metricas')
+@requires_admin
+def metricas():
+    """Retorna em JSON as métricas de funcionamento do worker que atendeu o pedido."""
+    return jsonify({
+        'pool_conexoes': estatisticas_pool(),
+        'despacho': estatisticas_despacho(),
+        'envio_lote': estatisticas_envio_lote(),
+        'diario_conversas': estatisticas_diario(),
+        'eventos_painel': estatisticas_eventos(),
+        'importacoes': estatisticas_importacoes(),
+        'webhook_duplicados': deduplicador_webhook.estatisticas(),
+        'caches': estatisticas_caches(),
+        'ouvinte_postgres': obter_ouvinte().estatisticas(),
+    })
+
+
 # --- Rota de Logout para a Área Admin (opcional, pode usar o logout da área auth) ---
 # @admin_bp.route('/logout')
 # @requires_admin # Protege esta rota
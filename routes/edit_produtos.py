@@ -3,6 +3,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
 
 from utils.db_utils import get_db_connection
+from utils.invalidacao import notificar_invalidacao
 
 edit_produtos_bp = Blueprint('edit_produtos_bp', __name__, template_folder='../templates')
 
@@ -46,6 +47,7 @@ def editar_produto(produto_id):
                         (conta_id_logada, nome, descricao, preco, categoria, ativo)
                     )
                     new_id = cur.fetchone()[0]
+                    notificar_invalidacao(conn, conta_id_logada, 'catalogo', produto_id=new_id)
                     conn.commit()
                     flash(f'Produto "{nome}" adicionado com sucesso!', 'success')
                     return redirect(url_for('edit_produtos_bp.editar_produto', produto_id=new_id))
@@ -55,6 +57,7 @@ def editar_produto(produto_id):
                         "UPDATE produtos SET nome = %s, descricao = %s, preco = %s, categoria = %s, ativo = %s WHERE id = %s AND conta_id = %s",
                         (nome, descricao, preco, categoria, ativo, produto_id, conta_id_logada)
                     )
+                    notificar_invalidacao(conn, conta_id_logada, 'catalogo', produto_id=produto_id)
                     conn.commit()
                     if cur.rowcount == 0:
                         flash('Erro: Produto não encontrado ou não pertence à sua conta.', 'danger')
@@ -0,0 +1,35 @@
+# Teste-bot-main/routes/eventos_painel.py
+
+from flask import Blueprint, Response
+from flask_login import login_required, current_user
+
+from utils.eventos_painel import fluxo_eventos, obter_central_eventos
+
+eventos_painel_bp = Blueprint('eventos_painel_bp', __name__)
+
+@eventos_painel_bp.route('/')
+@login_required
+def eventos():
+    """
+    Ligação Server-Sent Events com as novidades da conta do utilizador logado:
+    novas vendas ('venda') e mensagens/contadores de não lidas ('contatos').
+    Responde 503 se o worker já tem SSE_MAX_LIGACOES ligações abertas.
+    """
+    # A conta é lida aqui: o gerador corre depois de o contexto do pedido terminar.
+    conta_id_logada = current_user.conta_id
+    central = obter_central_eventos()
+    if not central.reservar_ligacao():
+        # Worker no limite de ligações abertas: o EventSource desiste com o 503 e
+        # a página passa a consultar a API, tentando de novo mais tarde.
+        return Response("Demasiadas ligações em tempo real.", status=503, headers={'Retry-After': '60'})
+    try:
+        resposta = Response(
+            fluxo_eventos(conta_id_logada),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    except Exception:
+        central.libertar_ligacao()
+        raise
+    resposta.call_on_close(central.libertar_ligacao)
+    return resposta
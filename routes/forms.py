@@ -1,7 +1,10 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileAllowed
 from wtforms import FileField, SubmitField
 from wtforms.validators import DataRequired
 
 class UploadCSVForm(FlaskForm):
-    file = FileField('Arquivo CSV', validators=[DataRequired()])
+    file = FileField('Arquivo CSV ou Excel (.xlsx)', validators=[
+        DataRequired(), FileAllowed(['csv', 'xlsx'], 'Envie um ficheiro .csv ou .xlsx.')
+    ])
     submit = SubmitField('Enviar')
@@ -1,9 +1,13 @@
-from flask import Blueprint, render_template, jsonify
+from flask import Blueprint, render_template, jsonify, request
 # --- NOVOS IMPORTS ---
 from flask_login import login_required, current_user
 from psycopg2.extras import RealDictCursor
 from utils.db_utils import get_db_connection
-from datetime import datetime
+from utils.fluxo_vendas import buscar_itens_vendas, formatar_venda_painel
+from utils.agregados_vendas import obter_analise
+from utils.exportacao import resposta_exportacao
+from datetime import date, datetime, timedelta
+import os
 
 gerenciar_vendas_bp = Blueprint('gerenciar_vendas_bp', __name__, template_folder='../templates')
 
@@ -13,50 +17,155 @@ def gerenciar_vendas():
     """Renderiza a página do painel de gerenciamento de vendas."""
     return render_template('gerenciar_vendas.html')
 
+# Tamanho das páginas da API de vendas.
+VENDAS_POR_PAGINA = int(os.environ.get('VENDAS_POR_PAGINA', 50))
+VENDAS_MAX_POR_PAGINA = 500
+
+def _formatar_cursor(momento, venda_id):
+    return f"{momento.isoformat() if momento else ''}_{venda_id}"
+
+def _ler_cursor(cursor):
+    """Converte o cursor 'momento_id' em (datetime ou None, id); levanta ValueError se for inválido."""
+    momento, venda_id = cursor.rsplit('_', 1)
+    return (datetime.fromisoformat(momento) if momento else None), int(venda_id)
+
+# Cursor do modo `since`: 'xid_id' da última alteração entregue (ver migrations/013).
+def _formatar_cursor_alteracoes(xid, venda_id):
+    return f"{xid}_{venda_id}"
+
+def _ler_cursor_alteracoes(cursor):
+    xid, venda_id = cursor.split('_', 1)
+    return int(xid), int(venda_id)
+
+def _ler_data(valor):
+    return datetime.strptime(valor, '%Y-%m-%d') if valor else None
+
+def _filtros_vendas(conta_id, args):
+    """
+    Condições SQL (e parâmetros) dos filtros do painel de vendas: status (padrão
+    'finalizado'), cliente e intervalo de datas. Levanta ValueError se uma data
+    for inválida.
+    """
+    data_inicio = _ler_data(args.get('data_inicio'))
+    data_fim = _ler_data(args.get('data_fim'))
+    # A query filtra sempre pelo conta_id para garantir que um cliente não veja as vendas de outro.
+    filtros = ["conta_id = %s", "status = %s"]
+    params = [conta_id, args.get('status') or 'finalizado']
+    if args.get('cliente'):
+        filtros.append("cliente_id ILIKE %s")
+        params.append('%' + args['cliente'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+    if data_inicio:
+        filtros.append("data_venda >= %s")
+        params.append(data_inicio)
+    if data_fim:
+        filtros.append("data_venda < %s")
+        params.append(data_fim + timedelta(days=1))
+    return filtros, params
+
 @gerenciar_vendas_bp.route('/api/vendas')
 @login_required # Protege a API que fornece os dados das vendas
 def api_vendas():
     """
-    Fornece os dados das vendas finalizadas, mas apenas para
-    a conta do utilizador que está atualmente logado.
+    Fornece as vendas da conta do utilizador logado, página a página (as mais
+    recentes primeiro). Parâmetros opcionais:
+      - status (padrão 'finalizado'), cliente (parte do número), data_inicio e
+        data_fim (AAAA-MM-DD, inclusivas) e limit;
+      - before=<cursor>: a página seguinte da listagem;
+      - since=<cursor>: em vez da listagem, só as vendas alteradas depois do
+        cursor (o painel usa o `cursor_alteracoes` da resposta anterior), de
+        qualquer status; `corresponde_filtro` diz se cada uma ainda pertence à
+        listagem filtrada, para o painel a inserir ou retirar.
     """
     # Obtém o ID da conta a partir da sessão do utilizador.
     conta_id_logada = current_user.conta_id
+    args = request.args
+    try:
+        limite = min(max(int(args.get('limit', VENDAS_POR_PAGINA)), 1), VENDAS_MAX_POR_PAGINA)
+        antes = _ler_cursor(args['before']) if args.get('before') else None
+        desde = _ler_cursor_alteracoes(args['since']) if args.get('since') else None
+        filtros, params = _filtros_vendas(conta_id_logada, args)
+    except ValueError:
+        return jsonify({'error': 'Parâmetros inválidos'}), 400
+
     conn = None
-    
     try:
         conn = get_db_connection()
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # A query agora filtra as vendas pelo conta_id para garantir
-            # que um cliente não veja as vendas de outro.
-            cur.execute("""
-                SELECT
-                    id,
-                    data_venda,
-                    cliente_id, -- O ID do cliente (número de telefone)
-                    produtos_vendidos,
-                    valor_total,
-                    status
-                FROM
-                    vendas
-                WHERE
-                    status = 'finalizado' AND conta_id = %s
-                ORDER BY
-                    data_venda DESC
-            """, (conta_id_logada,))
-            
-            # RealDictCursor já retorna uma lista de dicionários,
-            # tornando o código mais limpo e seguro.
-            vendas = cur.fetchall()
+            if desde:
+                # Alterações pela ordem das transações, só as de transações já
+                # terminadas (xid abaixo do xmin do snapshot desta consulta): uma
+                # transação ainda aberta entra numa consulta seguinte, quando terminar.
+                cur.execute(f"""
+                    WITH limite AS (SELECT pg_snapshot_xmin(pg_current_snapshot()) AS xmin)
+                    SELECT v.id, v.data_venda, v.cliente_id, v.valor_total, v.status,
+                           v.alterado_xid::text::bigint AS alterado_xid,
+                           ({' AND '.join(filtros[1:])}) AS corresponde_filtro,
+                           limite.xmin::text::bigint AS xmin
+                    FROM vendas v CROSS JOIN limite
+                    WHERE v.conta_id = %s
+                      AND v.alterado_xid < limite.xmin
+                      AND (v.alterado_xid, v.id) > (%s::text::xid8, %s)
+                    ORDER BY v.alterado_xid, v.id
+                    LIMIT %s
+                """, params[1:] + [conta_id_logada, str(desde[0]), desde[1], limite + 1])
+                vendas = cur.fetchall()
+                tem_mais = len(vendas) > limite
+                vendas = vendas[:limite]
+                if tem_mais:
+                    cursor_alteracoes = _formatar_cursor_alteracoes(vendas[-1]['alterado_xid'], vendas[-1]['id'])
+                else:
+                    # Tudo o que terminou antes do xmin já foi entregue: o cursor salta para ele.
+                    if vendas:
+                        xmin = vendas[0]['xmin']
+                    else:
+                        cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint AS xmin")
+                        xmin = cur.fetchone()['xmin']
+                    cursor_alteracoes = args['since'] if xmin <= desde[0] else _formatar_cursor_alteracoes(xmin, 0)
+                proximo_cursor = None
+            else:
+                # Ponto de partida para o modo `since`, lido antes da listagem: as
+                # transações abaixo deste xmin já terminaram, logo estão na listagem.
+                cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint AS xmin")
+                cursor_alteracoes = _formatar_cursor_alteracoes(cur.fetchone()['xmin'], 0)
+
+                if antes:
+                    data_antes, id_antes = antes
+                    if data_antes is None:
+                        filtros.append("data_venda IS NULL AND id < %s")
+                        params.append(id_antes)
+                    else:
+                        filtros.append("((data_venda, id) < (%s, %s) OR data_venda IS NULL)")
+                        params.extend(antes)
+
+                cur.execute(f"""
+                    SELECT id, data_venda, cliente_id, valor_total, status
+                    FROM vendas
+                    WHERE {' AND '.join(filtros)}
+                    ORDER BY data_venda DESC NULLS LAST, id DESC
+                    LIMIT %s
+                """, params + [limite + 1])
+                vendas = cur.fetchall()
+                tem_mais = len(vendas) > limite
+                vendas = vendas[:limite]
+                proximo_cursor = _formatar_cursor(vendas[-1]['data_venda'], vendas[-1]['id']) if tem_mais else None
+
+            # Itens e nomes dos produtos das vendas da página em duas consultas (sem N+1).
+            itens_por_venda = buscar_itens_vendas(cur, conta_id_logada, [venda['id'] for venda in vendas])
             
             # Formata os dados para o frontend (datas e valores numéricos)
+            vendas_formatadas = []
             for venda in vendas:
-                if isinstance(venda['data_venda'], datetime):
-                    venda['data_venda'] = venda['data_venda'].strftime('%d/%m/%Y %H:%M')
-                if venda['valor_total'] is not None:
-                    venda['valor_total'] = f"{float(venda['valor_total']):.2f}"
-
-        return jsonify(vendas)
+                formatada = formatar_venda_painel(venda, itens_por_venda.get(venda['id'], []))
+                if desde:
+                    formatada['corresponde_filtro'] = venda['corresponde_filtro']
+                vendas_formatadas.append(formatada)
+            vendas = vendas_formatadas
+        return jsonify({
+            'vendas': vendas,
+            'proximo_cursor': proximo_cursor,
+            'cursor_alteracoes': cursor_alteracoes,
+            'tem_mais_alteracoes': bool(desde) and tem_mais,
+        })
         
     except Exception as e:
         print(f"Erro ao buscar vendas para a conta {conta_id_logada}: {e}")
@@ -65,3 +174,75 @@ def api_vendas():
         if conn:
             conn.close()
 
+@gerenciar_vendas_bp.route('/exportar')
+@login_required
+def exportar_vendas():
+    """
+    Descarrega as vendas da conta (com os mesmos filtros da listagem) em CSV ou,
+    com formato=xlsx, em Excel. O ficheiro é gerado em streaming.
+    """
+    conta_id_logada = current_user.conta_id
+    try:
+        filtros, params = _filtros_vendas(conta_id_logada, request.args)
+    except ValueError:
+        return jsonify({'error': 'Parâmetros inválidos'}), 400
+
+    query = f"""
+        SELECT vendas.id, vendas.data_venda, vendas.cliente_id, vendas.status, vendas.valor_total, itens.produtos
+        FROM vendas
+        LEFT JOIN LATERAL (
+            SELECT string_agg(i.quantidade || 'x ' || COALESCE(p.nome, 'Produto #' || i.produto_id), ', ' ORDER BY i.produto_id) AS produtos
+            FROM itens_venda i LEFT JOIN produtos p ON p.id = i.produto_id
+            WHERE i.venda_id = vendas.id
+        ) itens ON TRUE
+        WHERE {' AND '.join(filtros)}
+        ORDER BY vendas.data_venda DESC NULLS LAST, vendas.id DESC
+    """
+    cabecalho = ['ID Venda', 'Data/Hora', 'Cliente', 'Status', 'Valor Total', 'Produtos']
+    resposta = resposta_exportacao('vendas', request.args.get('formato'), cabecalho, query, params)
+    if resposta is None:
+        return jsonify({'error': 'Já há exportações em curso. Tente novamente dentro de instantes.'}), 429
+    return resposta
+
+# Período máximo (em dias) aceite pela análise de vendas.
+ANALISE_MAX_DIAS = 366
+
+@gerenciar_vendas_bp.route('/analise')
+@login_required
+def analise_vendas():
+    """Renderiza a página de análise de vendas (receita, pedidos e produtos mais vendidos)."""
+    return render_template('analise_vendas.html')
+
+@gerenciar_vendas_bp.route('/api/analise')
+@login_required
+def api_analise():
+    """
+    Receita por dia, número de pedidos, ticket médio e produtos mais vendidos
+    da conta logada entre data_inicio e data_fim (AAAA-MM-DD; por padrão os
+    últimos 30 dias). Lê só os agregados diários, nunca a tabela de vendas.
+    """
+    conta_id_logada = current_user.conta_id
+    try:
+        data_fim = _ler_data(request.args.get('data_fim'))
+        data_fim = data_fim.date() if data_fim else date.today()
+        data_inicio = _ler_data(request.args.get('data_inicio'))
+        data_inicio = data_inicio.date() if data_inicio else data_fim - timedelta(days=29)
+    except ValueError:
+        return jsonify({'error': 'Datas inválidas'}), 400
+    if data_inicio > data_fim or (data_fim - data_inicio).days >= ANALISE_MAX_DIAS:
+        return jsonify({'error': f'O período deve ter entre 1 e {ANALISE_MAX_DIAS} dias'}), 400
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            analise = obter_analise(cur, conta_id_logada, data_inicio, data_fim)
+        analise['data_inicio'] = data_inicio.isoformat()
+        analise['data_fim'] = data_fim.isoformat()
+        return jsonify(analise)
+    except Exception as e:
+        print(f"Erro ao calcular análise de vendas para a conta {conta_id_logada}: {e}")
+        return jsonify({'error': 'Erro ao carregar a análise de vendas', 'details': str(e)}), 500
+    finally:
+        if conn:
+            conn.close()
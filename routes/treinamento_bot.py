@@ -7,6 +7,7 @@ import json
 
 # ATUALIZADO: Importa a função que centraliza a lógica
 from utils.db_utils import get_db_connection, get_bot_config
+from utils.invalidacao import notificar_invalidacao
 
 treinamento_bot_bp = Blueprint('treinamento_bot_bp', __name__, template_folder='../templates')
 
@@ -77,6 +78,8 @@ def treinamento():
                     }
                 )
                 
+                # Todos os workers passam a usar a nova configuração assim que o commit for feito
+                notificar_invalidacao(conn, conta_id_logada, 'config')
                 conn.commit()
                 flash('Configurações salvas com sucesso!', 'success')
                 return redirect(url_for('treinamento_bot_bp.treinamento'))
@@ -1,74 +1,114 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from werkzeug.utils import secure_filename
 import os
-import pandas as pd
 
 # --- NOVOS IMPORTS ---
 from flask_login import login_required, current_user
-from utils.db_utils import get_db_connection
+from psycopg2.extras import RealDictCursor
+from utils.db_utils import get_db_connection, executar_apos_confirmar
+from utils.importacao_produtos import estimar_linhas
+from utils.tarefas_importacao import guardar_upload, submeter_importacao
 from .forms import UploadCSVForm
 
 upload_csv_bp = Blueprint('upload_csv_bp', __name__, template_folder='../templates')
 
+# Quantas importações recentes são listadas na página.
+IMPORTACOES_LISTADAS = 10
+
+_COLUNAS_IMPORTACAO = """
+    id, nome_ficheiro, status, total_linhas, linhas_processadas, inseridos, atualizados,
+    total_erros, erros, mensagem_erro, criado_em, concluido_em
+"""
+
+def _formatar_importacao(linha):
+    importacao = dict(linha)
+    for campo in ('criado_em', 'concluido_em'):
+        if importacao[campo]:
+            importacao[campo] = importacao[campo].isoformat()
+    return importacao
+
 @upload_csv_bp.route('/', methods=['GET', 'POST'])
 @login_required # Protege a rota, apenas utilizadores logados podem fazer upload.
 def upload_csv():
     """
-    Permite o upload de um CSV de produtos, associando todos os novos
-    produtos à conta do utilizador atualmente logado.
+    Permite o upload de um CSV ou XLSX de produtos, associando todos os novos
+    produtos à conta do utilizador atualmente logado. O ficheiro é gravado e a
+    importação corre em segundo plano (utils/tarefas_importacao.py); a página
+    acompanha o progresso pela rota `importacao`.
     """
     form = UploadCSVForm()
+    # Obtém o ID da conta a partir da sessão do utilizador logado.
+    conta_id_logada = current_user.conta_id
     if form.validate_on_submit():
-        # Obtém o ID da conta a partir da sessão do utilizador logado.
-        conta_id_logada = current_user.conta_id
-        
         file = form.file.data
-        filename = secure_filename(file.filename)
-        filepath = os.path.join('/tmp', filename) # Usa uma pasta temporária segura
-        file.save(filepath)
-        
+        filename = secure_filename(file.filename) or 'produtos.csv'
+        filepath = None
         conn = None
         try:
-            # Lê o ficheiro CSV com o pandas
-            df = pd.read_csv(filepath)
-            
-            # Conecta-se ao banco de dados para fazer a inserção
+            filepath = guardar_upload(file, filename)
             conn = get_db_connection()
             with conn.cursor() as cur:
-                # Itera sobre cada linha do ficheiro CSV
-                for _, row in df.iterrows():
-                    # A query de inserção agora inclui o 'conta_id'
-                    cur.execute(
-                        """
-                        INSERT INTO produtos (conta_id, nome, descricao, preco, categoria, ativo)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                        """,
-                        (
-                            conta_id_logada,
-                            row.get('nome'),
-                            row.get('descricao'),
-                            row.get('preco'),
-                            row.get('categoria'),
-                            True # Define o produto como ativo por padrão
-                        )
-                    )
-            conn.commit() # Salva todas as inserções no banco
-            flash(f'{len(df)} produtos importados com sucesso!', 'success')
-            
+                cur.execute(
+                    """
+                    INSERT INTO importacoes (conta_id, nome_ficheiro, caminho, total_linhas)
+                    VALUES (%s, %s, %s, %s) RETURNING id
+                    """,
+                    (conta_id_logada, file.filename or filename, filepath, estimar_linhas(filepath))
+                )
+                importacao_id = cur.fetchone()[0]
+            conn.commit()
+            # Só depois do commit: a thread de fundo tem de ver a linha da tarefa.
+            executar_apos_confirmar(lambda: submeter_importacao(importacao_id))
+            flash("Ficheiro recebido. A importação está a decorrer; o progresso aparece abaixo.", 'success')
         except Exception as e:
             if conn: conn.rollback() # Desfaz as alterações em caso de erro
-            flash(f"Ocorreu um erro ao processar o ficheiro: {e}", "danger")
+            if filepath and os.path.exists(filepath):
+                os.remove(filepath)
+            flash(f"Ocorreu um erro ao receber o ficheiro: {e}", "danger")
             print(f"Erro no upload de CSV para conta {conta_id_logada}: {e}")
         finally:
-            # Garante que a conexão seja fechada e o ficheiro temporário removido
             if conn:
                 conn.close()
-            if os.path.exists(filepath):
-                os.remove(filepath)
         
         # Redireciona de volta para a mesma página de upload
         return redirect(url_for('upload_csv_bp.upload_csv'))
-        
-    return render_template('upload_csv.html', form=form)
 
+    importacoes = []
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                f"SELECT {_COLUNAS_IMPORTACAO} FROM importacoes WHERE conta_id = %s ORDER BY criado_em DESC LIMIT %s",
+                (conta_id_logada, IMPORTACOES_LISTADAS)
+            )
+            importacoes = [_formatar_importacao(linha) for linha in cur.fetchall()]
+    except Exception as e:
+        print(f"Erro ao listar importações da conta {conta_id_logada}: {e}")
+    finally:
+        if conn:
+            conn.close()
+    return render_template('upload_csv.html', form=form, importacoes=importacoes)
 
+@upload_csv_bp.route('/importacoes/<int:importacao_id>')
+@login_required
+def importacao(importacao_id):
+    """Estado e progresso de uma importação da conta logada, em JSON."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                f"SELECT {_COLUNAS_IMPORTACAO} FROM importacoes WHERE id = %s AND conta_id = %s",
+                (importacao_id, current_user.conta_id)
+            )
+            linha = cur.fetchone()
+    except Exception as e:
+        print(f"Erro ao consultar importação {importacao_id}: {e}")
+        return jsonify({'erro': 'Erro ao consultar a importação'}), 500
+    finally:
+        if conn:
+            conn.close()
+    if not linha:
+        return jsonify({'erro': 'Importação não encontrada'}), 404
+    return jsonify(_formatar_importacao(linha))
@@ -4,58 +4,174 @@ from flask import Blueprint, render_template, jsonify, request
 from flask_login import login_required, current_user
 from psycopg2.extras import RealDictCursor
 import os
+from datetime import datetime, timedelta
 
 from utils.db_utils import get_db_connection, salvar_conversa
 from utils.twilio_utils import send_text
+from utils.eventos_painel import publicar_evento
+from utils.exportacao import resposta_exportacao
 
 ver_conversas_bp = Blueprint('ver_conversas_bp', __name__, template_folder='../templates')
 
+# Contactos por página da lista (a página e a consulta periódica do painel).
+CONTATOS_RECENTES = 50
+
+def _formatar_cursor_contato(contato):
+    return f"{contato['ultima_mensagem'].isoformat()}_{contato['contato']}"
+
+def _ler_cursor_contato(cursor):
+    """Converte o cursor 'ultima_mensagem_contato' em (datetime, contato); levanta ValueError se for inválido."""
+    ultima_mensagem, contato = cursor.split('_', 1)
+    return datetime.fromisoformat(ultima_mensagem), contato
+
+def _buscar_contatos(cur, conta_id, antes=None):
+    """
+    Uma página do resumo de contactos, do mais recente para trás. Retorna a
+    página e o cursor da seguinte (None se não houver mais).
+    """
+    # contatos_resumo é mantido pelo diário de conversas (ver utils/diario_conversas.py),
+    # então a lista não depende do tamanho do histórico.
+    query = """
+        SELECT contato, total_mensagens, ultima_mensagem, nao_lidas FROM contatos_resumo
+        WHERE conta_id = %s
+    """
+    params = [conta_id]
+    if antes:
+        query += " AND (ultima_mensagem, contato) < (%s, %s)"
+        params.extend(antes)
+    query += " ORDER BY ultima_mensagem DESC, contato DESC LIMIT %s"
+    params.append(CONTATOS_RECENTES + 1)
+    cur.execute(query, params)
+    pagina = cur.fetchall()
+    proximo_cursor = _formatar_cursor_contato(pagina[CONTATOS_RECENTES - 1]) if len(pagina) > CONTATOS_RECENTES else None
+    return pagina[:CONTATOS_RECENTES], proximo_cursor
+
 @ver_conversas_bp.route('/', methods=['GET'])
 @login_required
 def listar_contatos():
-    """Lista os contactos e o seu status para a conta do utilizador logado."""
+    """
+    Lista os contactos com mensagens mais recentes da conta do utilizador
+    logado; os restantes são pedidos a /api/contatos com o cursor da página.
+    """
     conta_id_logada = current_user.conta_id
     conn = get_db_connection()
     contatos_resumo = []
-    
-    query = """
-        SELECT c.contato, COUNT(c.id) as total_mensagens, MAX(c.data_hora) as ultima_mensagem,
-               SUM(CASE WHEN c.lido = FALSE THEN 1 ELSE 0 END) as nao_lidas, v.status_atendimento
-        FROM conversas c
-        LEFT JOIN vendas v ON c.contato = v.cliente_id AND v.status = 'aberto' AND v.conta_id = %s
-        WHERE c.conta_id = %s
-        GROUP BY c.contato, v.status_atendimento ORDER BY ultima_mensagem DESC;
-    """
+    proximo_cursor = None
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(query, (conta_id_logada, conta_id_logada))
-            contatos_resumo = cur.fetchall()
+            contatos_resumo, proximo_cursor = _buscar_contatos(cur, conta_id_logada)
     except Exception as e:
         print(f"Erro ao buscar resumo de contactos para conta {conta_id_logada}: {e}")
     finally:
         if conn: conn.close()
         
-    return render_template('ver_conversas_agrupado.html', contatos=contatos_resumo)
+    return render_template('ver_conversas_agrupado.html', contatos=contatos_resumo, proximo_cursor=proximo_cursor)
+
+@ver_conversas_bp.route('/api/contatos', methods=['GET'])
+@login_required
+def get_contatos_recentes():
+    """
+    Resumo dos contactos com mensagens mais recentes, no mesmo formato dos
+    eventos 'contatos'. Usado pelo painel quando o canal de eventos recusa a
+    ligação e, com `before=<cursor>`, para carregar as páginas seguintes da lista.
+    """
+    conta_id_logada = current_user.conta_id
+    try:
+        antes = _ler_cursor_contato(request.args['before']) if request.args.get('before') else None
+    except ValueError:
+        return jsonify({'error': 'Parâmetros de paginação inválidos'}), 400
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            pagina, proximo_cursor = _buscar_contatos(cur, conta_id_logada, antes)
+            contatos = [dict(linha, ultima_mensagem=linha['ultima_mensagem'].isoformat()) for linha in pagina]
+    except Exception as e:
+        print(f"Erro ao buscar contactos recentes para conta {conta_id_logada}: {e}")
+        return jsonify({"error": "Erro ao buscar contactos"}), 500
+    finally:
+        if conn: conn.close()
+    return jsonify({'contatos': contatos, 'proximo_cursor': proximo_cursor})
+
+# Tamanho das páginas do histórico (a mais recente primeiro).
+HISTORICO_POR_PAGINA = int(os.environ.get('HISTORICO_POR_PAGINA', 50))
+HISTORICO_MAX_POR_PAGINA = 200
+
+def _formatar_cursor(mensagem):
+    return f"{mensagem['data_hora'].isoformat()}_{mensagem['id']}"
+
+def _ler_cursor(cursor):
+    """Converte o cursor 'data_hora_id' em (datetime, id); levanta ValueError se for inválido."""
+    data_hora, id_mensagem = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(data_hora), int(id_mensagem)
 
 @ver_conversas_bp.route('/api/conversas/<path:contato>', methods=['GET'])
 @login_required
 def get_historico_contato(contato):
-    """Busca o histórico de um contacto e formata a data para JSON."""
+    """
+    Retorna uma página do histórico de um contacto, da mais recente para trás.
+    Com `before=<cursor>` devolve as mensagens anteriores a esse cursor. As
+    mensagens da página são marcadas como lidas.
+    """
     conta_id_logada = current_user.conta_id
+    try:
+        limite = min(max(int(request.args.get('limit', HISTORICO_POR_PAGINA)), 1), HISTORICO_MAX_POR_PAGINA)
+        antes = _ler_cursor(request.args['before']) if request.args.get('before') else None
+    except ValueError:
+        return jsonify({'error': 'Parâmetros de paginação inválidos'}), 400
+
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("UPDATE conversas SET lido = TRUE WHERE conta_id = %s AND contato = %s AND lido = FALSE", (conta_id_logada, contato))
-            query = "SELECT * FROM conversas WHERE conta_id = %s AND contato = %s ORDER BY data_hora ASC;"
-            cur.execute(query, (conta_id_logada, contato))
-            historico = cur.fetchall()
-            conn.commit()
-            
-            for mensagem in historico:
-                if mensagem.get('data_hora'):
-                    mensagem['data_hora'] = mensagem['data_hora'].isoformat()
-            
-            return jsonify(historico)
+            query = """
+                SELECT id, mensagem_usuario, resposta_bot, data_hora, lido FROM conversas
+                WHERE conta_id = %s AND contato = %s
+            """
+            params = [conta_id_logada, contato]
+            if antes:
+                query += " AND (data_hora, id) < (%s, %s)"
+                params.extend(antes)
+            query += " ORDER BY data_hora DESC, id DESC LIMIT %s"
+            params.append(limite + 1)
+            cur.execute(query, params)
+            pagina = cur.fetchall()
+
+            tem_mais = len(pagina) > limite
+            pagina = pagina[:limite]
+
+            # Marca como lidas só as mensagens desta página, e desconta-as do resumo do contacto.
+            nao_lidas = [mensagem['id'] for mensagem in pagina if not mensagem['lido']]
+            if nao_lidas:
+                cur.execute(
+                    """
+                    WITH lidas AS (
+                        UPDATE conversas SET lido = TRUE
+                        WHERE conta_id = %s AND id = ANY(%s) AND lido = FALSE
+                        RETURNING 1
+                    )
+                    UPDATE contatos_resumo SET nao_lidas = GREATEST(nao_lidas - (SELECT COUNT(*) FROM lidas), 0)
+                    WHERE conta_id = %s AND contato = %s
+                    RETURNING nao_lidas
+                    """,
+                    (conta_id_logada, nao_lidas, conta_id_logada, contato)
+                )
+                resumo = cur.fetchone()
+                if resumo:
+                    # Outros painéis abertos da conta atualizam o contador de não lidas.
+                    publicar_evento(cur, conta_id_logada, 'contatos', [{'contato': contato, 'nao_lidas': resumo['nao_lidas']}])
+                conn.commit()
+
+            proximo_cursor = _formatar_cursor(pagina[-1]) if tem_mais else None
+            mensagens = []
+            for mensagem in reversed(pagina):
+                mensagens.append({
+                    'id': mensagem['id'],
+                    'mensagem_usuario': mensagem['mensagem_usuario'],
+                    'resposta_bot': mensagem['resposta_bot'],
+                    'data_hora': mensagem['data_hora'].isoformat() if mensagem['data_hora'] else None,
+                })
+
+            return jsonify({'mensagens': mensagens, 'proximo_cursor': proximo_cursor})
     except Exception as e:
         if conn: conn.rollback()
         print(f"ERRO CRÍTICO em get_historico_contato para {contato}: {e}")
@@ -82,7 +198,7 @@ def responder_cliente():
         if not from_number:
             raise ValueError("A variável de ambiente TWILIO_WHATSAPP_NUMBER não está configurada.")
 
-        send_text(to_number=contato, from_number=from_number, body=mensagem, conta_id=conta_id_logada)
+        send_text(to_number=contato, from_number=from_number, body=mensagem, conta_id=conta_id_logada, registar=False)
         
         resposta_formatada = f"[ATENDENTE]: {mensagem}"
         salvar_conversa(conta_id_logada, contato, "--- RESPOSTA MANUAL DO PAINEL ---", resposta_formatada)
@@ -92,3 +208,38 @@ def responder_cliente():
         return jsonify({'error': str(e)}), 500
 
 
+
+@ver_conversas_bp.route('/exportar', methods=['GET'])
+@login_required
+def exportar_conversas():
+    """
+    Descarrega as conversas da conta em CSV ou, com formato=xlsx, em Excel. Aceita
+    os filtros opcionais contato, data_inicio e data_fim (AAAA-MM-DD, inclusivas).
+    O ficheiro é gerado em streaming.
+    """
+    conta_id_logada = current_user.conta_id
+    filtros = ["conta_id = %s"]
+    params = [conta_id_logada]
+    try:
+        if request.args.get('contato'):
+            filtros.append("contato = %s")
+            params.append(request.args['contato'])
+        if request.args.get('data_inicio'):
+            filtros.append("data_hora >= %s")
+            params.append(datetime.strptime(request.args['data_inicio'], '%Y-%m-%d'))
+        if request.args.get('data_fim'):
+            filtros.append("data_hora < %s")
+            params.append(datetime.strptime(request.args['data_fim'], '%Y-%m-%d') + timedelta(days=1))
+    except ValueError:
+        return jsonify({'error': 'Datas inválidas'}), 400
+
+    query = f"""
+        SELECT data_hora, contato, mensagem_usuario, resposta_bot, lido FROM conversas
+        WHERE {' AND '.join(filtros)}
+        ORDER BY data_hora, id
+    """
+    cabecalho = ['Data/Hora', 'Contato', 'Mensagem do cliente', 'Resposta', 'Lida']
+    resposta = resposta_exportacao('conversas', request.args.get('formato'), cabecalho, query, params)
+    if resposta is None:
+        return jsonify({'error': 'Já há exportações em curso. Tente novamente dentro de instantes.'}), 429
+    return resposta
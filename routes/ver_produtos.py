@@ -1,8 +1,10 @@
-from flask import Blueprint, render_template, request, jsonify, Response
+from flask import Blueprint, render_template, request, jsonify, Response, url_for
 # --- NOVOS IMPORTS ---
 from flask_login import login_required, current_user
 
 from utils.db_utils import get_db_connection
+from utils.invalidacao import notificar_invalidacao
+from utils.imagens import IMAGENS_TAMANHO_MAXIMO, detetar_tipo_imagem, escolher_largura, etag_imagem, guardar_imagem, ler_imagem
 
 ver_produtos_bp = Blueprint('ver_produtos_bp', __name__, template_folder='../templates')
 
@@ -24,7 +26,8 @@ def ver_produtos():
             categorias_unicas = [row[0] for row in cur.fetchall()]
 
             # A query principal agora filtra os produtos pelo conta_id.
-            query = "SELECT id, nome, preco, descricao, categoria, imagem, ativo FROM produtos WHERE conta_id = %s"
+            # Só o hash da imagem (NULL se não tem): o bytea é servido à parte por imagem_produto.
+            query = "SELECT id, nome, preco, descricao, categoria, imagem_hash, ativo FROM produtos WHERE conta_id = %s"
             params = [conta_id_logada]
 
             if nome_filtro:
@@ -55,6 +58,7 @@ def excluir_produto(produto_id):
         with conn.cursor() as cur:
             # Adicionamos a verificação do conta_id para segurança.
             cur.execute("DELETE FROM produtos WHERE id = %s AND conta_id = %s", (produto_id, conta_id_logada))
+            notificar_invalidacao(conn, conta_id_logada, 'catalogo', produto_id=produto_id)
             conn.commit()
             # Verificamos se alguma linha foi realmente apagada.
             if cur.rowcount == 0:
@@ -85,6 +89,7 @@ def editar_produto_inline():
                 "UPDATE produtos SET nome = %s, preco = %s, descricao = %s, categoria = %s, ativo = %s WHERE id = %s AND conta_id = %s",
                 (data['nome'], data['preco'], data['descricao'], data['categoria'], data['ativo'], produto_id, conta_id_logada)
             )
+            notificar_invalidacao(conn, conta_id_logada, 'catalogo', produto_id=produto_id)
             conn.commit()
             if cur.rowcount == 0:
                  return jsonify({'success': False, 'message': 'Erro: Produto não encontrado ou não pertence à sua conta.'}), 404
@@ -99,19 +104,39 @@ def editar_produto_inline():
 @ver_produtos_bp.route('/imagem/<int:produto_id>')
 @login_required
 def imagem_produto(produto_id):
-    """Serve a imagem de um produto, garantindo que pertence à conta logada."""
+    """
+    Serve a imagem de um produto, garantindo que pertence à conta logada.
+    `?largura=N` serve a menor miniatura com pelo menos N px (ou o original).
+    O ETag é o hash do conteúdo (mais a largura): se o navegador já tem esta
+    versão, responde 304 sem ler a imagem. Com `?v=<hash>` (como nas
+    listagens) o URL muda sempre que a imagem muda, por isso pode ficar em
+    cache indefinidamente.
+    """
     conta_id_logada = current_user.conta_id
+    largura = escolher_largura(request.args.get('largura', type=int))
     conn = None
     try:
         conn = get_db_connection()
         with conn.cursor() as cur:
             # Adicionamos a verificação do conta_id para a segurança dos dados.
-            cur.execute("SELECT imagem FROM produtos WHERE id = %s AND conta_id = %s", (produto_id, conta_id_logada))
+            cur.execute("SELECT imagem_hash FROM produtos WHERE id = %s AND conta_id = %s", (produto_id, conta_id_logada))
             result = cur.fetchone()
-            if result and result[0]:
-                return Response(result[0], mimetype='image/jpeg')
-            else:
+            if not result or not result[0]:
                 return "Imagem não encontrada", 404
+            imagem_hash = result[0]
+
+            etag = etag_imagem(imagem_hash, largura)
+            if request.if_none_match.contains(etag):
+                return _resposta_imagem(Response(status=304), etag, imagem_hash)
+
+            dados, _ = ler_imagem(imagem_hash, largura)
+            if dados is None:
+                # Produto ainda não migrado para o armazém (ver utils/imagens.py).
+                cur.execute("SELECT imagem FROM produtos WHERE id = %s AND conta_id = %s", (produto_id, conta_id_logada))
+                result = cur.fetchone()
+                if not result or result[0] is None:
+                    return "Imagem não encontrada", 404
+                dados = bytes(result[0])
     except Exception as e:
         print(f"Erro ao buscar imagem {produto_id} da conta {conta_id_logada}: {e}")
         return "Erro ao buscar imagem", 500
@@ -119,3 +144,59 @@ def imagem_produto(produto_id):
         if conn:
             conn.close()
 
+    resposta = Response(dados, mimetype=detetar_tipo_imagem(dados))
+    resposta.headers['X-Content-Type-Options'] = 'nosniff'
+    return _resposta_imagem(resposta, etag, imagem_hash)
+
+def _resposta_imagem(resposta, etag, imagem_hash):
+    resposta.set_etag(etag)
+    # private: a imagem só é servida a utilizadores da conta.
+    if request.args.get('v') == imagem_hash:
+        resposta.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    else:
+        resposta.headers['Cache-Control'] = 'private, no-cache'
+    return resposta
+
+@ver_produtos_bp.route('/imagem/<int:produto_id>', methods=['POST'])
+@login_required
+def enviar_imagem_produto(produto_id):
+    """
+    Recebe a imagem de um produto da conta logada (campo `imagem`). O original
+    e as miniaturas vão para o armazém de imagens; o produto guarda só o hash.
+    """
+    conta_id_logada = current_user.conta_id
+    ficheiro = request.files.get('imagem')
+    if not ficheiro:
+        return jsonify({'success': False, 'message': 'Nenhuma imagem enviada.'}), 400
+    try:
+        # Lê no máximo um byte além do limite: chega para validar_imagem
+        # recusar o ficheiro sem o carregar inteiro em memória.
+        imagem_hash = guardar_imagem(ficheiro.stream.read(IMAGENS_TAMANHO_MAXIMO + 1))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        print(f"Erro ao guardar imagem do produto {produto_id} da conta {conta_id_logada}: {e}")
+        return jsonify({'success': False, 'message': 'Erro ao guardar a imagem.'}), 500
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE produtos SET imagem = NULL, imagem_hash = %s WHERE id = %s AND conta_id = %s",
+                (imagem_hash, produto_id, conta_id_logada)
+            )
+            conn.commit()
+            if cur.rowcount == 0:
+                return jsonify({'success': False, 'message': 'Erro: Produto não encontrado ou não pertence à sua conta.'}), 404
+    except Exception as e:
+        print(f"Erro ao associar imagem ao produto {produto_id} da conta {conta_id_logada}: {e}")
+        return jsonify({'success': False, 'message': f'Erro ao guardar a imagem: {e}'}), 500
+    finally:
+        if conn:
+            conn.close()
+    return jsonify({
+        'success': True,
+        'message': 'Imagem atualizada com sucesso!',
+        'url': url_for('ver_produtos_bp.imagem_produto', produto_id=produto_id, v=imagem_hash, largura=160),
+    })
@@ -0,0 +1,7 @@
+# Teste-bot-main/tests/conftest.py
+# Os testes importam os módulos da aplicação (utils, routes) a partir da raiz do projeto.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
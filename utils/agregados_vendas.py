@@ -0,0 +1,102 @@
+# Teste-bot-main/utils/agregados_vendas.py
+#
+# Agregados diários de vendas por conta (tabelas vendas_diarias e
+# vendas_diarias_produtos). São atualizados de forma incremental quando uma
+# venda é finalizada, para que o painel de análise nunca tenha de percorrer a
+# tabela de vendas.
+
+from datetime import timedelta
+from psycopg2.extras import execute_values
+
+def registar_venda_finalizada(cur, conta_id, venda, itens):
+    """
+    Soma uma venda finalizada aos agregados do dia. Deve ser chamada na mesma
+    transação que a finaliza, para que os agregados nunca divirjam das vendas.
+    `venda` precisa de data_venda e valor_total; `itens` vem de buscar_itens_vendas.
+    """
+    dia = venda['data_venda'].date()
+    cur.execute(
+        """
+        INSERT INTO vendas_diarias (conta_id, dia, receita, pedidos) VALUES (%s, %s, %s, 1)
+        ON CONFLICT (conta_id, dia) DO UPDATE SET
+            receita = vendas_diarias.receita + EXCLUDED.receita,
+            pedidos = vendas_diarias.pedidos + 1
+        """,
+        (conta_id, dia, venda['valor_total'] or 0)
+    )
+    if itens:
+        execute_values(
+            cur,
+            """
+            INSERT INTO vendas_diarias_produtos (conta_id, dia, produto_id, quantidade, receita) VALUES %s
+            ON CONFLICT (conta_id, dia, produto_id) DO UPDATE SET
+                quantidade = vendas_diarias_produtos.quantidade + EXCLUDED.quantidade,
+                receita = vendas_diarias_produtos.receita + EXCLUDED.receita
+            """,
+            [
+                (conta_id, dia, item['produto_id'], item['quantidade'], item['quantidade'] * item['preco_unitario'])
+                for item in sorted(itens, key=lambda item: item['produto_id'])
+            ]
+        )
+
+def _ticket_medio(receita, pedidos):
+    return round(receita / pedidos, 2) if pedidos else 0.0
+
+def obter_analise(cur, conta_id, data_inicio, data_fim, limite_produtos=10):
+    """
+    Receita e pedidos por dia, totais, ticket médio e produtos mais vendidos
+    entre data_inicio e data_fim (datas inclusivas), lidos só dos agregados.
+    `cur` deve ser um RealDictCursor. Os dias sem vendas aparecem com zeros.
+    """
+    cur.execute(
+        """
+        SELECT dia, receita, pedidos FROM vendas_diarias
+        WHERE conta_id = %s AND dia BETWEEN %s AND %s
+        """,
+        (conta_id, data_inicio, data_fim)
+    )
+    por_dia = {linha['dia']: (float(linha['receita']), linha['pedidos']) for linha in cur.fetchall()}
+
+    dias = []
+    dia = data_inicio
+    while dia <= data_fim:
+        receita, pedidos = por_dia.get(dia, (0.0, 0))
+        dias.append({'dia': dia.isoformat(), 'receita': round(receita, 2), 'pedidos': pedidos, 'ticket_medio': _ticket_medio(receita, pedidos)})
+        dia += timedelta(days=1)
+
+    receita_total = sum(receita for receita, _ in por_dia.values())
+    pedidos_total = sum(pedidos for _, pedidos in por_dia.values())
+
+    cur.execute(
+        """
+        SELECT produto_id, SUM(quantidade) AS quantidade, SUM(receita) AS receita
+        FROM vendas_diarias_produtos
+        WHERE conta_id = %s AND dia BETWEEN %s AND %s
+        GROUP BY produto_id
+        ORDER BY SUM(receita) DESC, produto_id
+        LIMIT %s
+        """,
+        (conta_id, data_inicio, data_fim, limite_produtos)
+    )
+    top = cur.fetchall()
+    # Importado aqui porque fluxo_vendas importa este módulo (finalizar_compra).
+    from .fluxo_vendas import buscar_produtos
+    nomes = buscar_produtos(cur, conta_id, [linha['produto_id'] for linha in top])
+
+    return {
+        'por_dia': dias,
+        'totais': {
+            'receita': round(receita_total, 2),
+            'pedidos': pedidos_total,
+            'ticket_medio': _ticket_medio(receita_total, pedidos_total),
+        },
+        'top_produtos': [
+            {
+                'produto_id': linha['produto_id'],
+                'nome': nomes[linha['produto_id']][0] if linha['produto_id'] in nomes else f"Produto #{linha['produto_id']}",
+                'quantidade': int(linha['quantidade']),
+                'receita': round(float(linha['receita']), 2),
+            }
+            for linha in top
+        ],
+    }
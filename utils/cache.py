@@ -0,0 +1,76 @@
+# Teste-bot-main/utils/cache.py
+
+import time
+import threading
+
+# Valor retornado por CacheTTL.obter() quando a chave não está em cache (ou expirou).
+AUSENTE = object()
+
+_caches = {}
+
+class CacheTTL:
+    """
+    Cache em memória do processo, com tempo de vida por entrada e invalidação
+    explícita. Cada worker do gunicorn tem a sua própria cópia.
+    """
+
+    def __init__(self, nome, ttl):
+        self.nome = nome
+        self.ttl = ttl
+        self._dados = {}
+        self._lock = threading.Lock()
+        self._stats = {'acertos': 0, 'falhas': 0, 'invalidacoes': 0}
+        _caches[nome] = self
+
+    def obter(self, chave):
+        """Retorna o valor em cache ou AUSENTE."""
+        agora = time.monotonic()
+        with self._lock:
+            entrada = self._dados.get(chave)
+            if entrada is not None and entrada[1] > agora:
+                self._stats['acertos'] += 1
+                return entrada[0]
+            if entrada is not None:
+                del self._dados[chave]
+            self._stats['falhas'] += 1
+            return AUSENTE
+
+    def guardar(self, chave, valor, ttl=None):
+        expira_em = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._dados[chave] = (valor, expira_em)
+
+    def invalidar(self, chave):
+        with self._lock:
+            if self._dados.pop(chave, None) is not None:
+                self._stats['invalidacoes'] += 1
+
+    def invalidar_onde(self, predicado):
+        """Remove todas as entradas para as quais `predicado(chave, valor)` é verdadeiro."""
+        with self._lock:
+            chaves = [chave for chave, (valor, _) in self._dados.items() if predicado(chave, valor)]
+            for chave in chaves:
+                del self._dados[chave]
+            self._stats['invalidacoes'] += len(chaves)
+
+    def limpar(self):
+        with self._lock:
+            self._stats['invalidacoes'] += len(self._dados)
+            self._dados.clear()
+
+    def estatisticas(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['itens'] = len(self._dados)
+        consultas = stats['acertos'] + stats['falhas']
+        stats['taxa_acerto'] = round(stats['acertos'] / consultas, 3) if consultas else 0.0
+        return stats
+
+def estatisticas_caches():
+    """Estatísticas de todos os caches criados neste processo."""
+    return {nome: cache.estatisticas() for nome, cache in _caches.items()}
+
+def limpar_caches():
+    """Esvazia todos os caches do processo (ex.: após perder notificações de invalidação)."""
+    for cache in _caches.values():
+        cache.limpar()
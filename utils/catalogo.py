@@ -0,0 +1,150 @@
+# Teste-bot-main/utils/catalogo.py
+
+import os
+import threading
+from collections import namedtuple
+
+from .cache import CacheTTL, AUSENTE
+from .db_utils import get_db_connection
+
+# Representação compacta (imutável) de um produto ativo no catálogo do bot.
+Produto = namedtuple('Produto', ['id', 'nome', 'preco', 'descricao', 'categoria'])
+
+class SnapshotCatalogo:
+    """
+    Foto imutável do catálogo ativo de uma conta: categorias e produtos por
+    categoria, já ordenados. Cada alteração gera uma nova foto com versão + 1,
+    para que leituras em curso nunca vejam um catálogo a meio de ser alterado.
+    """
+
+    __slots__ = ('versao', 'produtos', 'categorias', 'por_categoria')
+
+    def __init__(self, versao, produtos):
+        self.versao = versao
+        self.produtos = produtos
+        por_categoria = {}
+        nomes_categoria = {}
+        for produto in sorted(produtos.values(), key=_ordem_produto):
+            chave = produto.categoria.lower()
+            por_categoria.setdefault(chave, []).append(produto)
+            nomes_categoria.setdefault(produto.categoria, None)
+        self.por_categoria = {chave: tuple(lista) for chave, lista in por_categoria.items()}
+        self.categorias = tuple(sorted(nomes_categoria, key=_ordem_texto))
+
+    def com_alteracoes(self, alterados, removidos):
+        """Nova foto com os produtos `alterados` substituídos e os `removidos` retirados."""
+        produtos = dict(self.produtos)
+        for produto_id in removidos:
+            produtos.pop(produto_id, None)
+        produtos.update(alterados)
+        return SnapshotCatalogo(self.versao + 1, produtos)
+
+def _ordem_texto(texto):
+    return (texto.casefold(), texto)
+
+def _ordem_produto(produto):
+    return (_ordem_texto(produto.nome), produto.id)
+
+_SELECT_PRODUTOS = """
+    SELECT id, nome, preco, descricao, categoria FROM produtos
+    WHERE conta_id = %s AND ativo = TRUE AND categoria IS NOT NULL AND categoria != ''
+"""
+
+def _carregar_produtos(conta_id, ids=None):
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            if ids is None:
+                cur.execute(_SELECT_PRODUTOS, (conta_id,))
+            else:
+                cur.execute(_SELECT_PRODUTOS + " AND id = ANY(%s)", (conta_id, list(ids)))
+            produtos = {}
+            for row in cur.fetchall():
+                # Um produto sem preço não pode ser vendido pelo bot; fica fora
+                # da foto (e sai dela se o preço foi apagado) em vez de falhar
+                # o carregamento do catálogo inteiro.
+                if row[2] is None:
+                    print(f"Aviso: produto {row[0]} da conta {conta_id} sem preço, ignorado no catálogo")
+                    continue
+                produtos[row[0]] = Produto(row[0], row[1], float(row[2]), row[3], row[4])
+            return produtos
+    finally:
+        if conn: conn.close()
+
+# Fotos por conta_id. O TTL é só uma rede de segurança: as alterações chegam
+# pelo barramento de invalidação (ver utils/invalidacao.py).
+_snapshots = CacheTTL('catalogo', ttl=int(os.environ.get('CATALOGO_TTL', 3600)))
+_pendentes = {}
+_lock = threading.Lock()
+# Um lock por conta serializa a reconstrução da foto: sem ele, duas threads
+# partiam da mesma foto base e a última a guardar perdia as alterações da outra.
+_locks_conta = {}
+_RECONSTRUIR = object()
+
+def _lock_da_conta(conta_id):
+    with _lock:
+        return _locks_conta.setdefault(conta_id, threading.Lock())
+
+def _devolver_pendentes(conta_id, pendentes):
+    """Repõe invalidações que não chegaram a ser aplicadas (ex.: falha ao ler a base)."""
+    with _lock:
+        atuais = _pendentes.get(conta_id)
+        if pendentes is _RECONSTRUIR or atuais is _RECONSTRUIR:
+            _pendentes[conta_id] = _RECONSTRUIR
+        else:
+            _pendentes[conta_id] = (atuais or set()) | pendentes
+
+def obter_catalogo(conta_id):
+    """
+    Retorna a foto atual do catálogo da conta. É construída na primeira leitura;
+    depois, só os produtos alterados desde a última leitura são recarregados.
+    """
+    with _lock:
+        sem_pendentes = conta_id not in _pendentes
+    if sem_pendentes:
+        snapshot = _snapshots.obter(conta_id)
+        if snapshot is not AUSENTE:
+            return snapshot
+
+    with _lock_da_conta(conta_id):
+        with _lock:
+            pendentes = _pendentes.pop(conta_id, None)
+        snapshot = _snapshots.obter(conta_id)
+        try:
+            if snapshot is AUSENTE or pendentes is _RECONSTRUIR:
+                versao = 1 if snapshot is AUSENTE else snapshot.versao + 1
+                snapshot = SnapshotCatalogo(versao, _carregar_produtos(conta_id))
+                _snapshots.guardar(conta_id, snapshot)
+            elif pendentes:
+                alterados = _carregar_produtos(conta_id, pendentes)
+                snapshot = snapshot.com_alteracoes(alterados, pendentes - alterados.keys())
+                _snapshots.guardar(conta_id, snapshot)
+        except Exception:
+            if pendentes:
+                _devolver_pendentes(conta_id, pendentes)
+            raise
+    return snapshot
+
+def invalidar_catalogo(conta_id, produto_id=None):
+    """
+    Marca o catálogo da conta como alterado. Com `produto_id`, só esse produto é
+    recarregado na próxima leitura; sem ele (ex.: importação em massa), o
+    catálogo inteiro é reconstruído.
+    """
+    with _lock:
+        if conta_id is None:
+            _pendentes.clear()
+            _snapshots.limpar()
+            return
+        if produto_id is None or _pendentes.get(conta_id) is _RECONSTRUIR:
+            _pendentes[conta_id] = _RECONSTRUIR
+        else:
+            _pendentes.setdefault(conta_id, set()).add(int(produto_id))
+
+def listar_categorias(conta_id):
+    """Categorias com produtos ativos da conta, ordenadas."""
+    return obter_catalogo(conta_id).categorias
+
+def listar_produtos_categoria(conta_id, categoria):
+    """Produtos ativos de uma categoria (sem diferenciar maiúsculas), ordenados por nome."""
+    return obter_catalogo(conta_id).por_categoria.get(categoria.lower(), ())
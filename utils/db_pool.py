@@ -0,0 +1,215 @@
+# Teste-bot-main/utils/db_pool.py
+
+import os
+import threading
+import time
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2 import extensions, OperationalError, InterfaceError
+
+class ConexaoPool:
+    """
+    Envolve uma conexão emprestada do pool. Comporta-se como uma conexão
+    psycopg2 normal, mas `close()` devolve a conexão ao pool em vez de a fechar,
+    para que o código existente (`conn.close()` no `finally`) continue igual.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, nome):
+        if self._conn is None:
+            raise InterfaceError("Conexão já devolvida ao pool.")
+        return getattr(self._conn, nome)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    @property
+    def closed(self):
+        return self._conn is None or self._conn.closed
+
+    @property
+    def conexao_real(self):
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.devolver(conn)
+
+class PoolConexoes:
+    """
+    Pool de conexões PostgreSQL de um processo (um por worker do gunicorn).
+    Mantém até `maxconn` conexões abertas, com tempo máximo de espera por uma
+    conexão livre, verificação de saúde das conexões paradas e estatísticas.
+    """
+
+    def __init__(self, minconn, maxconn, timeout_checkout, verificar_apos, **parametros_conexao):
+        self.maxconn = maxconn
+        self.timeout_checkout = timeout_checkout
+        self.verificar_apos = verificar_apos
+        self._parametros_conexao = parametros_conexao
+        self._vagas = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._livres = []
+        self._abertas = 0
+        self._ultimo_uso = {}
+        self._stats = {
+            'emprestimos': 0,
+            'timeouts': 0,
+            'descartadas': 0,
+            'em_uso': 0,
+            'espera_total_ms': 0.0,
+            'espera_max_ms': 0.0,
+        }
+        for _ in range(minconn):
+            self._livres.append(self._nova_conexao())
+
+    def obter(self):
+        """Empresta uma conexão, esperando no máximo `timeout_checkout` segundos."""
+        inicio = time.monotonic()
+        if not self._vagas.acquire(timeout=self.timeout_checkout):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise pg_pool.PoolError(
+                f"Nenhuma conexão livre no pool após {self.timeout_checkout}s (máximo: {self.maxconn})."
+            )
+        try:
+            conn = self._obter_conexao_saudavel()
+        except Exception:
+            self._vagas.release()
+            raise
+
+        espera_ms = (time.monotonic() - inicio) * 1000
+        with self._lock:
+            self._stats['emprestimos'] += 1
+            self._stats['em_uso'] += 1
+            self._stats['espera_total_ms'] += espera_ms
+            self._stats['espera_max_ms'] = max(self._stats['espera_max_ms'], espera_ms)
+        return ConexaoPool(self, conn)
+
+    def _nova_conexao(self):
+        conn = psycopg2.connect(**self._parametros_conexao)
+        self._ultimo_uso[id(conn)] = time.monotonic()
+        with self._lock:
+            self._abertas += 1
+        return conn
+
+    def _obter_conexao_saudavel(self):
+        """Pega uma conexão livre (ou abre uma nova), descartando as que caíram enquanto estavam paradas."""
+        while True:
+            with self._lock:
+                conn = self._livres.pop() if self._livres else None
+            if conn is None:
+                return self._nova_conexao()
+            if not conn.closed and self._esta_saudavel(conn):
+                return conn
+            self._descartar(conn)
+
+    def _esta_saudavel(self, conn):
+        parada_ha = time.monotonic() - self._ultimo_uso.get(id(conn), 0)
+        if parada_ha < self.verificar_apos:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (OperationalError, InterfaceError):
+            return False
+
+    def _descartar(self, conn):
+        with self._lock:
+            self._stats['descartadas'] += 1
+            self._abertas -= 1
+        self._ultimo_uso.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception as e:
+            print(f"Erro ao descartar conexão do pool: {e}")
+
+    def devolver(self, conn):
+        """Devolve a conexão ao pool, desfazendo qualquer transação deixada aberta."""
+        try:
+            if conn.closed:
+                self._descartar(conn)
+                return
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except (OperationalError, InterfaceError):
+                self._descartar(conn)
+                return
+            self._ultimo_uso[id(conn)] = time.monotonic()
+            with self._lock:
+                self._livres.append(conn)
+        finally:
+            with self._lock:
+                self._stats['em_uso'] -= 1
+            self._vagas.release()
+
+    def estatisticas(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['livres'] = len(self._livres)
+            stats['abertas'] = self._abertas
+        stats['tamanho_maximo'] = self.maxconn
+        stats['espera_media_ms'] = round(stats['espera_total_ms'] / stats['emprestimos'], 2) if stats['emprestimos'] else 0.0
+        return stats
+
+    def fechar(self):
+        """Fecha as conexões livres (usado no encerramento do worker)."""
+        with self._lock:
+            livres, self._livres = self._livres, []
+        for conn in livres:
+            self._descartar(conn)
+
+def parametros_conexao():
+    """Parâmetros de ligação ao PostgreSQL, lidos das variáveis de ambiente."""
+    return {
+        'host': os.environ.get('DB_HOST'),
+        'database': os.environ.get('DB_NAME'),
+        'user': os.environ.get('DB_USER'),
+        'password': os.environ.get('DB_PASSWORD'),
+        'port': os.environ.get('DB_PORT', 5432),
+        'connect_timeout': int(os.environ.get('DB_CONNECT_TIMEOUT', 5)),
+    }
+
+def tamanho_pool_padrao():
+    """
+    Tamanho do pool quando DB_POOL_MAX não está definido: uma conexão por
+    thread de pedidos do worker (GUNICORN_THREADS, como no Procfile) mais
+    algumas para as threads de fundo (diário, importações, exportações).
+    """
+    return int(os.environ.get('GUNICORN_THREADS', 16)) + 4
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def obter_pool():
+    """
+    Retorna o pool do processo atual, criando-o na primeira utilização.
+    O PID é verificado para que cada worker do gunicorn tenha o seu próprio pool
+    (conexões não podem ser partilhadas entre processos após um fork).
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = PoolConexoes(
+                    minconn=int(os.environ.get('DB_POOL_MIN', 1)),
+                    maxconn=int(os.environ.get('DB_POOL_MAX', tamanho_pool_padrao())),
+                    timeout_checkout=float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+                    verificar_apos=float(os.environ.get('DB_POOL_VERIFICAR_APOS', 30)),
+                    **parametros_conexao()
+                )
+                _pool_pid = pid
+    return _pool
@@ -1,62 +1,262 @@
 # Teste-bot-main/utils/db_utils.py
 
-import psycopg2
 import os
-from datetime import datetime
+from flask import g, has_request_context, session, jsonify, Response
+from psycopg2 import extensions
 from psycopg2.extras import RealDictCursor
 import json
 
+from .db_pool import obter_pool
+from .cache import CacheTTL, AUSENTE
+
+class ConexaoRequisicao:
+    """
+    Conexão única partilhada por todos os helpers chamados durante um pedido HTTP.
+    `commit()` apenas marca um savepoint e `close()` não devolve a conexão:
+    a transação é confirmada uma única vez antes de a resposta sair
+    (confirmar_transacao_requisicao) ou desfeita no teardown do pedido.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.confirmar = False
+
+    def __getattr__(self, nome):
+        return getattr(self._conn, nome)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    @property
+    def closed(self):
+        return self._conn.closed
+
+    def _status(self):
+        return self._conn.get_transaction_status()
+
+    def commit(self):
+        # O trabalho confirmado até aqui fica protegido por um savepoint, para que
+        # um rollback posterior de outro helper não o desfaça.
+        if self._status() == extensions.TRANSACTION_STATUS_INTRANS:
+            with self._conn.cursor() as cur:
+                cur.execute("SAVEPOINT unidade_trabalho")
+            self.confirmar = True
+
+    def rollback(self):
+        if self.confirmar and self._status() != extensions.TRANSACTION_STATUS_IDLE:
+            with self._conn.cursor() as cur:
+                cur.execute("ROLLBACK TO SAVEPOINT unidade_trabalho")
+        else:
+            self._conn.rollback()
+
+    def close(self):
+        # Um helper que apanhou um erro de SQL deixa a transação abortada;
+        # desfazemos aqui para que os próximos helpers do pedido possam continuar.
+        if not self._conn.closed and self._status() == extensions.TRANSACTION_STATUS_INERROR:
+            self.rollback()
+
+def obter_conexao_isolada():
+    """
+    Empresta uma conexão própria do pool, fora da unidade de trabalho do pedido.
+    Deve ser usada por threads de fundo e respostas em streaming; o chamador
+    faz `commit()` e `close()` normalmente.
+    """
+    return obter_pool().obter()
+
 def get_db_connection():
-    """Estabelece e retorna uma conexão com o banco de dados PostgreSQL."""
-    return psycopg2.connect(
-        host=os.environ.get('DB_HOST'),
-        database=os.environ.get('DB_NAME'),
-        user=os.environ.get('DB_USER'),
-        password=os.environ.get('DB_PASSWORD'),
-        port=os.environ.get('DB_PORT', 5432)
-    )
+    """
+    Retorna a conexão a usar pelo chamador. Dentro de um pedido HTTP é a conexão
+    da unidade de trabalho do pedido (guardada em `g`); fora dele, uma conexão
+    emprestada do pool. Em ambos os casos o `conn.close()` dos chamadores é seguro.
+    """
+    if not has_request_context():
+        return obter_conexao_isolada()
+    conn = g.get('_conexao_requisicao')
+    if conn is None:
+        conn = ConexaoRequisicao(obter_conexao_isolada())
+        g._conexao_requisicao = conn
+    return conn
+
+def executar_apos_confirmar(funcao):
+    """
+    Agenda `funcao` para depois de a transação do pedido ser confirmada (por ex.
+    invalidar um cache só quando o novo valor já está visível para os outros).
+    Fora de um pedido, executa de imediato.
+    """
+    if has_request_context() and g.get('_conexao_requisicao') is not None:
+        g.setdefault('_apos_confirmar', []).append(funcao)
+    else:
+        funcao()
+
+def executar_apos_desfazer(funcao):
+    """
+    Agenda `funcao` para o caso de a transação do pedido não ser confirmada
+    (por ex. libertar uma reserva feita numa conexão isolada). Fora de um
+    pedido não faz nada: quem chama trata o seu próprio erro.
+    """
+    if has_request_context() and g.get('_conexao_requisicao') is not None:
+        g.setdefault('_apos_desfazer', []).append(funcao)
+
+def _confirmar(conn):
+    # Descarta o que foi feito depois do último commit() de um helper, tal como
+    # acontecia quando cada helper fechava a sua conexão, e confirma o resto.
+    conn.rollback()
+    conn._conn.commit()
+    conn.confirmar = False
+
+def marcar_erro_requisicao(remetente, exception=None, **extra):
+    """Sinal got_request_exception: o pedido falhou e a sua transação não é confirmada."""
+    g._erro_requisicao = True
+
+def _resposta_erro_gravacao(resposta):
+    # A mensagem de sucesso que a vista possa ter deixado já não é verdadeira.
+    session.pop('_flashes', None)
+    mensagem = 'Erro ao gravar os dados. Tente novamente.'
+    if resposta.is_json:
+        erro = jsonify({'error': mensagem})
+        erro.status_code = 500
+        return erro
+    return Response(mensagem, status=500, mimetype='text/plain')
+
+def confirmar_transacao_requisicao(resposta):
+    """
+    after_request: confirma a transação do pedido antes de a resposta sair, para
+    que o cliente só receba o sucesso (redirect, flash, 200) do que ficou
+    gravado e os bloqueios sejam libertados sem esperar pelo corpo da resposta.
+    Se o commit falhar, a resposta passa a ser um erro 500.
+    """
+    conn = g.get('_conexao_requisicao')
+    if conn is None or g.get('_erro_requisicao') or conn._conn.closed or not conn.confirmar:
+        return resposta
+    try:
+        _confirmar(conn)
+        g._transacao_confirmada = True
+    except Exception as e:
+        print(f"Erro ao confirmar a transação do pedido: {e}")
+        g._erro_requisicao = True
+        return _resposta_erro_gravacao(resposta)
+    return resposta
+
+def finalizar_conexao_requisicao(exc=None):
+    """
+    Teardown do pedido: normalmente a transação já foi confirmada antes da
+    resposta (confirmar_transacao_requisicao); aqui confirma o que ainda falte
+    se não houve exceção, ou desfaz tudo. Depois devolve a conexão ao pool e
+    corre as ações pós-commit.
+    """
+    conn = g.pop('_conexao_requisicao', None)
+    pendentes = g.pop('_apos_confirmar', [])
+    desfeitos = g.pop('_apos_desfazer', [])
+    if conn is None:
+        return
+    real = conn._conn
+    falhou = exc is not None or g.get('_erro_requisicao', False)
+    confirmado = g.get('_transacao_confirmada', False)
+    try:
+        if real.closed:
+            return
+        if not falhou and conn.confirmar:
+            # Descarta o que foi feito depois do último commit() de um helper,
+            # tal como acontecia quando cada helper fechava a sua conexão.
+            _confirmar(conn)
+            confirmado = True
+        else:
+            real.rollback()
+            # Pedido sem erro que não confirmou nada: as ações pós-commit (ex.:
+            # envios) não dependem de nenhuma escrita e seguem na mesma.
+            confirmado = confirmado or not falhou
+    except Exception as e:
+        confirmado = False
+        print(f"Erro ao finalizar a transação do pedido: {e}")
+    finally:
+        real.close()
+
+    for funcao in (pendentes if confirmado else desfeitos):
+        try:
+            funcao()
+        except Exception as e:
+            print(f"Erro numa ação pós-{'commit' if confirmado else 'rollback'} do pedido: {e}")
+
+def estatisticas_pool():
+    """Retorna as estatísticas do pool de conexões deste worker."""
+    return obter_pool().estatisticas()
+
+# Resolução AccountSid -> conta_id e configuração do bot já processada, por conta.
+# Só mudam quando o admin edita um cliente ou o lojista grava o /treinamento,
+# e esses pontos invalidam as entradas (ver invalidar_cache_conta).
+_cache_contas_por_sid = CacheTTL('contas_por_sid', ttl=int(os.environ.get('CONFIG_CACHE_TTL', 300)))
+_cache_config_bot = CacheTTL('config_bot', ttl=int(os.environ.get('CONFIG_CACHE_TTL', 300)))
 
 def get_conta_id_from_sid(account_sid):
     """Descobre a qual 'conta' um SID de subconta da Twilio pertence."""
+    conta_id = _cache_contas_por_sid.obter(account_sid)
+    if conta_id is not AUSENTE:
+        return conta_id
+
     conn = None
     try:
         conn = get_db_connection()
         with conn.cursor() as cur:
             cur.execute("SELECT id FROM contas WHERE twilio_subaccount_sid = %s LIMIT 1", (account_sid,))
             result = cur.fetchone()
-            return result[0] if result else None
+            conta_id = result[0] if result else None
     except Exception as e:
         print(f"ERRO CRÍTICO em get_conta_id_from_sid: {e}")
         return None
     finally:
         if conn: conn.close()
 
+    # SIDs desconhecidos ficam em cache por pouco tempo, para não martelar o banco.
+    _cache_contas_por_sid.guardar(account_sid, conta_id, ttl=None if conta_id else 30)
+    return conta_id
+
+def _copiar_config(config):
+    """Cópia rasa da configuração em cache, para que os chamadores possam alterá-la."""
+    copia = dict(config)
+    copia['faq_list'] = list(config['faq_list'])
+    return copia
+
 def get_bot_config(conta_id):
     """Busca as configurações do bot para uma conta específica."""
-    conn = None
-    try:
-        conn = get_db_connection()
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM configuracoes_bot WHERE conta_id = %s", (conta_id,))
-            config = cur.fetchone()
-
+    config = _cache_config_bot.obter(conta_id)
+    if config is not AUSENTE:
         if config:
-            try:
-                faq_data = config.get('faq_conhecimento')
-                if isinstance(faq_data, str):
-                     config['faq_list'] = json.loads(faq_data)
-                elif isinstance(faq_data, list):
-                     config['faq_list'] = faq_data
-                else:
-                     config['faq_list'] = []
-            except (json.JSONDecodeError, TypeError):
-                config['faq_list'] = []
-            return config
-            
-    except Exception as e:
-        print(f"Erro ao buscar configurações do bot para conta {conta_id}: {e}")
-    finally:
-        if conn: conn.close()
+            return _copiar_config(config)
+    else:
+        conn = None
+        try:
+            conn = get_db_connection()
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("SELECT * FROM configuracoes_bot WHERE conta_id = %s", (conta_id,))
+                config = cur.fetchone()
+
+            if config:
+                config = dict(config)
+                try:
+                    faq_data = config.get('faq_conhecimento')
+                    if isinstance(faq_data, str):
+                         config['faq_list'] = json.loads(faq_data)
+                    elif isinstance(faq_data, list):
+                         config['faq_list'] = faq_data
+                    else:
+                         config['faq_list'] = []
+                except (json.JSONDecodeError, TypeError):
+                    config['faq_list'] = []
+            _cache_config_bot.guardar(conta_id, config)
+            if config:
+                return _copiar_config(config)
+                
+        except Exception as e:
+            print(f"Erro ao buscar configurações do bot para conta {conta_id}: {e}")
+        finally:
+            if conn: conn.close()
 
     # Retorna um dicionário de fallback com valores padrão
     return {
@@ -65,24 +265,21 @@ def get_bot_config(conta_id):
         'nome_assistente': 'Assistente',
     }
 
-def salvar_conversa(conta_id, contato, mensagem_usuario, resposta_bot):
-    """Salva um registro da interação na tabela 'conversas'."""
-    conn = None
-    try:
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            cursor.execute(
-                """
-                INSERT INTO conversas (conta_id, contato, mensagem_usuario, resposta_bot, data_hora)
-                VALUES (%s, %s, %s, %s, %s)
-                """,
-                (conta_id, contato, mensagem_usuario, resposta_bot, datetime.now())
-            )
-            conn.commit()
-    except Exception as e:
-        print(f"Erro ao salvar conversa para conta_id {conta_id}: {e}")
-    finally:
-        if conn: conn.close()
+def invalidar_cache_conta(conta_id):
+    """
+    Descarta a configuração do bot e a resolução de SID em cache de uma conta.
+    Os SIDs desconhecidos também saem, pois podem ser o novo SID da conta.
+    """
+    _cache_config_bot.invalidar(conta_id)
+    _cache_contas_por_sid.invalidar_onde(lambda sid, valor: valor == conta_id or valor is None)
+
+def salvar_conversa(conta_id, contato, mensagem_usuario, resposta_bot, lido=True):
+    """
+    Salva um registro da interação na tabela 'conversas'. A gravação é feita em
+    lote pelo diário de conversas (utils/diario_conversas.py), sem bloquear o pedido.
+    """
+    from .diario_conversas import registar_conversa
+    registar_conversa(conta_id, contato, mensagem_usuario, resposta_bot, lido)
 
 # --- NOVA FUNÇÃO ADICIONADA ---
 def get_last_bot_message(conta_id, contato):
@@ -0,0 +1,327 @@
+# Teste-bot-main/utils/despacho.py
+
+import os
+import json
+import time
+import heapq
+import queue
+import uuid
+import random
+import socket
+import atexit
+import zlib
+import itertools
+import threading
+from collections import deque
+
+from .db_utils import obter_conexao_isolada
+
+class Despachante:
+    """
+    Despacha as mensagens de saída em segundo plano, para que o webhook apenas
+    enfileire e responda logo à Twilio.
+
+    Cada contacto é sempre atendido pela mesma thread (hash do número de destino),
+    o que preserva a ordem das mensagens por contacto enquanto contactos
+    diferentes são atendidos em paralelo. Falhas são repetidas com backoff
+    exponencial sem bloquear a thread: o envio fica agendado para mais tarde e,
+    até lá, as mensagens seguintes do mesmo contacto ficam retidas atrás dele,
+    enquanto os outros contactos da thread continuam a ser atendidos.
+
+    Opcionalmente, cada envio é gravado antes na tabela `mensagens_saida`
+    (outbox), em nome deste worker e com uma reserva que é renovada a cada
+    `intervalo_vigia` segundos; a mesma thread vigia retoma os envios pendentes
+    cuja reserva expirou (workers que morreram).
+    """
+
+    def __init__(self, executor, num_threads=4, max_tentativas=4, backoff_base=0.5, outbox=False,
+                 reserva_segundos=300, intervalo_vigia=60):
+        self._executor = executor
+        self.max_tentativas = max_tentativas
+        self.backoff_base = backoff_base
+        self.outbox = outbox
+        self.reserva_segundos = reserva_segundos
+        self.intervalo_vigia = intervalo_vigia
+        self.dono = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._filas = [queue.Queue() for _ in range(num_threads)]
+        self._lock = threading.Lock()
+        self._parado = threading.Event()
+        self._stats = {
+            'enfileirados': 0,
+            'enviados': 0,
+            'falhas': 0,
+            'retentativas': 0,
+            'em_andamento': 0,
+            'a_aguardar_retentativa': 0,
+            'retidos': 0,
+            'recuperados': 0,
+        }
+        self._threads = []
+        for indice, fila in enumerate(self._filas):
+            thread = threading.Thread(target=self._consumir, args=(fila,), name=f"despacho-{indice}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self.outbox:
+            threading.Thread(target=self._vigiar, name="despacho-vigia", daemon=True).start()
+
+    def enfileirar(self, envio):
+        """
+        Enfileira um envio. `envio` é um dicionário serializável com, no mínimo,
+        'tipo', 'conta_id', 'para' e 'de'; o resto são os parâmetros do tipo.
+        """
+        if self.outbox:
+            envio['id_outbox'] = self._gravar_outbox(envio)
+        self._fila_do_contacto(envio['para']).put(envio)
+        with self._lock:
+            self._stats['enfileirados'] += 1
+
+    def _fila_do_contacto(self, numero):
+        return self._filas[zlib.crc32((numero or '').encode()) % len(self._filas)]
+
+    def _consumir(self, fila):
+        # Estado da thread: envios à espera de nova tentativa (heap por instante)
+        # e, por contacto com um envio à espera, as mensagens retidas atrás dele.
+        adiados = []
+        retidos = {}
+        sequencia = itertools.count()
+
+        def atender(envio, tentativa):
+            para = envio['para']
+            atraso = self._processar(envio, tentativa)
+            while atraso is None:
+                # Envio resolvido (enviado ou desistido): segue a próxima retida.
+                pendentes = retidos.get(para)
+                if not pendentes:
+                    retidos.pop(para, None)
+                    return
+                envio, tentativa = pendentes.popleft(), 0
+                with self._lock:
+                    self._stats['retidos'] -= 1
+                atraso = self._processar(envio, tentativa)
+            retidos.setdefault(para, deque())
+            heapq.heappush(adiados, (time.monotonic() + atraso, next(sequencia), envio, tentativa + 1))
+            with self._lock:
+                self._stats['a_aguardar_retentativa'] += 1
+
+        while True:
+            espera = max(0, adiados[0][0] - time.monotonic()) if adiados else None
+            try:
+                envio = fila.get(timeout=espera)
+            except queue.Empty:
+                envio = False
+            if envio is None:
+                fila.task_done()
+                if adiados or retidos:
+                    # Com outbox ficam pendentes e são retomados quando a reserva expirar.
+                    print(f"Despachante a encerrar com {len(adiados)} envios por repetir e {sum(map(len, retidos.values()))} retidos.")
+                return
+            if envio:
+                try:
+                    if envio['para'] in retidos:
+                        retidos[envio['para']].append(envio)
+                        with self._lock:
+                            self._stats['retidos'] += 1
+                    else:
+                        atender(envio, 0)
+                finally:
+                    fila.task_done()
+            while adiados and adiados[0][0] <= time.monotonic():
+                _, _, envio, tentativa = heapq.heappop(adiados)
+                with self._lock:
+                    self._stats['a_aguardar_retentativa'] -= 1
+                atender(envio, tentativa)
+
+    def _atraso(self, tentativa):
+        return self.backoff_base * (2 ** (tentativa - 1)) * (1 + random.random() * 0.2)
+
+    def _processar(self, envio, tentativa):
+        """
+        Faz a tentativa número `tentativa` (a partir de 0) do envio. Retorna o
+        atraso (segundos) até à próxima tentativa, ou None se o envio terminou
+        (enviado, ou falhado de vez).
+        """
+        with self._lock:
+            self._stats['em_andamento'] += 1
+            if tentativa:
+                self._stats['retentativas'] += 1
+        try:
+            self._executor(envio)
+        except Exception as e:
+            print(f"Erro no envio '{envio.get('tipo')}' para {envio.get('para')} (conta {envio.get('conta_id')}), tentativa {tentativa + 1}: {e}")
+            if tentativa + 1 < self.max_tentativas:
+                self._atualizar_outbox(envio, 'pendente', tentativa + 1, str(e))
+                return self._atraso(tentativa + 1)
+            with self._lock:
+                self._stats['falhas'] += 1
+            self._atualizar_outbox(envio, 'falhou', tentativa + 1, str(e))
+            return None
+        finally:
+            with self._lock:
+                self._stats['em_andamento'] -= 1
+        with self._lock:
+            self._stats['enviados'] += 1
+        self._atualizar_outbox(envio, 'enviado', tentativa + 1)
+        return None
+
+    # --- Outbox durável (opcional) ---
+
+    def _gravar_outbox(self, envio):
+        conn = obter_conexao_isolada()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO mensagens_saida (conta_id, para, de, tipo, parametros, status, dono, reservado_ate)
+                    VALUES (%s, %s, %s, %s, %s, 'pendente', %s, NOW() + make_interval(secs => %s)) RETURNING id
+                    """,
+                    (envio['conta_id'], envio['para'], envio['de'], envio['tipo'], json.dumps(envio, ensure_ascii=False),
+                     self.dono, self.reserva_segundos)
+                )
+                id_outbox = cur.fetchone()[0]
+            conn.commit()
+            return id_outbox
+        finally:
+            conn.close()
+
+    def _atualizar_outbox(self, envio, status, tentativas, erro=None):
+        id_outbox = envio.get('id_outbox')
+        if not id_outbox:
+            return
+        conn = None
+        try:
+            conn = obter_conexao_isolada()
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE mensagens_saida
+                    SET status = %s, tentativas = %s, ultimo_erro = %s, parametros = %s, atualizado_em = NOW()
+                    WHERE id = %s
+                    """,
+                    # Os parâmetros guardam o progresso de um lote (mensagens já enviadas).
+                    (status, tentativas, erro, json.dumps(envio, ensure_ascii=False), id_outbox)
+                )
+            conn.commit()
+        except Exception as e:
+            print(f"Erro ao atualizar outbox {id_outbox}: {e}")
+        finally:
+            if conn: conn.close()
+
+    def _vigiar(self):
+        """Renova as reservas dos envios deste worker e retoma os de workers mortos."""
+        while not self._parado.is_set():
+            self.renovar_reservas()
+            self.recuperar_pendentes()
+            self._parado.wait(self.intervalo_vigia)
+
+    def renovar_reservas(self):
+        """Prolonga a reserva de todos os envios pendentes deste worker (ainda em fila ou a repetir)."""
+        conn = None
+        try:
+            conn = obter_conexao_isolada()
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE mensagens_saida SET reservado_ate = NOW() + make_interval(secs => %s)
+                    WHERE dono = %s AND status = 'pendente'
+                    """,
+                    (self.reserva_segundos, self.dono)
+                )
+            conn.commit()
+        except Exception as e:
+            print(f"Erro ao renovar as reservas do outbox: {e}")
+        finally:
+            if conn: conn.close()
+
+    def recuperar_pendentes(self):
+        """
+        Reenfileira envios do outbox que ficaram pendentes com a reserva
+        expirada (worker que morreu a meio) e passa-os para este worker. SKIP
+        LOCKED evita que dois workers recuperem a mesma mensagem; a reserva de
+        um worker vivo nunca expira, porque ele a renova.
+        """
+        conn = None
+        try:
+            conn = obter_conexao_isolada()
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE mensagens_saida
+                    SET dono = %s, reservado_ate = NOW() + make_interval(secs => %s), atualizado_em = NOW()
+                    WHERE id IN (
+                        SELECT id FROM mensagens_saida
+                        WHERE status = 'pendente' AND reservado_ate < NOW()
+                        ORDER BY id
+                        LIMIT 500
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, parametros
+                    """,
+                    (self.dono, self.reserva_segundos)
+                )
+                recuperados = sorted(cur.fetchall())
+            conn.commit()
+        except Exception as e:
+            print(f"Erro ao recuperar envios pendentes do outbox: {e}")
+            return 0
+        finally:
+            if conn: conn.close()
+
+        for id_outbox, parametros in recuperados:
+            envio = parametros if isinstance(parametros, dict) else json.loads(parametros)
+            envio['id_outbox'] = id_outbox
+            self._fila_do_contacto(envio['para']).put(envio)
+        with self._lock:
+            self._stats['enfileirados'] += len(recuperados)
+            self._stats['recuperados'] += len(recuperados)
+        return len(recuperados)
+
+    def estatisticas(self):
+        with self._lock:
+            stats = dict(self._stats)
+        profundidades = [fila.qsize() for fila in self._filas]
+        stats['profundidade_fila'] = sum(profundidades)
+        stats['profundidade_por_thread'] = profundidades
+        stats['outbox'] = self.outbox
+        return stats
+
+    def parar(self, timeout=10):
+        """Espera que as filas se esvaziem (até `timeout` segundos) e encerra as threads."""
+        self._parado.set()
+        for fila in self._filas:
+            fila.put(None)
+        limite = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0, limite - time.monotonic()))
+
+_despachante = None
+_despachante_pid = None
+_despachante_lock = threading.Lock()
+
+def obter_despachante(executor):
+    """
+    Retorna o despachante deste processo, criando-o (e às suas threads) na
+    primeira utilização. Tal como o pool, é recriado após um fork.
+    """
+    global _despachante, _despachante_pid
+    pid = os.getpid()
+    if _despachante is None or _despachante_pid != pid:
+        with _despachante_lock:
+            if _despachante is None or _despachante_pid != pid:
+                _despachante = Despachante(
+                    executor,
+                    num_threads=int(os.environ.get('DESPACHO_THREADS', 4)),
+                    max_tentativas=int(os.environ.get('DESPACHO_TENTATIVAS', 4)),
+                    backoff_base=float(os.environ.get('DESPACHO_BACKOFF', 0.5)),
+                    outbox=os.environ.get('DESPACHO_OUTBOX', '0') == '1',
+                    reserva_segundos=int(os.environ.get('DESPACHO_RESERVA', 300)),
+                    intervalo_vigia=int(os.environ.get('DESPACHO_VIGIA_INTERVALO', 60)),
+                )
+                _despachante_pid = pid
+                atexit.register(_despachante.parar)
+    return _despachante
+
+def estatisticas_despacho():
+    """Estatísticas do despachante deste worker (vazio se ainda não foi usado)."""
+    if _despachante is None or _despachante_pid != os.getpid():
+        return {}
+    return _despachante.estatisticas()
@@ -0,0 +1,203 @@
+# Teste-bot-main/utils/diario_conversas.py
+
+import os
+import time
+import atexit
+import threading
+from collections import deque
+from datetime import datetime
+import psycopg2
+from psycopg2.extras import execute_values
+
+from .db_utils import obter_conexao_isolada
+from .eventos_painel import publicar_lista
+
+class DiarioConversas:
+    """
+    Regista as mensagens recebidas e enviadas na tabela `conversas` sem custo
+    para o pedido: os registos ficam num buffer em memória e uma thread grava-os
+    em lote (um INSERT multi-linha) quando o lote enche ou a cada `intervalo`
+    segundos. Na mesma transação é atualizado o resumo por contacto
+    (`contatos_resumo`) usado pela caixa de entrada do painel.
+
+    Se o buffer estiver cheio (ex.: banco em baixo), quem regista espera até
+    `espera_maxima` segundos por espaço; depois disso o registo é descartado e
+    contabilizado, para nunca bloquear o webhook indefinidamente.
+    """
+
+    def __init__(self, tamanho_lote=200, intervalo=1.0, capacidade=10000, espera_maxima=2.0):
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self.capacidade = capacidade
+        self.espera_maxima = espera_maxima
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._lock_gravacao = threading.Lock()
+        self._stats = {'registados': 0, 'gravados': 0, 'lotes': 0, 'esperas': 0, 'descartados': 0, 'rejeitados': 0, 'erros_gravacao': 0}
+        self._thread = threading.Thread(target=self._executar, name="diario-conversas", daemon=True)
+        self._thread.start()
+
+    def registar(self, conta_id, contato, mensagem_usuario=None, resposta_bot=None, lido=False):
+        """Acrescenta uma mensagem ao buffer; a gravação acontece em segundo plano."""
+        registo = (conta_id, contato, mensagem_usuario, resposta_bot, datetime.now(), lido)
+        with self._cond:
+            if len(self._buffer) >= self.capacidade:
+                self._stats['esperas'] += 1
+                self._cond.notify_all()
+                limite = time.monotonic() + self.espera_maxima
+                while len(self._buffer) >= self.capacidade:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        self._stats['descartados'] += 1
+                        print(f"Diário de conversas cheio; mensagem de {contato} (conta {conta_id}) descartada.")
+                        return
+                    self._cond.wait(restante)
+            self._buffer.append(registo)
+            self._stats['registados'] += 1
+            if len(self._buffer) >= self.tamanho_lote:
+                self._cond.notify_all()
+
+    def _executar(self):
+        espera_erro = self.intervalo
+        while True:
+            with self._cond:
+                if len(self._buffer) < self.tamanho_lote:
+                    self._cond.wait(self.intervalo)
+            if self.gravar_pendentes():
+                espera_erro = self.intervalo
+            else:
+                time.sleep(espera_erro)
+                espera_erro = min(espera_erro * 2, 30)
+
+    def gravar_pendentes(self):
+        """Grava tudo o que está no buffer, em lotes. Retorna False se a gravação falhou."""
+        with self._lock_gravacao:
+            while True:
+                with self._cond:
+                    lote = [self._buffer.popleft() for _ in range(min(self.tamanho_lote, len(self._buffer)))]
+                    if lote:
+                        self._cond.notify_all()
+                if not lote:
+                    return True
+                try:
+                    self._gravar(lote)
+                except Exception as e:
+                    print(f"Erro ao gravar lote de {len(lote)} conversas: {e}")
+                    with self._cond:
+                        self._stats['erros_gravacao'] += 1
+                    # Um registo inválido não pode travar o diário: o lote é
+                    # regravado registo a registo e só os inválidos são descartados.
+                    por_gravar = self._gravar_um_a_um(lote)
+                    if por_gravar:
+                        with self._cond:
+                            # Falha do banco: devolve o resto ao início do buffer para tentar mais tarde.
+                            self._buffer.extendleft(reversed(por_gravar))
+                        return False
+
+    def _gravar_um_a_um(self, lote):
+        """
+        Grava os registos de `lote` um a um, descartando os que o banco rejeita
+        (texto com NUL, conta inexistente, ...). Retorna os registos por gravar
+        se o banco falhar por outra razão (ex.: em baixo).
+        """
+        for indice, registo in enumerate(lote):
+            try:
+                self._gravar([registo])
+            except (ValueError, psycopg2.DataError, psycopg2.IntegrityError) as e:
+                print(f"Conversa de {registo[1]} (conta {registo[0]}) rejeitada pelo banco e descartada: {e}")
+                with self._cond:
+                    self._stats['rejeitados'] += 1
+            except Exception as e:
+                print(f"Erro ao gravar conversa de {registo[1]} (conta {registo[0]}): {e}")
+                return lote[indice:]
+        return []
+
+    def _gravar(self, lote):
+        conn = obter_conexao_isolada()
+        try:
+            with conn.cursor() as cur:
+                execute_values(
+                    cur,
+                    "INSERT INTO conversas (conta_id, contato, mensagem_usuario, resposta_bot, data_hora, lido) VALUES %s",
+                    lote,
+                    page_size=len(lote)
+                )
+                resumos = execute_values(
+                    cur,
+                    """
+                    INSERT INTO contatos_resumo (conta_id, contato, total_mensagens, ultima_mensagem, nao_lidas)
+                    VALUES %s
+                    ON CONFLICT (conta_id, contato) DO UPDATE SET
+                        total_mensagens = contatos_resumo.total_mensagens + EXCLUDED.total_mensagens,
+                        ultima_mensagem = GREATEST(contatos_resumo.ultima_mensagem, EXCLUDED.ultima_mensagem),
+                        nao_lidas = contatos_resumo.nao_lidas + EXCLUDED.nao_lidas
+                    RETURNING conta_id, contato, total_mensagens, ultima_mensagem, nao_lidas
+                    """,
+                    _resumir_por_contato(lote),
+                    fetch=True
+                )
+                # Os painéis abertos recebem o resumo atualizado dos contactos do lote.
+                por_conta = {}
+                for conta_id, contato, total, ultima, nao_lidas in resumos:
+                    por_conta.setdefault(conta_id, []).append({
+                        'contato': contato, 'total_mensagens': total,
+                        'ultima_mensagem': ultima.isoformat(), 'nao_lidas': nao_lidas,
+                    })
+                for conta_id, contatos in por_conta.items():
+                    publicar_lista(cur, conta_id, 'contatos', contatos)
+            conn.commit()
+        finally:
+            conn.close()
+        with self._cond:
+            self._stats['gravados'] += len(lote)
+            self._stats['lotes'] += 1
+
+    def estatisticas(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['no_buffer'] = len(self._buffer)
+        return stats
+
+def _resumir_por_contato(lote):
+    """
+    Agrega o lote por (conta_id, contato) para atualizar `contatos_resumo` com
+    uma linha por contacto. A ordem fixa das chaves evita deadlocks entre
+    workers que gravam lotes com os mesmos contactos.
+    """
+    resumo = {}
+    for conta_id, contato, _, _, data_hora, lido in lote:
+        total, ultima, nao_lidas = resumo.get((conta_id, contato), (0, data_hora, 0))
+        resumo[(conta_id, contato)] = (total + 1, max(ultima, data_hora), nao_lidas + (0 if lido else 1))
+    return [chave + valores for chave, valores in sorted(resumo.items())]
+
+_diario = None
+_diario_pid = None
+_diario_lock = threading.Lock()
+
+def obter_diario():
+    """Retorna o diário deste processo, criando a thread de gravação na primeira utilização."""
+    global _diario, _diario_pid
+    pid = os.getpid()
+    if _diario is None or _diario_pid != pid:
+        with _diario_lock:
+            if _diario is None or _diario_pid != pid:
+                _diario = DiarioConversas(
+                    tamanho_lote=int(os.environ.get('DIARIO_TAMANHO_LOTE', 200)),
+                    intervalo=float(os.environ.get('DIARIO_INTERVALO', 1.0)),
+                    capacidade=int(os.environ.get('DIARIO_CAPACIDADE', 10000)),
+                    espera_maxima=float(os.environ.get('DIARIO_ESPERA_MAXIMA', 2.0)),
+                )
+                _diario_pid = pid
+                # Grava o que ainda estiver no buffer quando o worker encerrar.
+                atexit.register(_diario.gravar_pendentes)
+    return _diario
+
+def registar_conversa(conta_id, contato, mensagem_usuario=None, resposta_bot=None, lido=False):
+    """Atalho para registar uma mensagem no diário deste processo."""
+    obter_diario().registar(conta_id, contato, mensagem_usuario, resposta_bot, lido)
+
+def estatisticas_diario():
+    """Estatísticas do diário deste worker (vazio se ainda não foi usado)."""
+    if _diario is None or _diario_pid != os.getpid():
+        return {}
+    return _diario.estatisticas()
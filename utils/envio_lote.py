@@ -0,0 +1,104 @@
+# Teste-bot-main/utils/envio_lote.py
+
+import os
+import time
+import random
+import threading
+
+class FalhaEnvioLote(Exception):
+    """Uma mensagem do lote falhou; `enviadas` mensagens já tinham sido aceites."""
+
+    def __init__(self, enviadas, erro):
+        super().__init__(f"mensagem {enviadas + 1} do lote falhou: {erro}")
+        self.enviadas = enviadas
+
+class EnvioDeLote:
+    """
+    Envia as várias mensagens de uma vista (ex.: um cartão por produto) como
+    um só trabalho do despachante, e mede a latência por vista.
+
+    Todas as mensagens de um lote vão para o mesmo destinatário e o WhatsApp
+    mostra-as pela ordem em que a Twilio as aceita, por isso são enviadas uma
+    a uma; o paralelismo entre destinatários vem das threads do despachante.
+    Cada mensagem é repetida até `max_tentativas` vezes; se continuar a falhar
+    é levantada FalhaEnvioLote e o despachante repete o lote a partir dessa
+    mensagem (as já aceites não são reenviadas).
+    """
+
+    def __init__(self, max_tentativas=2, backoff_base=0.5):
+        self.max_tentativas = max_tentativas
+        self.backoff_base = backoff_base
+        self._lock = threading.Lock()
+        self._stats_vistas = {}
+
+    def enviar(self, mensagens, funcao_envio, vista='desconhecida', inicio_em=0):
+        """
+        Envia `mensagens[inicio_em:]` por ordem com `funcao_envio(mensagem)`.
+        Levanta FalhaEnvioLote (com o total já enviado) se uma delas falhar.
+        """
+        inicio = time.monotonic()
+        for indice in range(inicio_em, len(mensagens)):
+            try:
+                self._enviar_com_retentativas(funcao_envio, mensagens[indice])
+            except Exception as e:
+                self._registar(vista, indice - inicio_em, 1, (time.monotonic() - inicio) * 1000)
+                raise FalhaEnvioLote(indice, e) from e
+        self._registar(vista, len(mensagens) - inicio_em, 0, (time.monotonic() - inicio) * 1000)
+
+    def _enviar_com_retentativas(self, funcao_envio, mensagem):
+        for tentativa in range(self.max_tentativas):
+            if tentativa:
+                time.sleep(self.backoff_base * (2 ** (tentativa - 1)) * (1 + random.random() * 0.2))
+            try:
+                funcao_envio(mensagem)
+                return
+            except Exception as e:
+                if tentativa + 1 == self.max_tentativas:
+                    raise
+                print(f"Erro no envio em lote '{mensagem.get('tipo')}' para {mensagem.get('para')}, tentativa {tentativa + 1}: {e}")
+
+    def _registar(self, vista, enviadas, falhas, latencia_ms):
+        with self._lock:
+            stats = self._stats_vistas.setdefault(vista, {
+                'execucoes': 0, 'mensagens': 0, 'falhas': 0,
+                'latencia_total_ms': 0.0, 'latencia_max_ms': 0.0, 'latencia_ultima_ms': 0.0,
+            })
+            stats['execucoes'] += 1
+            stats['mensagens'] += enviadas
+            stats['falhas'] += falhas
+            stats['latencia_total_ms'] += latencia_ms
+            stats['latencia_max_ms'] = max(stats['latencia_max_ms'], latencia_ms)
+            stats['latencia_ultima_ms'] = latencia_ms
+
+    def estatisticas(self):
+        with self._lock:
+            resultado = {}
+            for vista, stats in self._stats_vistas.items():
+                stats = dict(stats)
+                stats['latencia_media_ms'] = round(stats.pop('latencia_total_ms') / stats['execucoes'], 1)
+                resultado[vista] = stats
+        return resultado
+
+_envio_lote = None
+_envio_lote_pid = None
+_envio_lote_lock = threading.Lock()
+
+def obter_envio_de_lote():
+    """Retorna o envio de lotes deste processo, criando-o na primeira utilização."""
+    global _envio_lote, _envio_lote_pid
+    pid = os.getpid()
+    if _envio_lote is None or _envio_lote_pid != pid:
+        with _envio_lote_lock:
+            if _envio_lote is None or _envio_lote_pid != pid:
+                _envio_lote = EnvioDeLote(
+                    max_tentativas=int(os.environ.get('LOTE_TENTATIVAS', 2)),
+                    backoff_base=float(os.environ.get('LOTE_BACKOFF', 0.5)),
+                )
+                _envio_lote_pid = pid
+    return _envio_lote
+
+def estatisticas_envio_lote():
+    """Latência de envio por vista neste worker (vazio se ainda não foi usado)."""
+    if _envio_lote is None or _envio_lote_pid != os.getpid():
+        return {}
+    return _envio_lote.estatisticas()
@@ -0,0 +1,161 @@
+# Teste-bot-main/utils/eventos_painel.py
+#
+# Eventos em tempo real para o painel do lojista (Server-Sent Events). Quem
+# altera dados chama publicar_evento() na mesma transação; o NOTIFY chega ao
+# ouvinte de cada worker, que entrega o evento às ligações SSE abertas dessa
+# conta. As páginas do painel deixam assim de consultar a API periodicamente.
+
+import os
+import json
+import queue
+import threading
+import time
+
+from .notificacoes_pg import obter_ouvinte, notificar
+
+CANAL_EVENTOS_PAINEL = 'eventos_painel'
+
+# O NOTIFY aceita payloads até 8000 bytes; listas maiores são partidas em vários eventos.
+MAX_ITENS_POR_EVENTO = 30
+
+class CentralEventos:
+    """
+    Liga os eventos recebidos pelo ouvinte PostgreSQL às ligações SSE deste
+    worker. Cada ligação tem a sua fila limitada; se um cliente lento deixar a
+    fila encher, recebe um evento 'recarregar' em vez dos eventos perdidos.
+
+    Cada ligação aberta ocupa uma thread do worker (gthread) durante minutos,
+    por isso no máximo `max_ligacoes` ficam abertas ao mesmo tempo; as outras
+    são recusadas e o painel passa a consultar a API periodicamente.
+    """
+
+    def __init__(self, tamanho_fila=100, max_ligacoes=4):
+        self.tamanho_fila = tamanho_fila
+        self._filas = {}
+        self._lock = threading.Lock()
+        self._vagas = threading.BoundedSemaphore(max_ligacoes)
+        self._stats = {'recebidos': 0, 'entregues': 0, 'descartados': 0, 'ligacoes_recusadas': 0}
+
+    def reservar_ligacao(self):
+        """Reserva uma vaga para uma ligação SSE; False se o worker já está no limite."""
+        if self._vagas.acquire(blocking=False):
+            return True
+        with self._lock:
+            self._stats['ligacoes_recusadas'] += 1
+        return False
+
+    def libertar_ligacao(self):
+        self._vagas.release()
+
+    def inscrever(self, conta_id):
+        fila = queue.Queue(maxsize=self.tamanho_fila)
+        with self._lock:
+            self._filas.setdefault(conta_id, set()).add(fila)
+        return fila
+
+    def cancelar(self, conta_id, fila):
+        with self._lock:
+            filas = self._filas.get(conta_id)
+            if filas is not None:
+                filas.discard(fila)
+                if not filas:
+                    del self._filas[conta_id]
+
+    def _ao_receber(self, payload):
+        with self._lock:
+            if payload is None:
+                # Reconexão do ouvinte: podemos ter perdido eventos, então todos recarregam.
+                destinos = [fila for filas in self._filas.values() for fila in filas]
+                evento = {'tipo': 'recarregar', 'dados': {}}
+            else:
+                self._stats['recebidos'] += 1
+                destinos = list(self._filas.get(payload.get('conta_id'), ()))
+                evento = {'tipo': payload.get('tipo'), 'dados': payload.get('dados') or {}}
+        for fila in destinos:
+            self._colocar(fila, evento)
+
+    def _colocar(self, fila, evento):
+        try:
+            fila.put_nowait(evento)
+            self._stats['entregues'] += 1
+        except queue.Full:
+            self._stats['descartados'] += 1
+            # Troca o conteúdo da fila por um único pedido de recarregamento.
+            try:
+                while True:
+                    fila.get_nowait()
+            except queue.Empty:
+                pass
+            fila.put_nowait({'tipo': 'recarregar', 'dados': {}})
+
+    def estatisticas(self):
+        with self._lock:
+            ligacoes = sum(len(filas) for filas in self._filas.values())
+        return dict(self._stats, ligacoes=ligacoes)
+
+_central = None
+_central_pid = None
+_central_lock = threading.Lock()
+
+def obter_central_eventos():
+    """Retorna a central de eventos deste processo, registando-a no ouvinte na primeira utilização."""
+    global _central, _central_pid
+    pid = os.getpid()
+    if _central is None or _central_pid != pid:
+        with _central_lock:
+            if _central is None or _central_pid != pid:
+                _central = CentralEventos(
+                    tamanho_fila=int(os.environ.get('SSE_TAMANHO_FILA', 100)),
+                    max_ligacoes=int(os.environ.get('SSE_MAX_LIGACOES', 4)),
+                )
+                obter_ouvinte().ouvir(CANAL_EVENTOS_PAINEL, _central._ao_receber)
+                _central_pid = pid
+    return _central
+
+def publicar_evento(cur, conta_id, tipo, dados):
+    """
+    Publica um evento para os painéis abertos da conta. Como o NOTIFY é
+    transacional, deve ser chamado antes do commit da alteração que descreve.
+    """
+    notificar(cur, CANAL_EVENTOS_PAINEL, {'conta_id': conta_id, 'tipo': tipo, 'dados': dados})
+
+def publicar_lista(cur, conta_id, tipo, itens):
+    """Publica `itens` em eventos de no máximo MAX_ITENS_POR_EVENTO elementos."""
+    for inicio in range(0, len(itens), MAX_ITENS_POR_EVENTO):
+        publicar_evento(cur, conta_id, tipo, itens[inicio:inicio + MAX_ITENS_POR_EVENTO])
+
+def _formatar_sse(tipo, dados):
+    return f"event: {tipo}\ndata: {json.dumps(dados, default=str)}\n\n"
+
+def fluxo_eventos(conta_id, intervalo_ping=15, duracao_maxima=None):
+    """
+    Gerador com o corpo de uma resposta text/event-stream para a conta. Envia
+    um comentário a cada `intervalo_ping` segundos para manter a ligação viva e
+    termina após `duracao_maxima` segundos; o EventSource do navegador volta a
+    ligar sozinho, o que liberta periodicamente a thread do worker.
+    """
+    if duracao_maxima is None:
+        duracao_maxima = int(os.environ.get('SSE_DURACAO_MAXIMA', 300))
+    central = obter_central_eventos()
+    fila = central.inscrever(conta_id)
+    fim = time.monotonic() + duracao_maxima
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            restante = fim - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                evento = fila.get(timeout=min(intervalo_ping, restante))
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            yield _formatar_sse(evento['tipo'], evento['dados'])
+    finally:
+        central.cancelar(conta_id, fila)
+
+def estatisticas_eventos():
+    """Estatísticas das ligações SSE deste worker (vazio se ainda não foi usado)."""
+    if _central is None or _central_pid != os.getpid():
+        return {}
+    return _central.estatisticas()
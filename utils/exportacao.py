@@ -0,0 +1,236 @@
+# Teste-bot-main/utils/exportacao.py
+#
+# Exportação de dados em CSV/XLSX sem carregar a tabela em memória: as linhas
+# vêm de um cursor do lado do servidor (named cursor) em lotes e são escritas
+# no ficheiro à medida que chegam. A memória do worker fica constante seja qual
+# for o número de linhas.
+
+import os
+import io
+import re
+import csv
+import uuid
+import zipfile
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape, quoteattr
+from flask import Response
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils import get_column_letter
+
+from .db_utils import obter_conexao_isolada
+
+EXPORTACAO_LOTE = int(os.environ.get('EXPORTACAO_LOTE', 2000))
+TAMANHO_BLOCO = 64 * 1024
+
+# Cada exportação em curso ocupa uma conexão do pool até ao fim do download;
+# este limite por worker evita que exportações longas esgotem o pool.
+_exportacoes_simultaneas = threading.BoundedSemaphore(int(os.environ.get('EXPORTACAO_SIMULTANEAS', 2)))
+
+def linhas_do_servidor(query, params, tamanho_lote=None):
+    """
+    Gera as linhas de `query` lidas em lotes por um cursor do lado do servidor,
+    numa conexão própria do pool (o gerador corre depois do fim do pedido).
+    """
+    tamanho_lote = tamanho_lote or EXPORTACAO_LOTE
+    conn = obter_conexao_isolada()
+    try:
+        with conn.cursor(name=f"exportacao_{uuid.uuid4().hex}") as cur:
+            cur.itersize = tamanho_lote
+            cur.execute(query, params)
+            while True:
+                lote = cur.fetchmany(tamanho_lote)
+                if not lote:
+                    break
+                yield from lote
+    finally:
+        conn.close()
+
+# Texto começado por um destes caracteres é interpretado como fórmula pelo
+# Excel/LibreOffice (e pelo openpyxl); os dados vêm de clientes, por isso levam
+# um apóstrofo à frente e ficam como texto. Um sinal seguido só de algarismos
+# (ex.: o telefone '+5511999999999') não é fórmula e fica como está.
+_INICIO_FORMULA = ('=', '+', '-', '@')
+_NUMERO_COM_SINAL = re.compile(r'[+-]\d+')
+
+def _texto_seguro(valor):
+    if (isinstance(valor, str) and valor.startswith(_INICIO_FORMULA)
+            and not _NUMERO_COM_SINAL.fullmatch(valor)):
+        return "'" + valor
+    return valor
+
+def gerar_csv(cabecalho, linhas, linhas_por_bloco=500):
+    """
+    Gera o CSV em blocos de texto. Usa ';' e BOM UTF-8, o formato que o Excel
+    em português abre diretamente.
+    """
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=';')
+    buffer.write('﻿')
+    escritor.writerow(cabecalho)
+    for numero, linha in enumerate(linhas, 1):
+        escritor.writerow([_texto_seguro(valor) for valor in linha])
+        if numero % linhas_por_bloco == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+class _SaidaEmBlocos(io.RawIOBase):
+    """Destino não posicionável do zipfile: guarda os bytes até serem recolhidos."""
+
+    def __init__(self):
+        self._partes = []
+        self.tamanho = 0
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        self.tamanho += len(dados)
+        return len(dados)
+
+    def recolher(self):
+        dados = b''.join(self._partes)
+        self._partes = []
+        self.tamanho = 0
+        return dados
+
+_EPOCA_EXCEL = datetime(1899, 12, 30)
+
+# Estilos referenciados pelo atributo s das células: 1 = data e hora, 2 = data.
+_ESTILO_DATA_HORA = 1
+_ESTILO_DATA = 2
+
+_XLSX_FIXOS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<numFmts count="1"><numFmt numFmtId="164" formatCode="dd/mm/yyyy hh:mm:ss"/></numFmts>'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="3">'
+        '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '</cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+
+def _xml_livro(titulo):
+    # O nome da folha tem no máximo 31 caracteres e não aceita []:*?/\
+    titulo = re.sub(r'[\[\]:*?/\\]', '_', titulo)[:31] or 'Folha1'
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name={quoteattr(titulo)} sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+
+def _xml_celula(referencia, valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, bool):
+        return f'<c r="{referencia}" t="b"><v>{int(valor)}</v></c>'
+    if isinstance(valor, (int, float, Decimal)):
+        return f'<c r="{referencia}"><v>{valor}</v></c>'
+    if isinstance(valor, datetime):
+        serial = (valor.replace(tzinfo=None) - _EPOCA_EXCEL).total_seconds() / 86400
+        return f'<c r="{referencia}" s="{_ESTILO_DATA_HORA}"><v>{serial!r}</v></c>'
+    if isinstance(valor, date):
+        serial = (valor - _EPOCA_EXCEL.date()).days
+        return f'<c r="{referencia}" s="{_ESTILO_DATA}"><v>{serial}</v></c>'
+    # Caracteres de controlo não são permitidos no XML do XLSX.
+    texto = escape(_texto_seguro(ILLEGAL_CHARACTERS_RE.sub('', str(valor))))
+    return f'<c r="{referencia}" t="inlineStr"><is><t xml:space="preserve">{texto}</t></is></c>'
+
+def _xml_linha(numero, colunas, valores):
+    celulas = ''.join(_xml_celula(f'{coluna}{numero}', valor) for coluna, valor in zip(colunas, valores))
+    return f'<row r="{numero}">{celulas}</row>'
+
+def gerar_xlsx(cabecalho, linhas, titulo):
+    """
+    Gera um XLSX em streaming: a folha é escrita diretamente no zip (texto
+    inline, sem tabela de strings partilhadas) e cada bloco comprimido é
+    enviado assim que tem TAMANHO_BLOCO bytes, por isso o primeiro byte sai
+    logo com as primeiras linhas e nem a memória nem o disco crescem com o
+    tamanho da exportação.
+    """
+    saida = _SaidaEmBlocos()
+    colunas = [get_column_letter(indice) for indice in range(1, len(cabecalho) + 1)]
+    with zipfile.ZipFile(saida, 'w', compression=zipfile.ZIP_DEFLATED) as pacote:
+        for nome, conteudo in _XLSX_FIXOS.items():
+            pacote.writestr(nome, conteudo)
+        pacote.writestr('xl/workbook.xml', _xml_livro(titulo))
+        yield saida.recolher()
+
+        with pacote.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as folha:
+            folha.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                + _xml_linha(1, colunas, cabecalho)
+            ).encode('utf-8'))
+            for numero, linha in enumerate(linhas, 2):
+                folha.write(_xml_linha(numero, colunas, linha).encode('utf-8'))
+                if saida.tamanho >= TAMANHO_BLOCO:
+                    yield saida.recolher()
+            folha.write(b'</sheetData></worksheet>')
+    yield saida.recolher()
+
+def resposta_exportacao(nome_base, formato, cabecalho, query, params):
+    """
+    Resposta HTTP em streaming com o resultado de `query` em CSV ou XLSX.
+    Retorna None se o worker já tiver o máximo de exportações em curso.
+    """
+    if not _exportacoes_simultaneas.acquire(blocking=False):
+        return None
+    try:
+        linhas = linhas_do_servidor(query, params)
+        if formato == 'xlsx':
+            corpo = gerar_xlsx(cabecalho, linhas, nome_base)
+            mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        else:
+            corpo = gerar_csv(cabecalho, linhas)
+            mimetype = 'text/csv'
+            formato = 'csv'
+        nome_ficheiro = f"{nome_base}_{datetime.now().strftime('%Y%m%d_%H%M')}.{formato}"
+        resposta = Response(corpo, mimetype=mimetype, headers={
+            'Content-Disposition': f'attachment; filename="{nome_ficheiro}"',
+            'X-Accel-Buffering': 'no',
+        })
+    except Exception:
+        _exportacoes_simultaneas.release()
+        raise
+    # Liberta a vaga quando o servidor fecha a resposta (download concluído ou interrompido).
+    resposta.call_on_close(_exportacoes_simultaneas.release)
+    return resposta
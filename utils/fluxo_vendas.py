@@ -1,32 +1,75 @@
 from .db_utils import get_db_connection
 from datetime import datetime
 from psycopg2.extras import RealDictCursor
+from .eventos_painel import publicar_evento
+from .agregados_vendas import registar_venda_finalizada
 
-def _get_product_info(cur, conta_id, prod_id):
-    """Função auxiliar para buscar informações de um produto específico de uma conta."""
-    cur.execute("SELECT nome, preco FROM produtos WHERE id = %s AND conta_id = %s", (prod_id, conta_id))
-    produto = cur.fetchone()
-    return (produto['nome'], float(produto['preco'])) if produto else (None, None)
+def buscar_produtos(cur, conta_id, produto_ids):
+    """
+    Busca numa só consulta vários produtos de uma conta. `cur` deve ser um
+    RealDictCursor. Retorna {produto_id: (nome, preco)}; ids inexistentes ou de
+    outra conta ficam de fora.
+    """
+    ids = list({int(produto_id) for produto_id in produto_ids})
+    if not ids:
+        return {}
+    cur.execute("SELECT id, nome, preco FROM produtos WHERE id = ANY(%s) AND conta_id = %s", (ids, conta_id))
+    return {produto['id']: (produto['nome'], float(produto['preco'])) for produto in cur.fetchall()}
 
-def listar_categorias(conta_id):
-    """Lista as categorias de produtos de uma conta específica."""
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT DISTINCT categoria FROM produtos WHERE conta_id = %s AND categoria IS NOT NULL AND categoria != '' AND ativo = TRUE ORDER BY categoria", (conta_id,))
-            return [row['categoria'] for row in cur.fetchall()]
-    finally:
-        if conn: conn.close()
+def buscar_itens_vendas(cur, conta_id, venda_ids):
+    """
+    Busca os itens de várias vendas de uma conta em duas consultas, seja qual for
+    o número de vendas ou de itens. Retorna {venda_id: [item, ...]}, onde cada item
+    é um dicionário com produto_id, nome, quantidade e preco_unitario. O nome é
+    None se o produto já foi excluído.
+    """
+    ids = list(set(venda_ids))
+    if not ids:
+        return {}
+    cur.execute(
+        """
+        SELECT i.venda_id, i.produto_id, i.quantidade, i.preco_unitario
+        FROM itens_venda i JOIN vendas v ON v.id = i.venda_id
+        WHERE i.venda_id = ANY(%s) AND v.conta_id = %s
+        ORDER BY i.venda_id, i.produto_id
+        """,
+        (ids, conta_id)
+    )
+    linhas = cur.fetchall()
+    produtos = buscar_produtos(cur, conta_id, [linha['produto_id'] for linha in linhas])
 
-def listar_produtos_categoria(conta_id, categoria):
-    """Lista os produtos de uma categoria específica de uma conta."""
-    conn = get_db_connection()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT id, nome, preco FROM produtos WHERE conta_id = %s AND LOWER(categoria) = LOWER(%s) AND ativo = TRUE ORDER BY nome ASC", (conta_id, categoria))
-            return cur.fetchall()
-    finally:
-        if conn: conn.close()
+    itens_por_venda = {venda_id: [] for venda_id in ids}
+    for linha in linhas:
+        nome, _ = produtos.get(linha['produto_id'], (None, None))
+        itens_por_venda[linha['venda_id']].append({
+            'produto_id': linha['produto_id'],
+            'nome': nome,
+            'quantidade': linha['quantidade'],
+            'preco_unitario': float(linha['preco_unitario']),
+        })
+    return itens_por_venda
+
+def formatar_itens(itens):
+    """Texto com uma linha '- Nx Produto' por item (itens de produtos excluídos são omitidos)."""
+    return "".join(f"- {item['quantidade']}x {item['nome']}\n" for item in itens if item['nome'])
+
+def formatar_venda_painel(venda, itens):
+    """
+    Dicionário de uma venda no formato da tabela do painel de vendas, com data e
+    valor já formatados. Usado pela API do painel e pelos eventos em tempo real.
+    """
+    data_venda = venda['data_venda']
+    return {
+        'id': venda['id'],
+        'data_venda': data_venda.strftime('%d/%m/%Y %H:%M') if isinstance(data_venda, datetime) else data_venda,
+        'cliente_id': venda['cliente_id'],
+        'valor_total': f"{float(venda['valor_total']):.2f}" if venda['valor_total'] is not None else None,
+        'status': venda['status'],
+        'itens': itens,
+        'produtos_vendidos': ', '.join(
+            f"{item['quantidade']}x {item['nome'] or 'Produto #' + str(item['produto_id'])}" for item in itens
+        ),
+    }
 
 def adicionar_ao_carrinho(conta_id, sender_number, prod_id, quantidade):
     """Adiciona um item ao carrinho/venda de uma conta específica."""
@@ -34,28 +77,43 @@ def adicionar_ao_carrinho(conta_id, sender_number, prod_id, quantidade):
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             if quantidade <= 0: return "A quantidade deve ser positiva."
-            
-            prod_nome, prod_preco = _get_product_info(cur, conta_id, prod_id)
-            if not prod_nome: return "Produto não encontrado. Verifique o ID."
 
-            cur.execute("SELECT id, produtos_vendidos, valor_total FROM vendas WHERE conta_id = %s AND cliente_id = %s AND status = 'aberto'", (conta_id, sender_number))
-            venda_ativa = cur.fetchone()
+            # Cria o carrinho aberto ou, se já existir, bloqueia-o até ao fim da transação.
+            # O índice único parcial garante um só carrinho aberto por cliente, e o bloqueio
+            # serializa toques simultâneos do mesmo cliente; clientes diferentes não esperam.
+            cur.execute(
+                """
+                INSERT INTO vendas (conta_id, cliente_id, valor_total, status) VALUES (%s, %s, 0, 'aberto')
+                ON CONFLICT (conta_id, cliente_id) WHERE status = 'aberto'
+                DO UPDATE SET status = EXCLUDED.status
+                RETURNING id
+                """,
+                (conta_id, sender_number)
+            )
+            venda_id = cur.fetchone()['id']
 
-            if not venda_ativa:
-                produtos_str = f"{prod_id}x{quantidade}"
-                valor_total = prod_preco * quantidade
-                cur.execute("INSERT INTO vendas (conta_id, cliente_id, produtos_vendidos, valor_total, status) VALUES (%s, %s, %s, %s, 'aberto')",
-                            (conta_id, sender_number, produtos_str, valor_total))
-            else:
-                venda_id, produtos_str, valor_atual = venda_ativa['id'], venda_ativa['produtos_vendidos'] or "", venda_ativa['valor_total'] or 0.0
-                carrinho = {int(p.split('x')[0]): int(p.split('x')[1]) for p in produtos_str.split(',') if 'x' in p}
-                carrinho[prod_id] = carrinho.get(prod_id, 0) + quantidade
-                produtos_atualizado = ','.join([f"{pid}x{qty}" for pid, qty in carrinho.items()])
-                valor_novo = float(valor_atual) + (prod_preco * quantidade)
-                cur.execute("UPDATE vendas SET produtos_vendidos = %s, valor_total = %s WHERE id = %s", (produtos_atualizado, valor_novo, venda_id))
+            # Um único statement: soma a quantidade ao item (ou cria-o) com o preço atual
+            # do produto. O valor_total da venda é atualizado pelo trigger de itens_venda.
+            cur.execute(
+                """
+                WITH produto AS (
+                    SELECT id, nome, preco FROM produtos WHERE id = %(prod_id)s AND conta_id = %(conta_id)s
+                ), item AS (
+                    INSERT INTO itens_venda (venda_id, produto_id, quantidade, preco_unitario)
+                    SELECT %(venda_id)s, id, %(quantidade)s, preco FROM produto
+                    ON CONFLICT (venda_id, produto_id)
+                    DO UPDATE SET quantidade = itens_venda.quantidade + EXCLUDED.quantidade
+                    RETURNING produto_id
+                )
+                SELECT produto.nome FROM produto JOIN item ON item.produto_id = produto.id
+                """,
+                {'prod_id': prod_id, 'conta_id': conta_id, 'venda_id': venda_id, 'quantidade': quantidade}
+            )
+            produto = cur.fetchone()
+            if not produto: return "Produto não encontrado. Verifique o ID."
             
             conn.commit()
-            return f"{quantidade}x {prod_nome} adicionado(s) ao seu carrinho."
+            return f"{quantidade}x {produto['nome']} adicionado(s) ao seu carrinho."
     finally:
         if conn: conn.close()
 
@@ -64,23 +122,17 @@ def ver_carrinho(conta_id, sender_number):
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT produtos_vendidos, valor_total FROM vendas WHERE conta_id = %s AND cliente_id = %s AND status = 'aberto'", (conta_id, sender_number))
+            cur.execute("SELECT id, valor_total FROM vendas WHERE conta_id = %s AND cliente_id = %s AND status = 'aberto'", (conta_id, sender_number))
             venda_ativa = cur.fetchone()
+            if not venda_ativa:
+                return "Seu carrinho está vazio."
 
-            if not venda_ativa or not venda_ativa['produtos_vendidos']:
+            itens_carrinho = buscar_itens_vendas(cur, conta_id, [venda_ativa['id']])[venda_ativa['id']]
+            if not itens_carrinho:
                 return "Seu carrinho está vazio."
 
-            produtos_str, valor_total = venda_ativa['produtos_vendidos'], venda_ativa['valor_total']
-            response_text = "Seu carrinho atual:\n"
-            itens_carrinho = [item.split('x') for item in produtos_str.split(',') if 'x' in item]
-            
-            for prod_id_str, quantidade_str in itens_carrinho:
-                prod_id, quantidade = int(prod_id_str), int(quantidade_str)
-                nome_produto, _ = _get_product_info(cur, conta_id, prod_id)
-                if nome_produto:
-                    response_text += f"- {quantidade}x {nome_produto}\n"
-            
-            response_text += f"\nTotal: R${float(valor_total):.2f}"
+            response_text = "Seu carrinho atual:\n" + formatar_itens(itens_carrinho)
+            response_text += f"\nTotal: R${float(venda_ativa['valor_total']):.2f}"
             return response_text
     finally:
         if conn: conn.close()
@@ -90,15 +142,23 @@ def finalizar_compra(conta_id, sender_number):
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT id FROM vendas WHERE conta_id = %s AND cliente_id = %s AND status = 'aberto'", (conta_id, sender_number))
+            # Um único UPDATE: espera por uma adição em curso ao mesmo carrinho e só depois o fecha.
+            cur.execute(
+                "UPDATE vendas SET status = 'finalizado', data_venda = %s WHERE conta_id = %s AND cliente_id = %s AND status = 'aberto' RETURNING id, valor_total, data_venda, cliente_id, status",
+                (datetime.now(), conta_id, sender_number)
+            )
             venda_ativa = cur.fetchone()
 
             if not venda_ativa: return "Seu carrinho está vazio."
-            
-            venda_id = venda_ativa['id']
-            cur.execute("UPDATE vendas SET status = 'finalizado', data_venda = %s WHERE id = %s", (datetime.now(), venda_id))
+            itens = buscar_itens_vendas(cur, conta_id, [venda_ativa['id']])[venda_ativa['id']]
+            registar_venda_finalizada(cur, conta_id, venda_ativa, itens)
+            # A nova venda aparece nos painéis abertos assim que a transação for confirmada.
+            publicar_evento(cur, conta_id, 'venda', formatar_venda_painel(venda_ativa, itens))
             conn.commit()
-            return "Pedido finalizado com sucesso! Entraremos em contato para confirmar os detalhes."
+
+            resumo = f"Resumo do pedido #{venda_ativa['id']}:\n" + formatar_itens(itens)
+            resumo += f"Total: R${float(venda_ativa['valor_total'] or 0):.2f}"
+            return f"Pedido finalizado com sucesso! Entraremos em contato para confirmar os detalhes.\n\n{resumo}"
     finally:
         if conn: conn.close()
 
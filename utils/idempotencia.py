@@ -0,0 +1,181 @@
+# Teste-bot-main/utils/idempotencia.py
+
+import os
+import threading
+from collections import OrderedDict
+
+from .db_utils import get_db_connection, obter_conexao_isolada, executar_apos_confirmar, executar_apos_desfazer
+
+class DeduplicadorWebhook:
+    """
+    Descarta reentregas do mesmo webhook da Twilio, identificadas pelo MessageSid.
+
+    Primeiro consulta uma LRU em memória (sem tocar no banco); se o SID não
+    estiver lá, reserva-o na tabela `webhook_mensagens_processadas` numa
+    transação curta e já confirmada ('em_curso', válida por `reserva_segundos`),
+    para que uma reentrega simultânea veja a reserva e seja descartada logo, sem
+    esperar pelo fim deste pedido. A reserva passa a 'concluida' na transação
+    do pedido; se o pedido falhar é libertada e a próxima reentrega volta a ser
+    processada. Se o worker morrer a meio, a reserva expira.
+
+    Os SIDs mais velhos que o TTL são apagados numa thread de fundo, a cada
+    `limpar_a_cada` verificações.
+    """
+
+    def __init__(self, capacidade=10000, ttl_segundos=86400, limpar_a_cada=500, reserva_segundos=120):
+        self.capacidade = capacidade
+        self.ttl_segundos = ttl_segundos
+        self.limpar_a_cada = limpar_a_cada
+        self.reserva_segundos = reserva_segundos
+        self._recentes = OrderedDict()
+        self._lock = threading.Lock()
+        self._limpeza = None
+        self._stats = {'verificadas': 0, 'duplicadas_memoria': 0, 'duplicadas_banco': 0, 'reservas_expiradas': 0}
+
+    def _lembrar(self, message_sid):
+        with self._lock:
+            self._recentes[message_sid] = True
+            self._recentes.move_to_end(message_sid)
+            while len(self._recentes) > self.capacidade:
+                self._recentes.popitem(last=False)
+
+    def _reservar(self, message_sid, account_sid):
+        """
+        Reserva o SID numa transação própria. Retorna 'reservada' se a reserva é
+        nossa (SID novo, ou reserva anterior expirada), senão o estado em que o
+        SID está ('em_curso' ou 'concluida'). Primeiro lê a linha com um
+        SELECT simples, que não espera pelo pedido que a está a marcar como
+        concluída; só insere se ela não existir, e só retoma reservas expiradas.
+        """
+        conn = obter_conexao_isolada()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT status, reservado_ate < NOW() FROM webhook_mensagens_processadas WHERE message_sid = %s",
+                    (message_sid,)
+                )
+                existente = cur.fetchone()
+                if existente is None:
+                    cur.execute(
+                        """
+                        INSERT INTO webhook_mensagens_processadas (message_sid, account_sid, status, reservado_ate)
+                        VALUES (%s, %s, 'em_curso', NOW() + make_interval(secs => %s))
+                        ON CONFLICT (message_sid) DO NOTHING
+                        """,
+                        (message_sid, account_sid, self.reserva_segundos)
+                    )
+                    estado = 'reservada' if cur.rowcount == 1 else 'em_curso'
+                elif existente[0] == 'em_curso' and existente[1]:
+                    cur.execute(
+                        """
+                        UPDATE webhook_mensagens_processadas
+                        SET reservado_ate = NOW() + make_interval(secs => %s), recebido_em = NOW()
+                        WHERE message_sid = %s AND status = 'em_curso' AND reservado_ate < NOW()
+                        """,
+                        (self.reserva_segundos, message_sid)
+                    )
+                    estado = 'reservada' if cur.rowcount == 1 else 'em_curso'
+                    if estado == 'reservada':
+                        with self._lock:
+                            self._stats['reservas_expiradas'] += 1
+                else:
+                    estado = existente[0]
+            conn.commit()
+            return estado
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _libertar(self, message_sid):
+        """Apaga a reserva de um pedido que falhou, para a reentrega ser processada."""
+        conn = obter_conexao_isolada()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "DELETE FROM webhook_mensagens_processadas WHERE message_sid = %s AND status = 'em_curso'",
+                    (message_sid,)
+                )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def ja_processada(self, message_sid, account_sid=None):
+        """Retorna True se a mensagem já foi (ou está a ser) processada por outro pedido."""
+        if not message_sid:
+            return False
+
+        with self._lock:
+            self._stats['verificadas'] += 1
+            verificadas = self._stats['verificadas']
+            if message_sid in self._recentes:
+                self._recentes.move_to_end(message_sid)
+                self._stats['duplicadas_memoria'] += 1
+                return True
+
+        if verificadas % self.limpar_a_cada == 0:
+            self._limpar_em_fundo()
+
+        estado = self._reservar(message_sid, account_sid)
+        if estado != 'reservada':
+            with self._lock:
+                self._stats['duplicadas_banco'] += 1
+            # Uma reserva em curso ainda pode ser libertada: só as concluídas vão para a LRU.
+            if estado == 'concluida':
+                self._lembrar(message_sid)
+            return True
+
+        # A conclusão vai na transação do pedido: fica gravada só se ele for confirmado.
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE webhook_mensagens_processadas SET status = 'concluida', reservado_ate = NULL WHERE message_sid = %s",
+                    (message_sid,)
+                )
+            conn.commit()
+        finally:
+            conn.close()
+
+        # Só vai para a LRU depois do commit: se o pedido falhar, a reserva é
+        # libertada e a reentrega passa.
+        executar_apos_confirmar(lambda: self._lembrar(message_sid))
+        executar_apos_desfazer(lambda: self._libertar(message_sid))
+        return False
+
+    def _limpar_em_fundo(self):
+        with self._lock:
+            if self._limpeza is not None and self._limpeza.is_alive():
+                return
+            self._limpeza = threading.Thread(target=self.limpar_antigas, name="limpeza-webhook", daemon=True)
+            self._limpeza.start()
+
+    def limpar_antigas(self):
+        """Apaga do banco os SIDs mais velhos que o TTL (a Twilio já não os reentrega)."""
+        conn = None
+        try:
+            conn = obter_conexao_isolada()
+            with conn.cursor() as cur:
+                cur.execute(
+                    "DELETE FROM webhook_mensagens_processadas WHERE recebido_em < NOW() - make_interval(secs => %s)",
+                    (self.ttl_segundos,)
+                )
+            conn.commit()
+        except Exception as e:
+            print(f"Erro ao limpar mensagens processadas antigas: {e}")
+        finally:
+            if conn: conn.close()
+
+    def estatisticas(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['itens_memoria'] = len(self._recentes)
+        stats['duplicadas'] = stats['duplicadas_memoria'] + stats['duplicadas_banco']
+        return stats
+
+deduplicador_webhook = DeduplicadorWebhook(
+    capacidade=int(os.environ.get('WEBHOOK_DEDUP_CAPACIDADE', 10000)),
+    ttl_segundos=int(os.environ.get('WEBHOOK_DEDUP_TTL', 86400)),
+    reserva_segundos=int(os.environ.get('WEBHOOK_DEDUP_RESERVA', 120)),
+)
@@ -0,0 +1,301 @@
+# Teste-bot-main/utils/imagens.py
+#
+# Armazém das imagens dos produtos, endereçado pelo conteúdo: cada imagem é
+# guardada uma só vez com o seu SHA-256 como chave (o mesmo valor de
+# produtos.imagem_hash), e as miniaturas são geradas no upload e guardadas ao
+# lado do original. A base de dados só guarda o hash.
+#
+# O armazém é escolhido por IMAGENS_ARMAZEM (por agora só 'disco'); outro
+# backend (ex.: um object store) só precisa de implementar existe/ler/gravar
+# e de ser registado em ARMAZENS.
+#
+# Para mover os blobs antigos de produtos.imagem para o armazém, com
+# IMAGENS_PASTA (ou IMAGENS_ARMAZEM) igual à da aplicação:
+#     python -m utils.imagens copiar
+#     python -m utils.imagens limpar
+
+import io
+import os
+import hashlib
+import tempfile
+import threading
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+IMAGENS_PASTA = os.environ.get(
+    'IMAGENS_PASTA',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'imagens')
+)
+IMAGENS_TAMANHO_MAXIMO = int(os.environ.get('IMAGENS_TAMANHO_MAXIMO', 5 * 1024 * 1024))
+
+# Larguras (px) das miniaturas geradas no upload, por ordem crescente.
+TAMANHOS_MINIATURA = sorted(int(t) for t in os.environ.get('IMAGENS_MINIATURAS', '160,480').split(',') if t.strip())
+
+# Assinaturas (primeiros bytes) dos formatos aceites.
+_ASSINATURAS = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+]
+
+def detetar_tipo_imagem(dados):
+    """Tipo MIME da imagem pelos primeiros bytes; 'application/octet-stream' se desconhecido."""
+    inicio = bytes(dados[:16])
+    if inicio[:4] == b'RIFF' and inicio[8:12] == b'WEBP':
+        return 'image/webp'
+    for assinatura, tipo in _ASSINATURAS:
+        if inicio.startswith(assinatura):
+            return tipo
+    return 'application/octet-stream'
+
+class ArmazemDisco:
+    """
+    Guarda os ficheiros numa pasta local, repartidos em subpastas pelos dois
+    primeiros caracteres da chave. A gravação é atómica (ficheiro temporário +
+    rename), por isso um leitor nunca vê um ficheiro a meio.
+    """
+
+    def __init__(self, pasta):
+        self.pasta = pasta
+
+    def _caminho(self, chave):
+        return os.path.join(self.pasta, chave[:2], chave)
+
+    def existe(self, chave):
+        return os.path.exists(self._caminho(chave))
+
+    def ler(self, chave):
+        """Conteúdo guardado em `chave`, ou None se não existe."""
+        try:
+            with open(self._caminho(chave), 'rb') as ficheiro:
+                return ficheiro.read()
+        except FileNotFoundError:
+            return None
+
+    def gravar(self, chave, dados):
+        caminho = self._caminho(chave)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        descritor, temporario = tempfile.mkstemp(dir=os.path.dirname(caminho), prefix='.tmp_')
+        try:
+            with os.fdopen(descritor, 'wb') as ficheiro:
+                ficheiro.write(dados)
+            os.replace(temporario, caminho)
+        except Exception:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            raise
+
+ARMAZENS = {
+    'disco': lambda: ArmazemDisco(IMAGENS_PASTA),
+}
+
+_armazem = None
+_armazem_lock = threading.Lock()
+
+def obter_armazem():
+    """Armazém de imagens configurado em IMAGENS_ARMAZEM (criado na primeira utilização)."""
+    global _armazem
+    if _armazem is None:
+        with _armazem_lock:
+            if _armazem is None:
+                _armazem = ARMAZENS[os.environ.get('IMAGENS_ARMAZEM', 'disco')]()
+    return _armazem
+
+def _chave(imagem_hash, largura=None):
+    return f"{imagem_hash}_{largura}" if largura else imagem_hash
+
+def etag_imagem(imagem_hash, largura=None):
+    """
+    ETag de uma imagem servida com `largura` (já passada por escolher_largura).
+    Depende só do pedido, não de a miniatura existir: se no lugar dela foi
+    servido o original, o If-None-Match seguinte tem de continuar a coincidir.
+    """
+    return _chave(imagem_hash, largura)
+
+def gerar_miniatura(dados, largura):
+    """Miniatura com `largura` px no lado maior: JPEG, ou PNG se a imagem tem transparência."""
+    with Image.open(io.BytesIO(dados)) as imagem:
+        imagem = ImageOps.exif_transpose(imagem)
+        imagem.thumbnail((largura, largura))
+        saida = io.BytesIO()
+        if imagem.mode in ('RGBA', 'LA', 'P') and imagem.has_transparency_data:
+            imagem.save(saida, format='PNG', optimize=True)
+        else:
+            imagem.convert('RGB').save(saida, format='JPEG', quality=85, optimize=True)
+        return saida.getvalue()
+
+def validar_imagem(dados):
+    """Levanta ValueError se `dados` não for uma imagem que o Pillow consiga ler."""
+    if len(dados) > IMAGENS_TAMANHO_MAXIMO:
+        raise ValueError(f"Imagem maior que {IMAGENS_TAMANHO_MAXIMO // (1024 * 1024)} MB.")
+    try:
+        with Image.open(io.BytesIO(dados)) as imagem:
+            imagem.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError) as e:
+        raise ValueError("O ficheiro não é uma imagem válida.") from e
+
+def guardar_imagem(dados, validar=True):
+    """
+    Guarda o original e as miniaturas de TAMANHOS_MINIATURA (só o que ainda
+    não existe: o mesmo conteúdo é sempre a mesma chave). Retorna o hash, a
+    gravar em produtos.imagem_hash.
+    """
+    if validar:
+        validar_imagem(dados)
+    dados = bytes(dados)
+    imagem_hash = hashlib.sha256(dados).hexdigest()
+    armazem = obter_armazem()
+    if not armazem.existe(imagem_hash):
+        armazem.gravar(imagem_hash, dados)
+    for largura in TAMANHOS_MINIATURA:
+        if armazem.existe(_chave(imagem_hash, largura)):
+            continue
+        try:
+            armazem.gravar(_chave(imagem_hash, largura), gerar_miniatura(dados, largura))
+        except Exception as e:
+            # Sem miniatura, ler_imagem serve o original.
+            print(f"Erro ao gerar miniatura {largura}px da imagem {imagem_hash}: {e}")
+    return imagem_hash
+
+def escolher_largura(pedida):
+    """Menor miniatura com pelo menos `pedida` px; None (original) se nenhuma chega."""
+    if not pedida:
+        return None
+    for largura in TAMANHOS_MINIATURA:
+        if largura >= pedida:
+            return largura
+    return None
+
+def ler_imagem(imagem_hash, largura=None):
+    """
+    Conteúdo da imagem (ou da miniatura de `largura`, que deve ser uma de
+    TAMANHOS_MINIATURA) e a largura efetivamente servida. Se a miniatura não
+    existir é servido o original (largura None). Retorna (None, None) se o
+    armazém não tem a imagem.
+    """
+    armazem = obter_armazem()
+    if largura:
+        dados = armazem.ler(_chave(imagem_hash, largura))
+        if dados is not None:
+            return dados, largura
+    return armazem.ler(imagem_hash), None
+
+def _exigir_armazem_configurado():
+    """
+    A migração só corre com o armazém configurado explicitamente: com a pasta
+    padrão, um script corrido noutro diretório (ou noutra máquina) gravaria as
+    imagens onde a aplicação não as procura.
+    """
+    if os.environ.get('IMAGENS_ARMAZEM', 'disco') == 'disco' and 'IMAGENS_PASTA' not in os.environ:
+        raise RuntimeError(
+            "Defina IMAGENS_PASTA (a mesma pasta usada pela aplicação) ou IMAGENS_ARMAZEM antes de migrar as imagens."
+        )
+
+def _lotes_com_blob(conn, colunas, tamanho_lote):
+    """Lotes de produtos com produtos.imagem preenchida, por ordem de id (uma transação curta por lote)."""
+    ultimo_id = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                SELECT id, {colunas} FROM produtos
+                WHERE imagem IS NOT NULL AND id > %s
+                ORDER BY id
+                LIMIT %s
+                """,
+                (ultimo_id, tamanho_lote)
+            )
+            lote = cur.fetchall()
+        conn.commit()
+        if not lote:
+            return
+        yield lote
+        ultimo_id = lote[-1][0]
+
+def copiar_blobs_para_armazem(tamanho_lote=50):
+    """
+    Primeiro passo da migração: grava no armazém as imagens ainda guardadas em
+    produtos.imagem. Não altera a base de dados (o imagem_hash já é mantido
+    pelo trigger) e pode ser repetido. Retorna o número de imagens copiadas.
+    """
+    from .db_utils import obter_conexao_isolada
+
+    _exigir_armazem_configurado()
+    copiadas = 0
+    conn = obter_conexao_isolada()
+    try:
+        for lote in _lotes_com_blob(conn, 'imagem', tamanho_lote):
+            for _, imagem in lote:
+                # Sem validação: as imagens antigas são copiadas mesmo que o
+                # Pillow não as consiga ler (ficam sem miniaturas).
+                guardar_imagem(imagem, validar=False)
+            copiadas += len(lote)
+            print(f"{copiadas} imagens copiadas...")
+    finally:
+        conn.close()
+    return copiadas
+
+def limpar_blobs_migrados(tamanho_lote=50):
+    """
+    Segundo passo da migração: para cada produto com bytea, relê a cópia do
+    armazém e só apaga produtos.imagem se o SHA-256 do que foi lido for o
+    imagem_hash do produto. O UPDATE confirma também que o hash não mudou
+    entretanto. Retorna (limpos, por_verificar); os por verificar mantêm o
+    bytea e o passo de cópia deve ser repetido para eles.
+    """
+    from .db_utils import obter_conexao_isolada
+
+    _exigir_armazem_configurado()
+    armazem = obter_armazem()
+    limpos = 0
+    por_verificar = 0
+    conn = obter_conexao_isolada()
+    try:
+        for lote in _lotes_com_blob(conn, 'imagem_hash', tamanho_lote):
+            verificados = []
+            for produto_id, imagem_hash in lote:
+                guardada = armazem.ler(imagem_hash) if imagem_hash else None
+                if guardada is not None and hashlib.sha256(guardada).hexdigest() == imagem_hash:
+                    verificados.append((produto_id, imagem_hash))
+                else:
+                    por_verificar += 1
+                    print(f"Imagem do produto {produto_id} não encontrada ou diferente no armazém; bytea mantido.")
+            with conn.cursor() as cur:
+                for produto_id, imagem_hash in verificados:
+                    cur.execute(
+                        "UPDATE produtos SET imagem = NULL WHERE id = %s AND imagem_hash = %s AND imagem IS NOT NULL",
+                        (produto_id, imagem_hash)
+                    )
+                    limpos += cur.rowcount
+            conn.commit()
+            print(f"{limpos} imagens removidas da base de dados...")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return limpos, por_verificar
+
+if __name__ == '__main__':
+    import sys
+
+    passo = sys.argv[1] if len(sys.argv) > 1 else None
+    if passo not in ('copiar', 'limpar'):
+        print("Uso: python -m utils.imagens copiar|limpar")
+        print("  copiar  grava no armazém as imagens guardadas em produtos.imagem")
+        print("  limpar  apaga produtos.imagem dos produtos cuja cópia no armazém foi verificada")
+        sys.exit(2)
+    try:
+        if passo == 'copiar':
+            total = copiar_blobs_para_armazem()
+            print(f"Concluído: {total} imagens copiadas para o armazém. Confirme-as e corra o passo 'limpar'.")
+        else:
+            total, por_verificar = limpar_blobs_migrados()
+            print(f"Concluído: {total} imagens removidas da base de dados, {por_verificar} por verificar.")
+            if total:
+                print("Para devolver o espaço ao sistema, corra VACUUM FULL produtos numa janela de manutenção.")
+    except RuntimeError as e:
+        print(f"Erro: {e}")
+        sys.exit(1)
@@ -0,0 +1,329 @@
+# Teste-bot-main/utils/importacao_produtos.py
+#
+# Importação em massa do catálogo de produtos. O ficheiro é lido em blocos,
+# os tipos são convertidos de forma vetorizada (pandas) e cada bloco válido é
+# carregado com COPY para uma tabela temporária. No fim, a tabela temporária
+# é mesclada em `produtos`: o produto com o mesmo SKU (ou, sem SKU, com o mesmo
+# nome) é atualizado; os restantes são inseridos.
+
+import io
+import os
+import csv
+import unicodedata
+from datetime import date, datetime
+import pandas as pd
+from openpyxl import load_workbook
+
+IMPORTACAO_TAMANHO_BLOCO = int(os.environ.get('IMPORTACAO_TAMANHO_BLOCO', 5000))
+
+COLUNAS = ['sku', 'nome', 'descricao', 'preco', 'categoria']
+
+# Nomes alternativos aceites no cabeçalho (já sem acentos e em minúsculas).
+SINONIMOS_COLUNAS = {
+    'codigo': 'sku',
+    'referencia': 'sku',
+    'ref': 'sku',
+    'produto': 'nome',
+    'valor': 'preco',
+}
+
+# Chave do bloqueio consultivo que serializa importações da mesma conta.
+_CLASSE_BLOQUEIO_IMPORTACAO = 4201
+
+# Maior preço que cabe em produtos.preco (NUMERIC(10, 2)).
+PRECO_MAXIMO = 99999999.99
+
+# Uma linha do CSV com mais campos que o cabeçalho fica no bloco com esta
+# marca (seguida do número de campos) na primeira coluna, para ser reportada
+# como erro na sua linha em vez de interromper a leitura.
+_MARCA_LINHA_MALFORMADA = '\x00linha_malformada:'
+
+def normalizar_coluna(nome):
+    """'Preço ' -> 'preco'; aplica também os sinónimos de SINONIMOS_COLUNAS."""
+    nome = unicodedata.normalize('NFKD', str(nome)).encode('ascii', 'ignore').decode('ascii')
+    nome = nome.strip().lower().replace(' ', '_')
+    return SINONIMOS_COLUNAS.get(nome, nome)
+
+def _detetar_formato_csv(caminho):
+    """Codificação e separador do CSV, a partir do início do ficheiro."""
+    with open(caminho, 'rb') as ficheiro:
+        inicio = ficheiro.read(64 * 1024)
+    try:
+        inicio.decode('utf-8')
+        codificacao = 'utf-8-sig'
+    except UnicodeDecodeError:
+        # Ficheiros gravados pelo Excel em português costumam vir em Windows-1252.
+        codificacao = 'cp1252'
+    primeira_linha = inicio.decode(codificacao, errors='ignore').splitlines()[0] if inicio else ''
+    try:
+        separador = csv.Sniffer().sniff(primeira_linha, delimiters=',;\t|').delimiter
+    except csv.Error:
+        separador = ','
+    return codificacao, separador
+
+def blocos_csv(caminho, tamanho_bloco=None):
+    """
+    Lê o CSV em DataFrames de `tamanho_bloco` linhas, com todas as colunas como
+    texto. O índice de cada bloco é o número da linha no ficheiro (a 1 é o
+    cabeçalho). Linhas com campos a mais chegam marcadas e são reportadas como
+    erro por preparar_bloco; um ficheiro que não se consegue ler de todo (ex.:
+    aspas por fechar) levanta ValueError.
+    """
+    codificacao, separador = _detetar_formato_csv(caminho)
+    # O motor 'python' é o que aceita uma função em on_bad_lines.
+    leitor = pd.read_csv(
+        caminho,
+        sep=separador,
+        encoding=codificacao,
+        dtype=str,
+        keep_default_na=False,
+        engine='python',
+        on_bad_lines=lambda campos: [f"{_MARCA_LINHA_MALFORMADA}{len(campos)}"],
+        chunksize=tamanho_bloco or IMPORTACAO_TAMANHO_BLOCO,
+    )
+    try:
+        for bloco in leitor:
+            bloco.index = bloco.index + 2
+            yield bloco
+    except pd.errors.ParserError as e:
+        raise ValueError(f"Não foi possível ler o CSV: {e}") from e
+
+def _texto_celula(valor):
+    """Valor de uma célula do Excel como texto, tal como viria num CSV."""
+    if valor is None:
+        return ''
+    if isinstance(valor, float) and valor.is_integer():
+        # Códigos e preços inteiros vêm do Excel como 1234.0.
+        return str(int(valor))
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    return str(valor)
+
+def blocos_xlsx(caminho, tamanho_bloco=None):
+    """
+    Lê a primeira folha do XLSX em DataFrames de `tamanho_bloco` linhas, com
+    todas as colunas como texto. Usa o modo read_only do openpyxl, que percorre
+    o XML da folha sem carregar o livro, para que a memória não cresça com o
+    número de linhas. A primeira linha não vazia é o cabeçalho e as linhas
+    vazias são ignoradas; o índice de cada bloco é o número da linha na folha,
+    para que os erros apontem a linha que o utilizador vê no Excel.
+    """
+    tamanho_bloco = tamanho_bloco or IMPORTACAO_TAMANHO_BLOCO
+    livro = load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        cabecalho = None
+        linhas = []
+        numeros = []
+        for numero, valores in enumerate(livro.worksheets[0].iter_rows(min_row=1, values_only=True), 1):
+            if all(valor is None or valor == '' for valor in valores):
+                continue
+            if cabecalho is None:
+                cabecalho = [_texto_celula(valor) or f"coluna_{indice}" for indice, valor in enumerate(valores)]
+                continue
+            # Linhas podem vir mais curtas ou mais longas que o cabeçalho.
+            linha = [_texto_celula(valor) for valor in valores[:len(cabecalho)]]
+            linhas.append(linha + [''] * (len(cabecalho) - len(linha)))
+            numeros.append(numero)
+            if len(linhas) == tamanho_bloco:
+                yield pd.DataFrame(linhas, columns=cabecalho, index=numeros, dtype=str)
+                linhas = []
+                numeros = []
+        if linhas:
+            yield pd.DataFrame(linhas, columns=cabecalho, index=numeros, dtype=str)
+    finally:
+        livro.close()
+
+def _e_xlsx(caminho):
+    return caminho.lower().endswith('.xlsx')
+
+def blocos_ficheiro(caminho, tamanho_bloco=None):
+    """Blocos do ficheiro de produtos, CSV ou XLSX conforme a extensão."""
+    if _e_xlsx(caminho):
+        return blocos_xlsx(caminho, tamanho_bloco)
+    return blocos_csv(caminho, tamanho_bloco)
+
+def estimar_linhas(caminho):
+    """Número aproximado de linhas de dados do ficheiro (quebras de linha menos o cabeçalho)."""
+    if _e_xlsx(caminho):
+        # Lido da dimensão gravada na folha; None se o programa que a gerou não a gravou.
+        livro = load_workbook(caminho, read_only=True)
+        try:
+            total = livro.worksheets[0].max_row
+        finally:
+            livro.close()
+        return max(total - 1, 0) if total else None
+    quebras = 0
+    ultimo = b''
+    with open(caminho, 'rb') as ficheiro:
+        while True:
+            bloco = ficheiro.read(1024 * 1024)
+            if not bloco:
+                break
+            quebras += bloco.count(b'\n')
+            ultimo = bloco[-1:]
+    if ultimo and ultimo != b'\n':
+        quebras += 1
+    return max(quebras - 1, 0)
+
+def preparar_bloco(bloco):
+    """
+    Normaliza e valida um bloco do ficheiro, cujo índice é o número de cada
+    linha no ficheiro (ver blocos_csv/blocos_xlsx). Retorna (DataFrame válido
+    com as colunas 'linha' + COLUNAS, lista de erros {'linha', 'erro'}).
+    """
+    primeira_coluna = bloco.iloc[:, 0].fillna('').astype(str).reset_index(drop=True)
+    malformadas = primeira_coluna.str.startswith(_MARCA_LINHA_MALFORMADA)
+    mensagem_malformada = (
+        'linha com ' + primeira_coluna.str.slice(len(_MARCA_LINHA_MALFORMADA))
+        + f' campos (o cabeçalho tem {len(bloco.columns)})'
+    )
+    bloco = bloco.rename(columns=normalizar_coluna)
+    bloco = bloco.loc[:, ~bloco.columns.duplicated()]
+    dados = pd.DataFrame({'linha': bloco.index.to_numpy()})
+    for coluna in COLUNAS:
+        if coluna in bloco.columns:
+            valores = bloco[coluna].fillna('').astype(str).str.strip().reset_index(drop=True)
+            dados[coluna] = valores.where(valores != '', None)
+        else:
+            dados[coluna] = None
+
+    # Aceita '10,50', '1.234,50' e 'R$ 10.50'.
+    preco_texto = dados['preco'].fillna('').str.replace(r'[R$\s]', '', regex=True)
+    com_virgula = preco_texto.str.contains(',', regex=False)
+    preco_texto = preco_texto.where(
+        ~com_virgula,
+        preco_texto.str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    )
+    # '1.234' tanto pode ser 1234 como 1,234: mais de duas casas decimais é
+    # tratado como ambíguo em vez de ser arredondado.
+    ambiguo = preco_texto.str.contains(r'\.\d{3,}$', regex=True)
+    dados['preco'] = pd.to_numeric(preco_texto, errors='coerce').round(2)
+
+    problemas = pd.Series(None, index=dados.index, dtype=object)
+    problemas = problemas.mask(dados['preco'] < 0, 'preço negativo')
+    problemas = problemas.mask(dados['preco'] > PRECO_MAXIMO, 'preço acima de 99.999.999,99')
+    problemas = problemas.mask(dados['preco'].isna(), 'preço em falta ou inválido')
+    problemas = problemas.mask(ambiguo, 'preço ambíguo: use vírgula para os decimais (ex.: 1.234,00 ou 1,23)')
+    problemas = problemas.mask(dados['nome'].isna(), 'nome em falta')
+    problemas = problemas.mask(dados['sku'].fillna('').str.len() > 100, 'SKU com mais de 100 caracteres')
+    problemas = problemas.mask(malformadas, mensagem_malformada)
+
+    invalidas = problemas.notna()
+    erros = [
+        {'linha': int(linha), 'erro': erro}
+        for linha, erro in zip(dados.loc[invalidas, 'linha'], problemas[invalidas])
+    ]
+    return dados.loc[~invalidas, ['linha'] + COLUNAS], erros
+
+class ImportadorProdutos:
+    """
+    Carrega produtos de uma conta por COPY numa tabela temporária e mescla-os
+    em `produtos` numa só transação (a da conexão dada). O chamador faz o commit.
+    """
+
+    def __init__(self, conn, conta_id):
+        self.conn = conn
+        self.conta_id = conta_id
+        self.linhas_lidas = 0
+        self.erros = []
+
+    def iniciar(self):
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                CREATE TEMP TABLE produtos_importacao (
+                    linha INTEGER, sku TEXT, nome TEXT, descricao TEXT, preco NUMERIC(10, 2), categoria TEXT
+                ) ON COMMIT DROP
+            """)
+
+    def carregar_bloco(self, bloco):
+        """Valida um bloco lido do ficheiro e copia as linhas válidas para a tabela temporária."""
+        validos, erros = preparar_bloco(bloco)
+        self.linhas_lidas += len(bloco)
+        self.erros.extend(erros)
+        if validos.empty:
+            return
+        buffer = io.StringIO()
+        validos.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        with self.conn.cursor() as cur:
+            cur.copy_expert(
+                "COPY produtos_importacao (linha, sku, nome, descricao, preco, categoria) FROM STDIN WITH (FORMAT csv)",
+                buffer
+            )
+
+    def mesclar(self):
+        """Atualiza os produtos existentes e insere os novos. Retorna (inseridos, atualizados)."""
+        with self.conn.cursor() as cur:
+            # Duas importações da mesma conta ao mesmo tempo criariam duplicados.
+            cur.execute("SELECT pg_advisory_xact_lock(%s, %s)", (_CLASSE_BLOQUEIO_IMPORTACAO, self.conta_id))
+
+            # Se a mesma chave aparece várias vezes no ficheiro, vale a última linha.
+            cur.execute("""
+                CREATE TEMP TABLE produtos_importacao_final ON COMMIT DROP AS
+                SELECT DISTINCT ON (COALESCE('sku:' || sku, 'nome:' || lower(nome))) *
+                FROM produtos_importacao
+                ORDER BY COALESCE('sku:' || sku, 'nome:' || lower(nome)), linha DESC
+            """)
+            # Tabelas temporárias não têm estatísticas; sem elas o planeador escolhe
+            # junções em ciclo aninhado que ficam quadráticas em ficheiros grandes.
+            cur.execute("ANALYZE produtos_importacao_final")
+
+            cur.execute("""
+                UPDATE produtos p SET nome = s.nome, descricao = COALESCE(s.descricao, p.descricao),
+                    preco = s.preco, categoria = COALESCE(s.categoria, p.categoria), ativo = TRUE
+                FROM produtos_importacao_final s
+                WHERE p.conta_id = %s AND s.sku IS NOT NULL AND p.sku = s.sku
+            """, (self.conta_id,))
+            atualizados = cur.rowcount
+
+            cur.execute("""
+                UPDATE produtos p SET descricao = COALESCE(s.descricao, p.descricao),
+                    preco = s.preco, categoria = COALESCE(s.categoria, p.categoria), ativo = TRUE
+                FROM produtos_importacao_final s
+                WHERE p.conta_id = %s AND s.sku IS NULL AND lower(p.nome) = lower(s.nome)
+            """, (self.conta_id,))
+            atualizados += cur.rowcount
+
+            # Inserção separada por tipo de chave: cada NOT EXISTS fica com uma só
+            # condição de igualdade e o PostgreSQL resolve-o com uma anti-junção por hash.
+            cur.execute("""
+                INSERT INTO produtos (conta_id, sku, nome, descricao, preco, categoria, ativo)
+                SELECT %s, s.sku, s.nome, s.descricao, s.preco, s.categoria, TRUE
+                FROM produtos_importacao_final s
+                WHERE s.sku IS NOT NULL
+                  AND NOT EXISTS (SELECT 1 FROM produtos p WHERE p.conta_id = %s AND p.sku = s.sku)
+                ORDER BY s.linha
+            """, (self.conta_id, self.conta_id))
+            inseridos = cur.rowcount
+
+            cur.execute("""
+                INSERT INTO produtos (conta_id, sku, nome, descricao, preco, categoria, ativo)
+                SELECT %s, NULL, s.nome, s.descricao, s.preco, s.categoria, TRUE
+                FROM produtos_importacao_final s
+                WHERE s.sku IS NULL
+                  AND NOT EXISTS (SELECT 1 FROM produtos p WHERE p.conta_id = %s AND lower(p.nome) = lower(s.nome))
+                ORDER BY s.linha
+            """, (self.conta_id, self.conta_id))
+            inseridos += cur.rowcount
+        return inseridos, atualizados
+
+def importar_produtos(conn, conta_id, blocos, ao_progresso=None):
+    """
+    Importa os produtos dos DataFrames em `blocos` (ex.: blocos_ficheiro(caminho))
+    na transação de `conn`. Retorna um dicionário com linhas, inseridos,
+    atualizados e erros (lista de {'linha', 'erro'}). Não faz commit.
+    `ao_progresso(linhas_lidas, total_erros)` é chamada após cada bloco.
+    """
+    importador = ImportadorProdutos(conn, conta_id)
+    importador.iniciar()
+    for bloco in blocos:
+        importador.carregar_bloco(bloco)
+        if ao_progresso:
+            ao_progresso(importador.linhas_lidas, len(importador.erros))
+    inseridos, atualizados = importador.mesclar()
+    return {
+        'linhas': importador.linhas_lidas,
+        'inseridos': inseridos,
+        'atualizados': atualizados,
+        'erros': importador.erros,
+    }
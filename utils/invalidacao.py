@@ -0,0 +1,66 @@
+# Teste-bot-main/utils/invalidacao.py
+#
+# Barramento de invalidação de caches entre workers. Quem altera dados de uma
+# conta chama notificar_invalidacao() antes do commit; cada worker tem um
+# ouvinte em LISTEN que descarta as entradas dessa conta poucos milissegundos
+# depois de a transação ser confirmada.
+
+from .cache import limpar_caches
+from .catalogo import invalidar_catalogo
+from .db_utils import executar_apos_confirmar, invalidar_cache_conta
+from .notificacoes_pg import obter_ouvinte, notificar
+from .twilio_utils import invalidar_cliente_twilio
+
+CANAL_INVALIDACAO = 'invalidacao_cache'
+
+def _invalidar_config(conta_id, dados):
+    invalidar_cache_conta(conta_id)
+
+def _invalidar_catalogo(conta_id, dados):
+    invalidar_catalogo(conta_id, dados.get('produto_id'))
+
+def _invalidar_conta(conta_id, dados):
+    invalidar_cache_conta(conta_id)
+    invalidar_cliente_twilio(conta_id)
+
+# Escopo da alteração -> funções que descartam os caches afetados.
+INVALIDADORES = {
+    'config': [_invalidar_config],
+    'conta': [_invalidar_conta],
+    'catalogo': [_invalidar_catalogo],
+}
+
+def _aplicar(escopo, conta_id, dados):
+    for funcao in INVALIDADORES.get(escopo, []):
+        try:
+            funcao(conta_id, dados)
+        except Exception as e:
+            print(f"Erro ao invalidar cache '{escopo}' da conta {conta_id}: {e}")
+
+def _ao_receber(payload):
+    if payload is None:
+        # Reconexão: podemos ter perdido notificações, então descartamos tudo.
+        limpar_caches()
+        return
+    _aplicar(payload.get('escopo'), payload.get('conta_id'), payload.get('dados') or {})
+
+_ouvinte_registado = None
+
+def iniciar_ouvinte_invalidacao():
+    """Garante que este worker está a ouvir o canal de invalidação."""
+    global _ouvinte_registado
+    ouvinte = obter_ouvinte()
+    if _ouvinte_registado is not ouvinte:
+        ouvinte.ouvir(CANAL_INVALIDACAO, _ao_receber)
+        _ouvinte_registado = ouvinte
+
+def notificar_invalidacao(conn, conta_id, escopo, **dados):
+    """
+    Avisa todos os workers de que os dados `escopo` da conta mudaram. Deve ser
+    chamada na mesma transação da alteração (antes do commit): o NOTIFY só é
+    entregue se ela for confirmada. Neste worker a invalidação é aplicada logo
+    após o commit do pedido.
+    """
+    with conn.cursor() as cur:
+        notificar(cur, CANAL_INVALIDACAO, {'escopo': escopo, 'conta_id': conta_id, 'dados': dados})
+    executar_apos_confirmar(lambda: _aplicar(escopo, conta_id, dados))
@@ -0,0 +1,139 @@
+# Teste-bot-main/utils/notificacoes_pg.py
+
+import os
+import json
+import time
+import select
+import threading
+import psycopg2
+from psycopg2 import extensions
+
+from .db_pool import parametros_conexao
+
+class OuvintePostgres:
+    """
+    Thread que mantém uma conexão dedicada em LISTEN nos canais registados e
+    entrega cada NOTIFY aos callbacks do canal. Há um ouvinte por worker.
+
+    Se a conexão cair, reconecta com backoff e chama os callbacks com `None`,
+    para que descartem o que possam ter perdido durante a queda.
+    """
+
+    def __init__(self):
+        self._callbacks = {}
+        self._lock = threading.Lock()
+        self._conn = None
+        self._novos_canais = []
+        self._stats = {'recebidas': 0, 'reconexoes': 0}
+        # Pipe para acordar o select() quando um canal novo é registado.
+        self._despertar_leitura, self._despertar_escrita = os.pipe()
+        self._thread = threading.Thread(target=self._executar, name="ouvinte-postgres", daemon=True)
+        self._thread.start()
+
+    def ouvir(self, canal, callback):
+        """Regista `callback(payload)` para o canal; payload é o dicionário enviado (ou None após reconexão)."""
+        with self._lock:
+            if canal not in self._callbacks:
+                self._callbacks[canal] = []
+                self._novos_canais.append(canal)
+            self._callbacks[canal].append(callback)
+        os.write(self._despertar_escrita, b'.')
+
+    def _conectar(self):
+        conn = psycopg2.connect(**parametros_conexao())
+        conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with self._lock:
+            canais = list(self._callbacks)
+            self._novos_canais = []
+        with conn.cursor() as cur:
+            for canal in canais:
+                cur.execute(f'LISTEN "{canal}"')
+        return conn
+
+    def _executar(self):
+        espera = 1
+        primeira = True
+        while True:
+            try:
+                self._conn = self._conectar()
+                if not primeira:
+                    self._stats['reconexoes'] += 1
+                    self._entregar_a_todos(None)
+                primeira = False
+                espera = 1
+                self._escutar()
+            except Exception as e:
+                print(f"Ouvinte PostgreSQL desconectado: {e}. Nova tentativa em {espera}s.")
+                if self._conn is not None:
+                    try:
+                        self._conn.close()
+                    except Exception:
+                        pass
+                time.sleep(espera)
+                espera = min(espera * 2, 30)
+
+    def _escutar(self):
+        while True:
+            with self._lock:
+                novos, self._novos_canais = self._novos_canais, []
+            if novos:
+                with self._conn.cursor() as cur:
+                    for canal in novos:
+                        cur.execute(f'LISTEN "{canal}"')
+
+            prontos, _, _ = select.select([self._conn, self._despertar_leitura], [], [], 5)
+            if self._despertar_leitura in prontos:
+                os.read(self._despertar_leitura, 1024)
+            if self._conn not in prontos:
+                continue
+            self._conn.poll()
+            while self._conn.notifies:
+                notificacao = self._conn.notifies.pop(0)
+                self._stats['recebidas'] += 1
+                try:
+                    payload = json.loads(notificacao.payload) if notificacao.payload else {}
+                except ValueError:
+                    payload = {'bruto': notificacao.payload}
+                self._entregar(notificacao.channel, payload)
+
+    def _entregar(self, canal, payload):
+        with self._lock:
+            callbacks = list(self._callbacks.get(canal, []))
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception as e:
+                print(f"Erro ao tratar notificação do canal '{canal}': {e}")
+
+    def _entregar_a_todos(self, payload):
+        with self._lock:
+            canais = list(self._callbacks)
+        for canal in canais:
+            self._entregar(canal, payload)
+
+    def estatisticas(self):
+        with self._lock:
+            canais = list(self._callbacks)
+        return dict(self._stats, canais=canais, conectado=self._conn is not None and not self._conn.closed)
+
+_ouvinte = None
+_ouvinte_pid = None
+_ouvinte_lock = threading.Lock()
+
+def obter_ouvinte():
+    """Retorna o ouvinte deste processo, criando a thread na primeira utilização."""
+    global _ouvinte, _ouvinte_pid
+    pid = os.getpid()
+    if _ouvinte is None or _ouvinte_pid != pid:
+        with _ouvinte_lock:
+            if _ouvinte is None or _ouvinte_pid != pid:
+                _ouvinte = OuvintePostgres()
+                _ouvinte_pid = pid
+    return _ouvinte
+
+def notificar(cur, canal, payload):
+    """
+    Emite um NOTIFY com `payload` (dicionário) pelo cursor dado. Como o NOTIFY
+    é transacional, só é entregue quando a transação do chamador for confirmada.
+    """
+    cur.execute("SELECT pg_notify(%s, %s)", (canal, json.dumps(payload, default=str)))
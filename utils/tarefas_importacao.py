@@ -0,0 +1,291 @@
+# Teste-bot-main/utils/tarefas_importacao.py
+#
+# Importações do catálogo em segundo plano. O pedido de upload só grava o
+# ficheiro e cria a linha em `importacoes`; um pool de threads por worker faz a
+# importação (utils/importacao_produtos.py) e vai gravando o progresso na linha,
+# que a página de upload consulta.
+#
+# O ficheiro fica em IMPORTACAO_PASTA até a importação terminar; com vários
+# servidores esta pasta tem de ser partilhada entre eles.
+
+import os
+import json
+import atexit
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .db_utils import obter_conexao_isolada
+from .invalidacao import notificar_invalidacao
+from .importacao_produtos import importar_produtos, blocos_ficheiro
+
+IMPORTACAO_PASTA = os.environ.get('IMPORTACAO_PASTA', os.path.join(tempfile.gettempdir(), 'importacoes'))
+
+# Quantas linhas com erro ficam guardadas na tarefa (o total vai em total_erros).
+MAX_ERROS_GUARDADOS = 100
+
+class ExecutorImportacoes:
+    """
+    Executa as tarefas de importação num pool de threads. Cada tarefa ocupa uma
+    conexão do pool durante toda a importação (é uma só transação), por isso o
+    número de threads deve ficar bem abaixo do tamanho do pool.
+
+    A tarefa é reclamada com um UPDATE condicional ('pendente' -> 'em_curso'),
+    o que garante que só um worker a processa mesmo que seja submetida mais de
+    uma vez (por ex. pela recuperação de tarefas paradas). Enquanto corre, a
+    tarefa é mantida viva (atualizado_em) para não parecer parada durante a
+    mescla, e todas as escritas levam o número da reclamação: um worker que
+    perdeu a tarefa já não lhe altera o estado nem lhe apaga o ficheiro.
+
+    Uma thread vigia corre recuperar_paradas() logo ao arrancar e depois a cada
+    `intervalo_recuperacao` segundos, para que as tarefas de um worker que
+    morreu sejam retomadas mesmo sem novos uploads.
+    """
+
+    def __init__(self, num_threads=1, expira_apos=600, intervalo_recuperacao=60):
+        self.expira_apos = expira_apos
+        self.intervalo_recuperacao = intervalo_recuperacao
+        self._executor = ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix='importacao')
+        self._lock = threading.Lock()
+        self._parado = threading.Event()
+        self._stats = {
+            'submetidas': 0,
+            'concluidas': 0,
+            'falhadas': 0,
+            'em_andamento': 0,
+            'recuperadas': 0,
+        }
+        self._vigia = threading.Thread(target=self._vigiar, name='importacao-vigia', daemon=True)
+        self._vigia.start()
+
+    def _vigiar(self):
+        while not self._parado.is_set():
+            recuperadas = self.recuperar_paradas()
+            if recuperadas:
+                with self._lock:
+                    self._stats['recuperadas'] += recuperadas
+            self._parado.wait(self.intervalo_recuperacao)
+
+    def submeter(self, importacao_id):
+        self._executor.submit(self._executar, importacao_id)
+        with self._lock:
+            self._stats['submetidas'] += 1
+
+    def _executar(self, importacao_id):
+        with self._lock:
+            self._stats['em_andamento'] += 1
+        try:
+            self._processar(importacao_id)
+        except Exception as e:
+            print(f"Erro na importação {importacao_id}: {e}")
+        finally:
+            with self._lock:
+                self._stats['em_andamento'] -= 1
+
+    def _reclamar(self, importacao_id):
+        """Passa a tarefa a 'em_curso'. Retorna (conta_id, caminho, reclamacao) ou None se outro a tem."""
+        conn = obter_conexao_isolada()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE importacoes SET status = 'em_curso', linhas_processadas = 0,
+                        reclamacao = reclamacao + 1, atualizado_em = NOW()
+                    WHERE id = %s AND (
+                        status = 'pendente'
+                        OR (status = 'em_curso' AND atualizado_em < NOW() - make_interval(secs => %s))
+                    )
+                    RETURNING conta_id, caminho, reclamacao
+                    """,
+                    (importacao_id, self.expira_apos)
+                )
+                linha = cur.fetchone()
+            conn.commit()
+            return linha
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _sql_atualizar(campos, concluir):
+        atribuicoes = ''.join(f"{campo} = %s, " for campo in campos)
+        if concluir:
+            atribuicoes += 'concluido_em = NOW(), '
+        return f"UPDATE importacoes SET {atribuicoes}atualizado_em = NOW() WHERE id = %s AND reclamacao = %s"
+
+    def _atualizar(self, importacao_id, reclamacao, concluir=False, **campos):
+        """
+        Grava campos da tarefa numa transação curta, à parte da importação, se
+        a reclamação ainda for `reclamacao`. Retorna False se a tarefa já não é nossa.
+        """
+        conn = obter_conexao_isolada()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(self._sql_atualizar(campos, concluir), list(campos.values()) + [importacao_id, reclamacao])
+                atualizada = cur.rowcount > 0
+            conn.commit()
+            return atualizada
+        finally:
+            conn.close()
+
+    def _manter_viva(self, importacao_id, reclamacao, terminou):
+        """Renova atualizado_em enquanto a importação corre (a mescla não reporta progresso)."""
+        intervalo = max(1, self.expira_apos / 4)
+        while not terminou.wait(intervalo):
+            try:
+                if not self._atualizar(importacao_id, reclamacao):
+                    return
+            except Exception as e:
+                print(f"Erro ao renovar a importação {importacao_id}: {e}")
+
+    def _processar(self, importacao_id):
+        reclamada = self._reclamar(importacao_id)
+        if not reclamada:
+            return
+        conta_id, caminho, reclamacao = reclamada
+
+        def ao_progresso(linhas, total_erros):
+            try:
+                self._atualizar(importacao_id, reclamacao, linhas_processadas=linhas, total_erros=total_erros)
+            except Exception as e:
+                # O progresso é informativo; não interrompe a importação.
+                print(f"Erro ao gravar progresso da importação {importacao_id}: {e}")
+
+        terminou = threading.Event()
+        threading.Thread(
+            target=self._manter_viva, args=(importacao_id, reclamacao, terminou),
+            name=f"importacao-{importacao_id}-viva", daemon=True
+        ).start()
+        conn = None
+        try:
+            conn = obter_conexao_isolada()
+            resultado = importar_produtos(conn, conta_id, blocos_ficheiro(caminho), ao_progresso=ao_progresso)
+            # Importação em massa: o catálogo inteiro da conta é reconstruído
+            notificar_invalidacao(conn, conta_id, 'catalogo')
+            # O estado final vai na transação da importação: ou ficam os dois, ou
+            # nenhum. Se a tarefa foi entretanto retomada por outro worker, desiste.
+            erros = resultado['erros']
+            campos = {
+                'status': 'concluida',
+                'total_linhas': resultado['linhas'],
+                'linhas_processadas': resultado['linhas'],
+                'inseridos': resultado['inseridos'],
+                'atualizados': resultado['atualizados'],
+                'total_erros': len(erros),
+                'erros': json.dumps(erros[:MAX_ERROS_GUARDADOS], ensure_ascii=False),
+            }
+            with conn.cursor() as cur:
+                cur.execute(self._sql_atualizar(campos, True), list(campos.values()) + [importacao_id, reclamacao])
+                if cur.rowcount == 0:
+                    conn.rollback()
+                    print(f"Importação {importacao_id} retomada por outro worker; resultado desta execução descartado.")
+                    return
+            conn.commit()
+        except Exception as e:
+            if conn: conn.rollback()
+            with self._lock:
+                self._stats['falhadas'] += 1
+            print(f"Erro ao importar produtos da conta {conta_id} (importação {importacao_id}): {e}")
+            if self._atualizar(importacao_id, reclamacao, status='falhou', mensagem_erro=str(e), concluir=True):
+                self._remover_ficheiro(caminho)
+            return
+        finally:
+            terminou.set()
+            if conn: conn.close()
+
+        with self._lock:
+            self._stats['concluidas'] += 1
+        self._remover_ficheiro(caminho)
+
+    def _remover_ficheiro(self, caminho):
+        try:
+            os.remove(caminho)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Erro ao remover ficheiro de importação {caminho}: {e}")
+
+    def recuperar_paradas(self, pendente_ha_segundos=60):
+        """
+        Resubmete tarefas que ficaram por fazer (worker reiniciado a meio): as
+        pendentes há mais de `pendente_ha_segundos` e as em curso sem progresso
+        há mais de `expira_apos`. A reclamação em _processar evita repetições.
+        """
+        conn = None
+        try:
+            conn = obter_conexao_isolada()
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT id FROM importacoes
+                    WHERE (status = 'pendente' AND atualizado_em < NOW() - make_interval(secs => %s))
+                       OR (status = 'em_curso' AND atualizado_em < NOW() - make_interval(secs => %s))
+                    ORDER BY id
+                    LIMIT 100
+                    """,
+                    (pendente_ha_segundos, self.expira_apos)
+                )
+                paradas = [linha[0] for linha in cur.fetchall()]
+            conn.commit()
+        except Exception as e:
+            print(f"Erro ao recuperar importações paradas: {e}")
+            return 0
+        finally:
+            if conn: conn.close()
+
+        for importacao_id in paradas:
+            self.submeter(importacao_id)
+        return len(paradas)
+
+    def estatisticas(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def parar(self):
+        self._parado.set()
+        self._executor.shutdown(wait=False)
+
+_executor_importacoes = None
+_executor_importacoes_pid = None
+_executor_importacoes_lock = threading.Lock()
+
+def obter_executor_importacoes():
+    """
+    Retorna o executor de importações deste processo, criando-o na primeira
+    utilização (o que arranca a recuperação periódica das tarefas paradas). É
+    recriado após um fork.
+    """
+    global _executor_importacoes, _executor_importacoes_pid
+    pid = os.getpid()
+    if _executor_importacoes is None or _executor_importacoes_pid != pid:
+        with _executor_importacoes_lock:
+            if _executor_importacoes is None or _executor_importacoes_pid != pid:
+                _executor_importacoes = ExecutorImportacoes(
+                    num_threads=int(os.environ.get('IMPORTACAO_THREADS', 1)),
+                    expira_apos=int(os.environ.get('IMPORTACAO_EXPIRA_APOS', 600)),
+                    intervalo_recuperacao=int(os.environ.get('IMPORTACAO_RECUPERAR_INTERVALO', 60)),
+                )
+                _executor_importacoes_pid = pid
+                atexit.register(_executor_importacoes.parar)
+    return _executor_importacoes
+
+def guardar_upload(ficheiro, nome_seguro):
+    """Grava o ficheiro enviado em IMPORTACAO_PASTA com um nome único. Retorna o caminho."""
+    os.makedirs(IMPORTACAO_PASTA, exist_ok=True)
+    descritor, caminho = tempfile.mkstemp(prefix='importacao_', suffix=f"_{nome_seguro}", dir=IMPORTACAO_PASTA)
+    os.close(descritor)
+    ficheiro.save(caminho)
+    return caminho
+
+def iniciar_executor_importacoes():
+    """Garante que este worker tem o executor (e a recuperação de tarefas paradas) a correr."""
+    obter_executor_importacoes()
+
+def submeter_importacao(importacao_id):
+    """Atalho para submeter uma tarefa já gravada ao executor deste processo."""
+    obter_executor_importacoes().submeter(importacao_id)
+
+def estatisticas_importacoes():
+    """Estatísticas do executor de importações deste worker (vazio se ainda não foi usado)."""
+    if _executor_importacoes is None or _executor_importacoes_pid != os.getpid():
+        return {}
+    return _executor_importacoes.estatisticas()
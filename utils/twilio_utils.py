@@ -3,14 +3,28 @@
 import os
 import json
 from twilio.rest import Client
-from .db_utils import get_db_connection
+from twilio.http.http_client import TwilioHttpClient
+from .cache import CacheTTL, AUSENTE
+from .db_utils import get_db_connection, executar_apos_confirmar
+from .despacho import obter_despachante
+from .envio_lote import obter_envio_de_lote, FalhaEnvioLote
+from .diario_conversas import registar_conversa
+
+# Clientes Twilio já autenticados, por conta. Reutilizar o cliente evita a
+# consulta às credenciais e reaproveita a sessão HTTP (keep-alive) a cada envio.
+_clientes_twilio = CacheTTL('clientes_twilio', ttl=int(os.environ.get('TWILIO_CLIENTE_TTL', 600)))
 
 def _get_twilio_client_for_account(conta_id):
-    """Cria um cliente Twilio com as credenciais da subconta ou principais."""
+    """Retorna o cliente Twilio (em cache) com as credenciais da subconta ou principais."""
+    client = _clientes_twilio.obter(conta_id)
+    if client is not AUSENTE:
+        return client
+
     account_sid_master = os.environ.get('TWILIO_ACCOUNT_SID')
     auth_token_master = os.environ.get('TWILIO_AUTH_TOKEN')
     
     final_sid, final_token = account_sid_master, auth_token_master
+    credenciais_ok = True
 
     if conta_id:
         conn = None
@@ -23,27 +37,31 @@ def _get_twilio_client_for_account(conta_id):
                     final_sid, final_token = creds[0], creds[1]
         except Exception as e:
             print(f"ERRO ao buscar credenciais para conta {conta_id}: {e}.")
+            credenciais_ok = False
         finally:
             if conn: conn.close()
             
     if not all([final_sid, final_token]):
         raise Exception("Credenciais da Twilio não configuradas.")
         
-    return Client(final_sid, final_token)
+    http_client = TwilioHttpClient(pool_connections=True, timeout=float(os.environ.get('TWILIO_TIMEOUT', 15)))
+    client = Client(final_sid, final_token, http_client=http_client)
+    # Se a consulta falhou não guardamos o cliente principal, para tentar de novo no próximo envio.
+    if credenciais_ok:
+        _clientes_twilio.guardar(conta_id, client)
+    return client
+
+def invalidar_cliente_twilio(conta_id):
+    """Descarta o cliente em cache de uma conta (ex.: após alterar as credenciais)."""
+    _clientes_twilio.invalidar(conta_id)
 
-def send_text(to_number, from_number, body, conta_id):
-    """Envia uma mensagem de texto simples."""
+def _send_text_now(to_number, from_number, body, conta_id):
+    """Envia uma mensagem de texto simples imediatamente (levanta exceção em caso de falha)."""
     client = _get_twilio_client_for_account(conta_id)
-    try:
-        client.messages.create(from_=from_number, to=to_number, body=body)
-    except Exception as e:
-        print(f"Erro ao enviar mensagem de texto para conta {conta_id}: {e}")
+    client.messages.create(from_=from_number, to=to_number, body=body)
 
-def send_reply_buttons(to_number, from_number, body, buttons, conta_id):
-    """
-    Envia uma mensagem com até 3 botões de resposta rápida (Quick Reply) de forma livre.
-    `buttons` é uma lista de dicionários: [{'id': 'payload_1', 'title': 'Botão 1'}, ...]
-    """
+def _send_reply_buttons_now(to_number, from_number, body, buttons, conta_id):
+    """Envia imediatamente uma mensagem com botões, recorrendo a texto numerado se falhar."""
     client = _get_twilio_client_for_account(conta_id)
     
     # Monta a estrutura de ações para os botões
@@ -62,10 +80,10 @@ def send_reply_buttons(to_number, from_number, body, buttons, conta_id):
         print(f"ERRO ao enviar botões de resposta para conta {conta_id}: {e}")
         # Lógica de fallback se o envio interativo falhar
         fallback_text = f"{body}\n\n" + "\n".join([f"*{i+1}* - {btn['title']}" for i, btn in enumerate(buttons)]) + "\n\n_Responda com o número da opção desejada._"
-        send_text(to_number, from_number, fallback_text, conta_id)
+        _send_text_now(to_number, from_number, fallback_text, conta_id)
 
-def send_list_picker(to_number, from_number, body, button_text, sections, conta_id):
-    """Envia uma mensagem com uma lista de opções (List Picker) de forma livre."""
+def _send_list_picker_now(to_number, from_number, body, button_text, sections, conta_id):
+    """Envia imediatamente uma lista de opções, recorrendo a texto se falhar."""
     client = _get_twilio_client_for_account(conta_id)
 
     # Monta a estrutura completa para a mensagem de lista
@@ -82,7 +100,81 @@ def send_list_picker(to_number, from_number, body, button_text, sections, conta_
     except Exception as e:
         print(f"ERRO ao enviar lista de opções para conta {conta_id}: {e}")
         fallback_text = f"{body}\n\n" + "\n".join([f"*{sec['title']}*\n" + "\n".join([f"- {row['title']}" for row in sec['rows']]) for sec in sections])
-        send_text(to_number, from_number, fallback_text, conta_id)
+        _send_text_now(to_number, from_number, fallback_text, conta_id)
 
+def _executar_envio(envio):
+    """Executa um envio enfileirado pelo despachante."""
+    if envio['tipo'] == 'text':
+        _send_text_now(envio['para'], envio['de'], envio['body'], envio['conta_id'])
+    elif envio['tipo'] == 'buttons':
+        _send_reply_buttons_now(envio['para'], envio['de'], envio['body'], envio['buttons'], envio['conta_id'])
+    elif envio['tipo'] == 'list':
+        _send_list_picker_now(envio['para'], envio['de'], envio['body'], envio['button_text'], envio['sections'], envio['conta_id'])
+    elif envio['tipo'] == 'lote':
+        mensagens = [dict(mensagem, conta_id=envio['conta_id'], para=envio['para'], de=envio['de']) for mensagem in envio['mensagens']]
+        try:
+            obter_envio_de_lote().enviar(mensagens, _executar_envio, vista=envio.get('vista', 'lote'), inicio_em=envio.get('enviadas', 0))
+        except FalhaEnvioLote as e:
+            # A nova tentativa do despachante recomeça na mensagem que falhou.
+            envio['enviadas'] = e.enviadas
+            raise
+    else:
+        raise ValueError(f"Tipo de envio desconhecido: {envio['tipo']}")
 
-                                                                         
+    # Só chega aqui se o envio não falhou; o lote regista cada mensagem individualmente.
+    if envio['tipo'] != 'lote' and envio.get('registar', True):
+        registar_conversa(envio['conta_id'], envio['para'], resposta_bot=envio['body'], lido=True)
+
+def _despachar(envio):
+    """
+    Entrega o envio ao despachante em segundo plano, só depois do commit do
+    pedido: se o pedido falhar, a reclamação do MessageSid (ver
+    utils/idempotencia.py) é desfeita e a reentrega da Twilio não pode encontrar
+    respostas já enviadas. Fora de um pedido, o envio segue de imediato.
+    """
+    executar_apos_confirmar(lambda: _despachar_agora(envio))
+
+def _despachar_agora(envio):
+    """
+    Entrega o envio ao despachante. Com DESPACHO_ASSINCRONO=0 o envio é feito
+    na hora, como antigamente (útil para depuração).
+    """
+    if os.environ.get('DESPACHO_ASSINCRONO', '1') == '1':
+        obter_despachante(_executar_envio).enfileirar(envio)
+        return
+    try:
+        _executar_envio(envio)
+    except Exception as e:
+        print(f"Erro ao enviar mensagem '{envio['tipo']}' para conta {envio['conta_id']}: {e}")
+
+def iniciar_despacho():
+    """Garante que este worker tem o despachante a correr (com outbox, retoma os envios de workers mortos)."""
+    if os.environ.get('DESPACHO_ASSINCRONO', '1') == '1':
+        obter_despachante(_executar_envio)
+
+def send_text(to_number, from_number, body, conta_id, registar=True):
+    """
+    Envia uma mensagem de texto simples. Com registar=False a mensagem não vai
+    para o diário de conversas (quem chama já a regista à sua maneira).
+    """
+    _despachar({'tipo': 'text', 'conta_id': conta_id, 'para': to_number, 'de': from_number, 'body': body, 'registar': registar})
+
+def send_reply_buttons(to_number, from_number, body, buttons, conta_id):
+    """
+    Envia uma mensagem com até 3 botões de resposta rápida (Quick Reply) de forma livre.
+    `buttons` é uma lista de dicionários: [{'id': 'payload_1', 'title': 'Botão 1'}, ...]
+    """
+    _despachar({'tipo': 'buttons', 'conta_id': conta_id, 'para': to_number, 'de': from_number, 'body': body, 'buttons': buttons})
+
+def send_list_picker(to_number, from_number, body, button_text, sections, conta_id):
+    """Envia uma mensagem com uma lista de opções (List Picker) de forma livre."""
+    _despachar({'tipo': 'list', 'conta_id': conta_id, 'para': to_number, 'de': from_number, 'body': body, 'button_text': button_text, 'sections': sections})
+
+def send_batch(to_number, from_number, mensagens, conta_id, vista='lote'):
+    """
+    Envia várias mensagens de uma vista como um único trabalho (ver
+    utils/envio_lote.py), pela ordem da lista, cada uma depois de a anterior
+    ser aceite. Cada mensagem é um dicionário com 'tipo' ('text', 'buttons' ou
+    'list') e os parâmetros desse tipo.
+    """
+    _despachar({'tipo': 'lote', 'conta_id': conta_id, 'para': to_number, 'de': from_number, 'vista': vista, 'mensagens': mensagens})
@@ -1,8 +1,9 @@
 # Teste-bot-main/utils/view_handlers.py
 
+import os
 from .db_utils import get_bot_config
-from .fluxo_vendas import listar_categorias, listar_produtos_categoria
-from .twilio_utils import send_reply_buttons, send_list_picker, send_text
+from .catalogo import listar_categorias, listar_produtos_categoria
+from .twilio_utils import send_reply_buttons, send_list_picker, send_text, send_batch
 
 def send_initial_view(conta_id, to_number, from_number):
     """Envia a tela inicial com o menu principal."""
@@ -41,7 +42,13 @@ def send_categories_view(conta_id, to_number, from_number):
         conta_id=conta_id
     )
 
-def send_products_from_category_view(conta_id, to_number, from_number, category_name):
+# 'lista': uma lista paginada por toque (custo constante de envios);
+# 'cartoes': uma mensagem com botões por produto (modo antigo).
+CATALOGO_MODO = os.environ.get('CATALOGO_MODO', 'lista')
+# O WhatsApp aceita no máximo 10 linhas por lista; 2 ficam para a navegação.
+ITENS_POR_PAGINA = max(1, min(int(os.environ.get('CATALOGO_ITENS_POR_PAGINA', 8)), 8))
+
+def send_products_from_category_view(conta_id, to_number, from_number, category_name, pagina=0):
     """Envia os produtos de uma categoria específica."""
     produtos = listar_produtos_categoria(conta_id, category_name)
 
@@ -49,22 +56,76 @@ def send_products_from_category_view(conta_id, to_number, from_number, category_
         send_text(to_number, from_number, f"Não encontrei produtos na categoria '{category_name}'.", conta_id)
         return
 
+    if CATALOGO_MODO == 'lista':
+        _send_products_page(conta_id, to_number, from_number, category_name, produtos, pagina)
+    else:
+        _send_products_cards(conta_id, to_number, from_number, category_name, produtos)
+
+def _truncar(texto, limite):
+    return texto if len(texto) <= limite else texto[:limite - 1] + '…'
+
+def _send_products_page(conta_id, to_number, from_number, category_name, produtos, pagina):
+    """
+    Envia uma página de produtos numa única lista de opções. Tocar num produto
+    envia o payload `add_cart_<id>`; as linhas de navegação enviam
+    `catpage_<página>_<categoria>`, tratado pelo webhook.
+    """
+    total_paginas = (len(produtos) + ITENS_POR_PAGINA - 1) // ITENS_POR_PAGINA
+    pagina = max(0, min(pagina, total_paginas - 1))
+    inicio = pagina * ITENS_POR_PAGINA
+
+    rows = [
+        {
+            'id': f"add_cart_{produto.id}",
+            'title': _truncar(produto.nome, 24),
+            'description': _truncar(f"R$ {produto.preco:.2f} · {produto.descricao or 'Sem descrição.'}", 72),
+        }
+        for produto in produtos[inicio:inicio + ITENS_POR_PAGINA]
+    ]
+    sections = [{'title': _truncar(category_name, 24), 'rows': rows}]
+
+    navegacao = []
+    if pagina > 0:
+        navegacao.append({'id': f"catpage_{pagina - 1}_{category_name}", 'title': '⬅️ Página anterior'})
+    if pagina < total_paginas - 1:
+        navegacao.append({'id': f"catpage_{pagina + 1}_{category_name}", 'title': '➡️ Próxima página'})
+    if navegacao:
+        sections.append({'title': 'Navegação', 'rows': navegacao})
+
+    body = f"Produtos de *{category_name}*"
+    if total_paginas > 1:
+        body += f" (página {pagina + 1} de {total_paginas})"
+    body += ".\nToque num produto para adicioná-lo ao carrinho."
+
+    send_list_picker(
+        to_number=to_number,
+        from_number=from_number,
+        body=body,
+        button_text="Ver produtos",
+        sections=sections,
+        conta_id=conta_id
+    )
+
+def _send_products_cards(conta_id, to_number, from_number, category_name, produtos):
+    """Envia uma mensagem com botões para cada produto da categoria."""
     # Informa o cliente sobre o que ele vai ver
-    send_text(to_number, from_number, f"Certo, aqui estão os produtos de *{category_name}*:", conta_id)
+    mensagens = [{'tipo': 'text', 'body': f"Certo, aqui estão os produtos de *{category_name}*:"}]
 
-    # Envia uma mensagem para cada produto
+    # Uma mensagem para cada produto, entregues pela ordem da lista (ver utils/envio_lote.py)
     for produto in produtos:
         # Futuramente, aqui podemos adicionar uma imagem com `send_media_message`
-        product_text = f"*{produto['nome']}*\n"
-        product_text += f"_{produto.get('descricao', 'Sem descrição.')}_\n\n"
-        product_text += f"Preço: R$ {float(produto['preco']):.2f}"
+        product_text = f"*{produto.nome}*\n"
+        product_text += f"_{produto.descricao or 'Sem descrição.'}_\n\n"
+        product_text += f"Preço: R$ {produto.preco:.2f}"
         
         buttons = [
-            {'id': f"add_cart_{produto['id']}", 'title': '🛒 Adicionar'},
-            {'id': f"more_details_{produto['id']}", 'title': '+ Detalhes'}
+            {'id': f"add_cart_{produto.id}", 'title': '🛒 Adicionar'},
+            {'id': f"more_details_{produto.id}", 'title': '+ Detalhes'}
         ]
         
-        send_reply_buttons(to_number, from_number, product_text, buttons, conta_id)
+        mensagens.append({'tipo': 'buttons', 'body': product_text, 'buttons': buttons})
+
+    send_batch(to_number, from_number, mensagens, conta_id, vista='produtos_categoria')
 
 def send_talk_to_human_view(conta_id, to_number, from_number):
     """Informa o cliente que um atendente entrará em contato."""